@@ -0,0 +1,136 @@
+import hashlib
+import threading
+import weakref
+
+try:
+  from binaryninja import BinaryDataNotification
+except ImportError:
+  # headless replay, nothing ever changes underneath it
+  BinaryDataNotification = object
+
+from handler_cache import function_identity
+from instrumentation import TRACE, instruments
+
+# results of slicing, lifting and compiling for the life of a session, keyed
+# by function and that function's analysis generation. a function's
+# generation only moves on when its code actually changed: updates are
+# collected while binary ninja analyses and checked once analysis completes,
+# so tagging or commenting a handler (which also counts as an update) doesn't
+# throw its results away, patching or redefining it does
+#
+# anything depending on memory outside the function (evaluation against the
+# bytecode) isn't kept here, that's what memory_model's invalidation is for
+
+def code_fingerprint(func):
+  # what the function's il is built from: its bytes and where its blocks are
+  return hashlib.sha256(function_identity(func)).hexdigest()
+
+class AnalysisSession(object):
+  def __init__(self, view):
+    self.view = view
+    self.generations = {}
+    self.fingerprints = {}
+    # (function start, generation) -> {kind: result}
+    self.results = {}
+    self.dirty = set()
+    self.waiting = False
+    # called with each function whose results were dropped
+    self.listeners = []
+    self.hits = 0
+    self.misses = 0
+    # notifications arrive on binary ninja's analysis threads while the ui or
+    # identify_all_handlers reads results, compute runs outside it
+    self.lock = threading.RLock()
+
+  def generation(self, func):
+    return self.generations.get(func.start, 0)
+
+  def get(self, func, kind, compute):
+    # kind is any hashable naming the result, compute makes it on a miss
+    with self.lock:
+      key = (func.start, self.generation(func))
+      results = self.results.get(key)
+      if results is None:
+        results = self.results[key] = {}
+        self.fingerprints[func.start] = code_fingerprint(func)
+      if kind in results:
+        self.hits += 1
+        instruments.count("session_hits")
+        return results[kind]
+      self.misses += 1
+    instruments.count("session_misses")
+    result = compute()
+    with self.lock:
+      # the function may have changed while computing, then results is no
+      # longer in self.results and this goes nowhere. two threads computing
+      # the same kind both get the first one stored
+      return results.setdefault(kind, result)
+
+  def function_changed(self, func):
+    # checked once analysis settles, see analysis_completed
+    with self.lock:
+      if func.start not in self.fingerprints:
+        return
+      self.dirty.add(func.start)
+      if self.waiting:
+        return
+      if hasattr(self.view, "add_analysis_completion_event"):
+        self.waiting = True
+        self.view.add_analysis_completion_event(self.analysis_completed)
+      else:
+        self.analysis_completed()
+
+  def analysis_completed(self):
+    with self.lock:
+      self.waiting = False
+      dirty = self.dirty
+      self.dirty = set()
+      for start in dirty:
+        func = self.view.get_function_at(start)
+        if func is None:
+          self.invalidate_start(start, None)
+        elif code_fingerprint(func) != self.fingerprints.get(start):
+          self.invalidate_start(start, func)
+
+  def invalidate(self, func):
+    self.invalidate_start(func.start, func)
+
+  def invalidate_start(self, start, func):
+    instruments.trace(TRACE, "Analysis results for %s are stale", hex(start))
+    with self.lock:
+      self.results.pop((start, self.generations.get(start, 0)), None)
+      self.fingerprints.pop(start, None)
+      self.generations[start] = self.generations.get(start, 0) + 1
+      for listener in self.listeners:
+        listener(start, func)
+
+  def stats(self):
+    with self.lock:
+      return {"hits": self.hits, "misses": self.misses, "functions": len(self.results)}
+
+class AnalysisSessionNotification(BinaryDataNotification):
+  def __init__(self, session):
+    BinaryDataNotification.__init__(self)
+    self.session = session
+
+  def function_updated(self, view, func):
+    self.session.function_changed(func)
+
+  def function_removed(self, view, func):
+    self.session.invalidate(func)
+
+# a closed view's session goes with it, the session only holds a proxy so
+# it doesn't keep its own key alive
+sessions = weakref.WeakKeyDictionary()
+sessions_lock = threading.Lock()
+
+def get_analysis_session(view):
+  session = sessions.get(view)
+  if session is None:
+    with sessions_lock:
+      session = sessions.get(view)
+      if session is None:
+        session = AnalysisSession(weakref.proxy(view))
+        view.register_notification(AnalysisSessionNotification(session))
+        sessions[view] = session
+  return session
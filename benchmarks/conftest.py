@@ -0,0 +1,13 @@
+import os
+import sys
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIRECTORY)
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIRECTORY))
+
+import fake_binaryninja
+fake_binaryninja.install()
+
+import fixtures
+
+cold_caches = fixtures.cold_caches
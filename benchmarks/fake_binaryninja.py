@@ -0,0 +1,260 @@
+# pure python stand in for the parts of the binaryninja api the scripts use,
+# enough to slice, lift and evaluate synthetic functions without a licence.
+# install() puts it in sys.modules before identify_handler is imported
+import sys
+import tempfile
+
+def log_info(message):
+  pass
+
+def log_warn(message):
+  pass
+
+def user_directory():
+  return tempfile.gettempdir()
+
+class ILRegister(object):
+  def __init__(self, name):
+    self.name = name
+
+  def __eq__(self, other):
+    return isinstance(other, ILRegister) and other.name == self.name
+
+  def __hash__(self):
+    return hash(self.name)
+
+  def __repr__(self):
+    return self.name
+
+class SSARegister(object):
+  def __init__(self, reg, version):
+    self.reg = reg if isinstance(reg, ILRegister) else ILRegister(reg)
+    self.version = version
+
+  def __eq__(self, other):
+    return isinstance(other, SSARegister) and other.reg == self.reg and other.version == self.version
+
+  def __hash__(self):
+    return hash((self.reg, self.version))
+
+  def __repr__(self):
+    return "<ssa %s version %d>" % (self.reg, self.version)
+
+class ILFlag(object):
+  def __init__(self, name):
+    self.name = name
+
+  def __repr__(self):
+    return self.name
+
+class SSAFlag(object):
+  def __init__(self, flag, version):
+    self.flag = flag if isinstance(flag, ILFlag) else ILFlag(flag)
+    self.version = version
+
+  def __repr__(self):
+    return "<ssa flag %s version %d>" % (self.flag, self.version)
+
+class SSARegisterOrFlag(object):
+  def __init__(self, reg_or_flag, version):
+    self.reg_or_flag = reg_or_flag if isinstance(reg_or_flag, ILRegister) else ILRegister(reg_or_flag)
+    self.version = version
+
+class ILIntrinsic(object):
+  def __init__(self, name):
+    self.name = name
+
+class LowLevelILOperation(object):
+  def __init__(self, name):
+    self.name = name
+
+  def __repr__(self):
+    return "<LowLevelILOperation.%s>" % self.name
+
+class LowLevelILInstruction(object):
+  OPERATION = None
+  FIELDS = ()
+
+  def __init__(self, size, *operands):
+    if len(operands) != len(self.FIELDS):
+      raise Exception("%s takes %s" % (type(self).__name__, self.FIELDS))
+    self.size = size
+    for field, operand in zip(self.FIELDS, operands):
+      setattr(self, field, operand)
+    self.operation = LowLevelILOperation(self.OPERATION)
+    self.instr_index = None
+    self.function = None
+
+  @property
+  def operands(self):
+    return [getattr(self, x) for x in self.FIELDS]
+
+  def __repr__(self):
+    return "%s(%s)" % (self.OPERATION, ", ".join(repr(x) for x in self.operands))
+
+def instruction_class(name, operation, fields):
+  return type(name, (LowLevelILInstruction,), {"OPERATION": operation, "FIELDS": fields})
+
+LowLevelILAdd = instruction_class("LowLevelILAdd", "LLIL_ADD", ("left", "right"))
+LowLevelILSub = instruction_class("LowLevelILSub", "LLIL_SUB", ("left", "right"))
+LowLevelILAnd = instruction_class("LowLevelILAnd", "LLIL_AND", ("left", "right"))
+LowLevelILOr = instruction_class("LowLevelILOr", "LLIL_OR", ("left", "right"))
+LowLevelILXor = instruction_class("LowLevelILXor", "LLIL_XOR", ("left", "right"))
+LowLevelILLsl = instruction_class("LowLevelILLsl", "LLIL_LSL", ("left", "right"))
+LowLevelILLsr = instruction_class("LowLevelILLsr", "LLIL_LSR", ("left", "right"))
+LowLevelILRol = instruction_class("LowLevelILRol", "LLIL_ROL", ("left", "right"))
+LowLevelILRor = instruction_class("LowLevelILRor", "LLIL_ROR", ("left", "right"))
+LowLevelILZx = instruction_class("LowLevelILZx", "LLIL_ZX", ("src",))
+LowLevelILSx = instruction_class("LowLevelILSx", "LLIL_SX", ("src",))
+LowLevelILNot = instruction_class("LowLevelILNot", "LLIL_NOT", ("src",))
+LowLevelILNeg = instruction_class("LowLevelILNeg", "LLIL_NEG", ("src",))
+LowLevelILConst = instruction_class("LowLevelILConst", "LLIL_CONST", ("constant",))
+LowLevelILRegSsa = instruction_class("LowLevelILRegSsa", "LLIL_REG_SSA", ("src",))
+LowLevelILRegSsaPartial = instruction_class("LowLevelILRegSsaPartial", "LLIL_REG_SSA_PARTIAL", ("full_reg", "src"))
+LowLevelILLoadSsa = instruction_class("LowLevelILLoadSsa", "LLIL_LOAD_SSA", ("src", "src_memory"))
+LowLevelILFlagSsa = instruction_class("LowLevelILFlagSsa", "LLIL_FLAG_SSA", ("src",))
+LowLevelILFlagBitSsa = instruction_class("LowLevelILFlagBitSsa", "LLIL_FLAG_BIT_SSA", ("src", "bit"))
+LowLevelILSetFlagSsa = instruction_class("LowLevelILSetFlagSsa", "LLIL_SET_FLAG_SSA", ("dest", "src"))
+LowLevelILFlagPhi = instruction_class("LowLevelILFlagPhi", "LLIL_FLAG_PHI", ("dest", "src"))
+LowLevelILSetRegSsa = instruction_class("LowLevelILSetRegSsa", "LLIL_SET_REG_SSA", ("dest", "src"))
+LowLevelILSetRegSsaPartial = instruction_class("LowLevelILSetRegSsaPartial", "LLIL_SET_REG_SSA_PARTIAL", ("full_reg", "dest", "src"))
+LowLevelILStoreSsa = instruction_class("LowLevelILStoreSsa", "LLIL_STORE_SSA", ("dest", "dest_memory", "src_memory", "src"))
+LowLevelILIntrinsicSsa = instruction_class("LowLevelILIntrinsicSsa", "LLIL_INTRINSIC_SSA", ("output", "intrinsic", "param"))
+LowLevelILCallParamSsa = instruction_class("LowLevelILCallParamSsa", "LLIL_CALL_PARAM_SSA", ("src",))
+LowLevelILRegPhi = instruction_class("LowLevelILRegPhi", "LLIL_REG_PHI", ("dest", "src"))
+LowLevelILJump = instruction_class("LowLevelILJump", "LLIL_JUMP", ("dest",))
+LowLevelILIf = instruction_class("LowLevelILIf", "LLIL_IF", ("condition", "true", "false"))
+LowLevelILRet = instruction_class("LowLevelILRet", "LLIL_RET", ("dest",))
+
+class LowLevelILFunction(object):
+  # already in ssa form, ssa_form returns itself
+  def __init__(self, instructions, source_function=None):
+    self.instructions = list(instructions)
+    self.source_function = source_function
+    self.ssa_form = self
+    for instr_index, instruction in enumerate(self.instructions):
+      instruction.instr_index = instr_index
+      instruction.function = self
+
+  @property
+  def ssa_registers(self):
+    registers = set()
+    stack = list(self.instructions)
+    while stack:
+      value = stack.pop()
+      if isinstance(value, SSARegister):
+        registers.add(value)
+      elif isinstance(value, SSARegisterOrFlag):
+        registers.add(SSARegister(value.reg_or_flag, value.version))
+      elif isinstance(value, LowLevelILInstruction):
+        stack += value.operands
+      elif isinstance(value, list):
+        stack += value
+    return list(registers)
+
+  def get_ssa_reg_definition(self, register):
+    for instruction in self.instructions:
+      if isinstance(instruction, LowLevelILSetRegSsa) and instruction.dest == register:
+        return instruction
+      if isinstance(instruction, LowLevelILSetRegSsaPartial) and instruction.full_reg == register:
+        return instruction
+    return None
+
+  def __getitem__(self, instr_index):
+    return self.instructions[instr_index]
+
+  def __len__(self):
+    return len(self.instructions)
+
+class BasicBlock(object):
+  def __init__(self, start, length):
+    self.start = start
+    self.length = length
+    self.end = start + length
+
+class Function(object):
+  # the whole function is one basic block whose bytes are the repr of its
+  # llil, so different synthetic functions get different cache keys
+  def __init__(self, view, start, instructions, name=None):
+    self.view = view
+    self.start = start
+    self.name = name or "sub_%x" % start
+    self.llil = LowLevelILFunction(instructions, self)
+    self.code = repr(self.llil.instructions).encode()
+    self.basic_blocks = [BasicBlock(start, len(self.code))]
+    self.tags = []
+    self.comment = ""
+    view.add_function(self)
+
+  def add_tag(self, tag_type, data):
+    self.tags.append((tag_type, data))
+
+  def __repr__(self):
+    return "<func: %s@%s>" % (self.name, hex(self.start))
+
+class Segment(object):
+  def __init__(self, start, end):
+    self.start = start
+    self.end = end
+    self.data_length = end - start
+    self.data_offset = 0
+
+class BinaryView(object):
+  # function code reads back as the function's bytes, every other address
+  # reads from a repeating pattern so any computed address can be loaded
+  def __init__(self, seed=0):
+    self.pattern = bytes((x * 167 + seed * 13 + 89) & 0xFF for x in range(256))
+    self.functions = []
+    self.notifications = []
+    self.tag_types = {}
+    self.segments = [Segment(0, 0x100000000)]
+
+  def add_function(self, func):
+    self.functions.append(func)
+
+  def read(self, address, length):
+    for func in self.functions:
+      if func.start <= address < func.start + len(func.code):
+        offset = address - func.start
+        return func.code[offset:offset + length]
+    start = address % len(self.pattern)
+    repeats = (start + length) // len(self.pattern) + 1
+    return (self.pattern * repeats)[start:start + length]
+
+  def read_int(self, address, size, sign=True):
+    value = int.from_bytes(self.read(address, size), "little")
+    if sign and value >= 1 << (size * 8 - 1):
+      value -= 1 << (size * 8)
+    return value
+
+  def get_functions_containing(self, address):
+    return [x for x in self.functions if x.start <= address < x.start + len(x.code)]
+
+  def get_function_at(self, address):
+    for func in self.functions:
+      if func.start == address:
+        return func
+    return None
+
+  def register_notification(self, notification):
+    self.notifications.append(notification)
+
+  def create_tag_type(self, name, icon):
+    self.tag_types[name] = icon
+
+class BinaryDataNotification(object):
+  def __init__(self, *args, **kwargs):
+    pass
+
+class BackgroundTask(object):
+  def __init__(self, initial_progress_text="", can_cancel=False):
+    self.progress = initial_progress_text
+    self.can_cancel = can_cancel
+    self.cancelled = False
+    self.finished = False
+
+  def finish(self):
+    self.finished = True
+
+def install():
+  sys.modules["binaryninja"] = sys.modules[__name__]
@@ -0,0 +1,18 @@
+# fixtures shared by tests/ and benchmarks/, both conftests import them after
+# installing fake_binaryninja
+import pytest
+
+import analysis_session
+import identify_handler
+from handler_cache import HandlerCache
+
+@pytest.fixture
+def cold_caches():
+  # nothing cached on disk, in a session or as compiled code carries over
+  # between tests
+  identify_handler.handler_cache = HandlerCache(":memory:")
+  identify_handler.compiled_slices.clear()
+  analysis_session.sessions.clear()
+  yield
+  identify_handler.handler_cache.close()
+  identify_handler.handler_cache = None
@@ -0,0 +1,130 @@
+# generates vmprotect style handlers and vmenter blocks in fake llil ssa form
+#
+# size is the length of the decrypt chain, junk is the chance of a dead
+# assignment (to a register nothing reads) going in after each real one
+import random
+
+from fake_binaryninja import (
+  Function,
+  LowLevelILAdd,
+  LowLevelILConst,
+  LowLevelILJump,
+  LowLevelILLoadSsa,
+  LowLevelILNeg,
+  LowLevelILNot,
+  LowLevelILRegSsa,
+  LowLevelILRol,
+  LowLevelILRor,
+  LowLevelILSetRegSsa,
+  LowLevelILStoreSsa,
+  LowLevelILSub,
+  LowLevelILXor,
+  SSARegister,
+)
+
+JUNK_REGISTERS = ["ecx", "edx"]
+
+class SsaBuilder(object):
+  # hands out ssa versions and collects instructions
+  def __init__(self, seed, junk):
+    self.random = random.Random(seed)
+    self.junk = junk
+    self.versions = {}
+    self.instructions = []
+
+  def register(self, name):
+    return LowLevelILRegSsa(4, SSARegister(name, self.versions.get(name, 0)))
+
+  def const(self, value):
+    return LowLevelILConst(4, value & 0xFFFFFFFF)
+
+  def load(self, address):
+    return LowLevelILLoadSsa(4, address, 0)
+
+  def set(self, name, source):
+    version = self.versions.get(name, 0) + 1
+    self.versions[name] = version
+    self.instructions.append(LowLevelILSetRegSsa(4, SSARegister(name, version), source))
+    if self.random.random() < self.junk:
+      self.add_junk()
+
+  def store(self, address, source):
+    self.instructions.append(LowLevelILStoreSsa(4, address, 1, 0, source))
+
+  def add_junk(self):
+    name = self.random.choice(JUNK_REGISTERS)
+    source = self.decrypt_step(self.register(name))
+    version = self.versions.get(name, 0) + 1
+    self.versions[name] = version
+    self.instructions.append(LowLevelILSetRegSsa(4, SSARegister(name, version), source))
+
+  def decrypt_step(self, operand):
+    kind = self.random.randrange(7)
+    if kind == 0:
+      return LowLevelILXor(4, operand, self.const(self.random.getrandbits(32)))
+    elif kind == 1:
+      return LowLevelILAdd(4, operand, self.const(self.random.getrandbits(32)))
+    elif kind == 2:
+      return LowLevelILSub(4, operand, self.const(self.random.getrandbits(32)))
+    elif kind == 3:
+      return LowLevelILRol(4, operand, self.const(self.random.randrange(1, 32)))
+    elif kind == 4:
+      return LowLevelILRor(4, operand, self.const(self.random.randrange(1, 32)))
+    elif kind == 5:
+      return LowLevelILNot(4, operand)
+    return LowLevelILNeg(4, operand)
+
+  def decrypt_chain(self, name, size):
+    for _ in range(size):
+      self.set(name, self.decrypt_step(self.register(name)))
+
+def vmenter_instructions(size, junk=0.0, seed=0):
+  # makes room for the registers and flags a vmenter pushes, reads the
+  # bytecode key from above them and the return address at [esp+0x28],
+  # decrypts it into esi and sets up edi/ebp/esp/ebx the way evaluate_vmenter
+  # expects
+  builder = SsaBuilder(seed, junk)
+  builder.set("esp", LowLevelILSub(4, builder.register("esp"), builder.const(0x24)))
+  esp = builder.register("esp")
+  builder.set("esi", builder.load(LowLevelILAdd(4, esp, builder.const(0x28))))
+  builder.decrypt_chain("esi", size)
+  builder.set("ebx", builder.register("esi"))
+  builder.set("ebp", esp)
+  builder.set("esp", LowLevelILSub(4, esp, builder.const(0xC0)))
+  builder.set("eax", builder.load(builder.register("esi")))
+  builder.decrypt_chain("eax", size)
+  builder.set("edi", LowLevelILNot(4, builder.register("eax")))
+  builder.set("esi", LowLevelILAdd(4, builder.register("esi"), builder.const(4)))
+  builder.store(builder.register("ebp"), builder.register("ebx"))
+  builder.instructions.append(LowLevelILJump(4, builder.register("edi")))
+  return builder.instructions
+
+def handler_instructions(size, junk=0.0, seed=0):
+  # vadd style: pops two values off the vm stack at ebp, decrypts the
+  # sum and writes it over the second, then steps the bytecode pointer and
+  # dispatches
+  builder = SsaBuilder(seed, junk)
+  ebp = builder.register("ebp")
+  builder.set("eax", builder.load(ebp))
+  builder.set("ebx", builder.load(LowLevelILAdd(4, ebp, builder.const(4))))
+  builder.set("eax", LowLevelILAdd(4, builder.register("eax"), builder.register("ebx")))
+  builder.decrypt_chain("eax", size)
+  builder.set("ebp", LowLevelILAdd(4, ebp, builder.const(4)))
+  builder.store(builder.register("ebp"), builder.register("eax"))
+  builder.set("esi", LowLevelILAdd(4, builder.register("esi"), builder.const(1)))
+  builder.instructions.append(LowLevelILJump(4, builder.register("edi")))
+  return builder.instructions
+
+def expression(size, seed=0):
+  # one nested expression tree of depth size, for lifting on its own
+  builder = SsaBuilder(seed, 0.0)
+  value = builder.register("esi")
+  for _ in range(size):
+    value = builder.decrypt_step(value)
+  return value
+
+def make_vmenter(view, start, size, junk=0.0, seed=0):
+  return Function(view, start, vmenter_instructions(size, junk, seed), "vmenter_%x" % start)
+
+def make_handler(view, start, size, junk=0.0, seed=0):
+  return Function(view, start, handler_instructions(size, junk, seed), "handler_%x" % start)
@@ -0,0 +1,92 @@
+# throughput of lifting, slicing and evaluation on synthetic handlers
+#
+#   python -m pytest benchmarks --benchmark-autosave
+#   python -m pytest benchmarks --benchmark-compare
+#
+# saved runs go in .benchmarks/ and can be compared across commits
+import pytest
+
+import identify_handler
+from fake_binaryninja import BinaryView
+from synthetic import expression, make_handler, make_vmenter
+
+SIZES = [16, 256]
+JUNK = [0.0, 0.5]
+
+KEYS = [0x1000, 0x2000, 0x3000, 0x4000]
+
+@pytest.mark.parametrize("size", SIZES)
+def test_resolve_source(benchmark, size):
+  source = expression(size)
+  benchmark(identify_handler.resolve_source, source)
+
+@pytest.mark.parametrize("junk", JUNK)
+@pytest.mark.parametrize("size", SIZES)
+def test_find_all_dependent_registers(benchmark, size, junk):
+  func = make_handler(BinaryView(), 0x401000, size, junk)
+  store = identify_handler.find_store_instructions(identify_handler.function_index(func))[0]
+  benchmark(identify_handler.find_all_dependent_registers, func, store)
+
+@pytest.mark.parametrize("junk", JUNK)
+@pytest.mark.parametrize("size", SIZES)
+def test_evaluate_value(benchmark, cold_caches, size, junk):
+  func = make_vmenter(BinaryView(), 0x401000, size, junk)
+  assignments, entries = identify_handler.find_all_dependent_registers_from_register_names(func, identify_handler.VMENTER_REGISTERS)
+  esp = identify_handler.AstNodeRegisterSsa("esp", 0)
+  assignments_by_register = {x.dest: x for x in assignments} | {
+    "key": KEYS[0],
+    esp: identify_handler.AstNodeAssignment(esp, identify_handler.AstNodeConstant(0xFFFF0000)),
+  }
+  read_mem = identify_handler.get_view_memory(func.view).read_int
+  def evaluate():
+    context = identify_handler.EvaluationContext(assignments_by_register, read_mem)
+    return [identify_handler.evaluate_value(entries[x], assignments_by_register, context) for x in identify_handler.VMENTER_REGISTERS]
+  benchmark(evaluate)
+
+@pytest.mark.parametrize("junk", JUNK)
+@pytest.mark.parametrize("size", SIZES)
+def test_evaluate_compact_slice(benchmark, cold_caches, size, junk):
+  # the same slice as test_evaluate_value, evaluated from the array form
+  func = make_vmenter(BinaryView(), 0x401000, size, junk)
+  initial_registers = identify_handler.vmenter_initial_registers(4, KEYS[0])
+  expected = identify_handler.get_final_values(func, identify_handler.VMENTER_REGISTERS, initial_registers)
+  compact = identify_handler.find_all_dependent_registers_from_register_names(func, identify_handler.VMENTER_REGISTERS, compact=True)
+  read_mem = identify_handler.get_view_memory(func.view).read_int
+  assert identify_handler.evaluate_compact_slice(compact, initial_registers, read_mem) == expected
+  benchmark(identify_handler.evaluate_compact_slice, compact, initial_registers, read_mem)
+
+@pytest.mark.parametrize("junk", JUNK)
+@pytest.mark.parametrize("size", SIZES)
+def test_evaluate_vmenter(benchmark, cold_caches, size, junk):
+  # steady state, the slice is compiled on the first call
+  func = make_vmenter(BinaryView(), 0x401000, size, junk)
+  identify_handler.evaluate_vmenter(func, KEYS[0])
+  benchmark(lambda: [identify_handler.evaluate_vmenter(func, x) for x in KEYS])
+
+@pytest.mark.parametrize("junk", JUNK)
+@pytest.mark.parametrize("size", SIZES)
+def test_evaluate_vmenter_batch(benchmark, cold_caches, size, junk):
+  # same keys as test_evaluate_vmenter in one call
+  func = make_vmenter(BinaryView(), 0x401000, size, junk)
+  assert identify_handler.evaluate_vmenter_batch(func, KEYS) == [identify_handler.evaluate_vmenter(func, x) for x in KEYS]
+  benchmark(identify_handler.evaluate_vmenter_batch, func, KEYS)
+
+@pytest.mark.parametrize("size", SIZES)
+def test_evaluate_vmenter_cold(benchmark, cold_caches, size):
+  # slicing, lifting, simplifying and compiling from scratch every round
+  def setup():
+    func = make_vmenter(BinaryView(), 0x401000, size, 0.5)
+    identify_handler.handler_cache.clear()
+    identify_handler.compiled_slices.clear()
+    return (func, KEYS[0]), {}
+  benchmark.pedantic(identify_handler.evaluate_vmenter, setup=setup, rounds=10)
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("junk", JUNK)
+def test_classify_handler(benchmark, cold_caches, size, junk):
+  # fingerprinting and index lookup on an already sliced handler
+  func = make_handler(BinaryView(), 0x402000, size, junk)
+  result = identify_handler.process_snapshot(identify_handler.export_function_snapshot(func))
+  assignments, entries = identify_handler.deserialize_assignments(result["assignments"])
+  assert identify_handler.classify_handler(assignments, entries)["type"] == "vadd"
+  benchmark(identify_handler.classify_handler, assignments, entries)
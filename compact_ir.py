@@ -0,0 +1,235 @@
+import array
+import struct
+import sys
+
+from snapshot_file import take
+
+# struct of arrays form of a lifted slice, for whole binary runs where
+# hundreds of thousands of AstNodes would otherwise stay alive. node i is
+# opcodes[i], sizes[i], lhs[i], rhs[i] and values[i] and refers to other
+# nodes by index. nodes are only ever appended after their operands so index
+# order is a valid evaluation order
+#
+#   Constant      values = the constant
+#   RegisterSsa   lhs = index into names, rhs = version,
+#                 values = 1 + index of the defining source, 0 if undefined
+#   Sx            lhs = operand, rhs = operand size
+#   FlagBit       lhs = index into names, values = bit
+#   anything else lhs (and rhs for binary operations) are operands
+#
+# opcode names are the AstNode class names without the prefix, identify_handler
+# maps between the two
+
+OPCODES = [
+  "Constant", "RegisterSsa", "ReadMem", "Zx", "Sx", "Not", "Neg", "FlagBit", "Bswap",
+  "Add", "Sub", "And", "Or", "Xor", "Shl", "Shr", "Rol", "Ror",
+]
+OPCODE_INDEXES = {name: index for index, name in enumerate(OPCODES)}
+
+CONSTANT = OPCODE_INDEXES["Constant"]
+REGISTER = OPCODE_INDEXES["RegisterSsa"]
+SX = OPCODE_INDEXES["Sx"]
+FLAG_BIT = OPCODE_INDEXES["FlagBit"]
+
+NO_NODE = -1
+
+# values are unsigned 64 bit, a constant keeps its low 64 bits
+VALUE_MASK = 0xFFFFFFFFFFFFFFFF
+
+MAGIC = b"VMPC"
+FORMAT_VERSION = 1
+
+#   MAGIC, format version, nodes, names, assignments, stores, entries
+HEADER = struct.Struct("<4sHIIIII")
+LENGTH = struct.Struct("<H")
+
+class CompactSlice(object):
+  def __init__(self):
+    self.opcodes = array.array("B")
+    self.sizes = array.array("B")
+    self.lhs = array.array("i")
+    self.rhs = array.array("i")
+    self.values = array.array("Q")
+    self.names = []
+    # (register node, source node) in dependency order
+    self.assignment_dests = array.array("i")
+    self.assignment_srcs = array.array("i")
+    # (address node, value node, size) in program order
+    self.store_dests = array.array("i")
+    self.store_srcs = array.array("i")
+    self.store_sizes = array.array("B")
+    # native register name (or "jump") -> node
+    self.entries = {}
+    # only needed while building, see freeze
+    self.interned = {}
+    self.name_indexes = {}
+
+  def __len__(self):
+    return len(self.opcodes)
+
+  def name_index(self, name):
+    index = self.name_indexes.get(name)
+    if index is None:
+      index = len(self.names)
+      self.names.append(name)
+      self.name_indexes[name] = index
+    return index
+
+  def add(self, opcode, size=0, lhs=NO_NODE, rhs=NO_NODE, value=0):
+    # identical nodes are shared, like interned AstNodes
+    if opcode == CONSTANT:
+      value &= VALUE_MASK
+    key = (opcode, size, lhs, rhs, value)
+    index = self.interned.get(key)
+    if index is None:
+      index = len(self.opcodes)
+      self.opcodes.append(opcode)
+      self.sizes.append(size)
+      self.lhs.append(lhs)
+      self.rhs.append(rhs)
+      self.values.append(value)
+      self.interned[key] = index
+    return index
+
+  def add_register(self, name, version):
+    # registers are interned on name and version alone, define fills in values
+    key = (REGISTER, self.name_index(name), version)
+    index = self.interned.get(key)
+    if index is None:
+      index = self.add(REGISTER, 0, key[1], version)
+      self.interned[key] = index
+    return index
+
+  def define(self, register, source):
+    if self.values[register]:
+      raise Exception("Couldn't define %s twice" % self.describe(register))
+    if source > register:
+      raise Exception("Couldn't define %s, it's used before its definition" % self.describe(register))
+    self.values[register] = source + 1
+    self.assignment_dests.append(register)
+    self.assignment_srcs.append(source)
+
+  def definition(self, register):
+    # index of the source defining register, or None
+    value = self.values[register]
+    if value == 0:
+      return None
+    return value - 1
+
+  def add_store(self, dest, src, size):
+    self.store_dests.append(dest)
+    self.store_srcs.append(src)
+    self.store_sizes.append(size)
+
+  def describe(self, index):
+    if self.opcodes[index] == REGISTER:
+      return "%s#%s" % (self.names[self.lhs[index]], self.rhs[index])
+    return "%s node %d" % (OPCODES[self.opcodes[index]], index)
+
+  def freeze(self):
+    # drops the build time dicts, after this the slice can't be added to
+    self.interned = None
+    self.name_indexes = None
+    return self
+
+  def needed(self, roots, replaced=None):
+    # bytearray marking every node roots depend on. operands always come
+    # before their users so one backwards pass is enough. replaced maps a
+    # node to what it needs instead of its operands
+    needed = bytearray(len(self.opcodes))
+    for root in roots:
+      needed[root] = 1
+    opcodes = self.opcodes
+    lhs = self.lhs
+    rhs = self.rhs
+    values = self.values
+    for index in range(len(needed) - 1, -1, -1):
+      if not needed[index]:
+        continue
+      if replaced and index in replaced:
+        for other in replaced[index]:
+          needed[other] = 1
+        continue
+      opcode = opcodes[index]
+      if opcode == CONSTANT:
+        continue
+      if opcode == REGISTER:
+        if values[index]:
+          needed[values[index] - 1] = 1
+        continue
+      if lhs[index] >= 0 and opcode != FLAG_BIT:
+        needed[lhs[index]] = 1
+      if rhs[index] >= 0 and opcode != SX:
+        needed[rhs[index]] = 1
+    return needed
+
+  def arrays(self):
+    return [self.opcodes, self.sizes, self.lhs, self.rhs, self.values,
+      self.assignment_dests, self.assignment_srcs, self.store_dests, self.store_srcs, self.store_sizes]
+
+  def nbytes(self):
+    return sum(len(x) * x.itemsize for x in self.arrays())
+
+  def numpy_arrays(self):
+    # zero copy views, for vectorised passes over the whole slice
+    import numpy
+    return {
+      "opcodes": numpy.frombuffer(self.opcodes, dtype=numpy.uint8),
+      "sizes": numpy.frombuffer(self.sizes, dtype=numpy.uint8),
+      "lhs": numpy.frombuffer(self.lhs, dtype=numpy.int32),
+      "rhs": numpy.frombuffer(self.rhs, dtype=numpy.int32),
+      "values": numpy.frombuffer(self.values, dtype=numpy.uint64),
+    }
+
+  def to_bytes(self):
+    # arrays are written little endian as they are, names and entries as
+    # length prefixed utf-8
+    entries = sorted(self.entries.items())
+    output = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, len(self.opcodes), len(self.names),
+      len(self.assignment_dests), len(self.store_dests), len(entries)))
+    for name in self.names + [name for name, _ in entries]:
+      data = name.encode()
+      output += LENGTH.pack(len(data))
+      output += data
+    output += array_bytes(array.array("i", [index for _, index in entries]))
+    for values in self.arrays():
+      output += array_bytes(values)
+    return bytes(output)
+
+  @classmethod
+  def from_bytes(cls, data):
+    header, offset = take(data, 0, HEADER.size)
+    magic, version, nodes, names, assignments, stores, entries = HEADER.unpack(header)
+    if magic != MAGIC or version != FORMAT_VERSION:
+      raise Exception("Couldn't read compact slice, bad magic or version %s" % version)
+    strings = []
+    for _ in range(names + entries):
+      prefix, offset = take(data, offset, LENGTH.size)
+      length, = LENGTH.unpack(prefix)
+      value, offset = take(data, offset, length)
+      strings.append(bytes(value).decode())
+    compact = cls()
+    compact.names = strings[:names]
+    entry_indexes, offset = read_array(data, offset, "i", entries)
+    compact.entries = dict(zip(strings[names:], entry_indexes))
+    counts = [nodes] * 5 + [assignments] * 2 + [stores] * 3
+    for values, count in zip(compact.arrays(), counts):
+      loaded, offset = read_array(data, offset, values.typecode, count)
+      values.extend(loaded)
+    if offset != len(data):
+      raise Exception("Couldn't read compact slice, %d bytes left over" % (len(data) - offset))
+    return compact.freeze()
+
+def array_bytes(values):
+  if sys.byteorder != "little":
+    values = array.array(values.typecode, values)
+    values.byteswap()
+  return values.tobytes()
+
+def read_array(data, offset, typecode, count):
+  values = array.array(typecode)
+  chunk, end = take(data, offset, count * values.itemsize)
+  values.frombytes(bytes(chunk))
+  if sys.byteorder != "little":
+    values.byteswap()
+  return values, end
@@ -1,6 +1,12 @@
-def resolve_source(source):
-  sizes = {1: "b", 2: "w", 4: "d"}
-  mask_for_size = {1: "0xFF", 2: "0xFFFF", 4: "0xFFFFFFFF"}
+import re
+
+from instrumentation import INFO, TRACE, instruments
+from llil_lifter import LifterBackend, lift_expression
+from ssa_index import get_ssa_index
+
+class StringLifterBackend(LifterBackend):
+  sizes = {1: "b", 2: "w", 4: "d", 8: "q"}
+  mask_for_size = {1: "0xFF", 2: "0xFFFF", 4: "0xFFFFFFFF", 8: "0xFFFFFFFFFFFFFFFF"}
   masks = {
     "al":0x000000FF,
     "bl":0x000000FF,
@@ -25,89 +31,102 @@ def resolve_source(source):
     "ch":">> 8",
     "dh":">> 8",
   }
-  # load up flattened tree
-  sources = [source]
-  todo = []
-  output = []
-  while sources:
-    source = sources.pop()
-    if type(source) in [LowLevelILSub, LowLevelILZx, LowLevelILSx, LowLevelILAnd, LowLevelILXor, LowLevelILOr, LowLevelILNot, LowLevelILLsl, LowLevelILLsr, LowLevelILRol, LowLevelILRor, LowLevelILAdd]:
-      todo.append(source)
-      for operand in source.operands:
-        sources.append(operand)
-    elif type(source) in [LowLevelILLoadSsa]:
-      # operands are [src, src_memory] and src_memory is just an int ref we don't want
-      todo.append(source)
-      sources.append(source.src)
-    elif type(source) in [LowLevelILConst, LowLevelILRegSsa, LowLevelILRegSsaPartial]:
-      todo.append(source)
-    else:
-      raise Exception("Couldn't process instruction %s type %s" % (source, type(source)))
-  # process flattened tree
-  while todo:
-    value = todo.pop()
-    if type(value) == LowLevelILConst:
-      output.append(hex(value.constant))
-    elif type(value) == LowLevelILRegSsa:
-      output.append("%s_%s" % (value.src.reg.name, value.src.version))
-    elif type(value) == LowLevelILRegSsaPartial:
-      result = "(%s & %s_%s)" % (hex(masks[value.src.name]), value.full_reg.reg.name, value.full_reg.version)
-      if value.src.name in shifts:
-        result = "(%s %s)" % (result, shifts[value.src.name])
-      output.append(result)
-    elif type(value) == LowLevelILAdd:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append("(%s + %s)" % (lhs, rhs))
-    elif type(value) == LowLevelILSub:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append("(%s - %s)" % (lhs, rhs))
-    elif type(value) == LowLevelILAnd:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append("(%s & %s)" % (lhs, rhs))
-    elif type(value) == LowLevelILXor:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append("(%s ^ %s)" % (lhs, rhs))
-    elif type(value) == LowLevelILOr:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append("(%s | %s)" % (lhs, rhs))
-    elif type(value) == LowLevelILLsl:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append("(%s << %s)" % (lhs, rhs))
-    elif type(value) == LowLevelILLsr:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append("(%s >> %s)" % (lhs, rhs))
-    elif type(value) == LowLevelILRol:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append("(%s & ((%s << %s) | (%s >> (%d - %s))))" % (mask_for_size[value.size], lhs, rhs, lhs, value.size*8, rhs))
-    elif type(value) == LowLevelILRor:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append("(%s & ((%s >> %s) | (%s << (%d - %s))))" % (mask_for_size[value.size], lhs, rhs, lhs, value.size*8, rhs))
-    elif type(value) == LowLevelILZx:
-      operand = output.pop()
-      output.append("zx(%s, %s)" % (operand, value.size))
-    elif type(value) == LowLevelILSx:
-      operand = output.pop()
-      output.append("sx(%s, %s)" % (operand, value.size))
-    elif type(value) == LowLevelILNot:
-      operand = output.pop()
-      output.append("not(%s, %s)" % (operand, value.size))
-    elif type(value) == LowLevelILLoadSsa:
-      operand = output.pop()
-      output.append("read_mem(%s,%s)" % (operand, value.size))
-    else:
-      raise Exception("Couldn't process %s" % value)
-  if len(output) != 1:
-    raise Exception("expected one result but got %s" % output)
-  return output[0]
+  binary_formats = {
+    "LLIL_ADD": "(%s + %s)",
+    "LLIL_SUB": "(%s - %s)",
+    "LLIL_AND": "(%s & %s)",
+    "LLIL_XOR": "(%s ^ %s)",
+    "LLIL_OR": "(%s | %s)",
+    "LLIL_LSL": "(%s << %s)",
+    "LLIL_LSR": "(%s >> %s)",
+  }
+  unary_formats = {
+    "LLIL_ZX": "zx(%s, %s)",
+    "LLIL_NOT": "not(%s, %s)",
+  }
+
+  def constant(self, value, size):
+    return hex(value)
+
+  def register(self, name, version, size):
+    return "%s_%s" % (name, version)
+
+  def register_partial(self, full_name, version, partial_name, size):
+    result = "(%s & %s_%s)" % (hex(self.masks[partial_name]), full_name, version)
+    if partial_name in self.shifts:
+      result = "(%s %s)" % (result, self.shifts[partial_name])
+    return result
+
+  def load(self, operand, size):
+    return "read_mem(%s,%s)" % (operand, size)
+
+  def unary(self, operation, operand, size):
+    if operation not in self.unary_formats:
+      raise Exception("Couldn't process %s" % operation)
+    return self.unary_formats[operation] % (operand, size)
+
+  def sign_extend(self, operand, size, operand_size):
+    return "sx(%s, %s)" % (operand, size)
+
+  def binary(self, operation, lhs, rhs, size):
+    if operation == "LLIL_ROL":
+      return "(%s & ((%s << %s) | (%s >> (%d - %s))))" % (self.mask_for_size[size], lhs, rhs, lhs, size*8, rhs)
+    elif operation == "LLIL_ROR":
+      return "(%s & ((%s >> %s) | (%s << (%d - %s))))" % (self.mask_for_size[size], lhs, rhs, lhs, size*8, rhs)
+    return self.binary_formats[operation] % (lhs, rhs)
+
+STRING_LIFTER_BACKEND = StringLifterBackend()
+
+ATOM = re.compile(r"^\w+$")
+
+class TemporaryLifterBackend(StringLifterBackend):
+  # names subexpressions instead of repeating them: rotate operands (which
+  # appear twice in the output), anything longer than INLINE_LIMIT and
+  # anything already named. temporaries go out through write as soon as
+  # they're made, so no line is longer than a couple of INLINE_LIMITs and
+  # output grows linearly with the number of llil nodes
+  INLINE_LIMIT = 64
+
+  def __init__(self, write):
+    self.write = write
+    self.temporaries = {}
+
+  def name(self, text):
+    if ATOM.match(text):
+      return text
+    temporary = self.temporaries.get(text)
+    if temporary is None:
+      temporary = "t%d" % len(self.temporaries)
+      self.temporaries[text] = temporary
+      self.write("%s = %s\n" % (temporary, text))
+    return temporary
+
+  def limit(self, text):
+    if len(text) > self.INLINE_LIMIT or text in self.temporaries:
+      return self.name(text)
+    return text
+
+  def register_partial(self, full_name, version, partial_name, size):
+    return self.limit(StringLifterBackend.register_partial(self, full_name, version, partial_name, size))
+
+  def load(self, operand, size):
+    return self.limit(StringLifterBackend.load(self, operand, size))
+
+  def unary(self, operation, operand, size):
+    return self.limit(StringLifterBackend.unary(self, operation, operand, size))
+
+  def sign_extend(self, operand, size, operand_size):
+    return self.limit(StringLifterBackend.sign_extend(self, operand, size, operand_size))
+
+  def binary(self, operation, lhs, rhs, size):
+    if operation in ["LLIL_ROL", "LLIL_ROR"]:
+      lhs = self.name(lhs)
+      rhs = self.name(rhs)
+    return self.limit(StringLifterBackend.binary(self, operation, lhs, rhs, size))
+
+def resolve_source(source):
+  # one expression with nothing named, rotates repeat their operands
+  return lift_expression(source, STRING_LIFTER_BACKEND)[0]
 
 def resolve_dest(dest):
   if type(dest) == SSARegister:
@@ -115,7 +134,8 @@ def resolve_dest(dest):
   else:
     raise Exception("Couldn't resolve destination %s type %s" % (dest, type(dest)))
 
-def resolve_assignment(assignment):
+def lift_assignment(assignment, backend=STRING_LIFTER_BACKEND):
+  # one walk gives the lifted assignment and the registers it depends on
   masks = {
     "al":0x000000FF,
     "bl":0x000000FF,
@@ -159,81 +179,79 @@ def resolve_assignment(assignment):
     "dh":"<< 8",
   }
   if type(assignment) == LowLevelILSetRegSsa:
-    return "%s = %s" % (resolve_dest(assignment.dest), resolve_source(assignment.src))
+    source, registers = lift_expression(assignment.src, backend)
+    return "%s = %s" % (resolve_dest(assignment.dest), source), registers
   elif type(assignment) == LowLevelILSetRegSsaPartial:
+    source, registers = lift_expression(assignment.src, backend)
     previous_version = "%s_%s" % (assignment.full_reg.reg, assignment.full_reg.version - 1)
     output = resolve_dest(assignment.full_reg)
     original = "(%s & %s)" % (hex(inverse_masks[assignment.dest.name]), previous_version)
-    change = "(%s & %s)" % (hex(masks[assignment.dest.name]), resolve_source(assignment.src))
+    change = "(%s & %s)" % (hex(masks[assignment.dest.name]), source)
     full_src = "%s & %s" % (original, change)
     if assignment.dest.name in shifts:
       full_src = "(%s %s)" % (full_src, shifts[assignment.dest.name])
-    return "%s = %s" % (output, full_src)
+    return "%s = %s" % (output, full_src), registers
   else:
     raise Exception("Couldn't resolve assignment %s type %s" % (assignment, type(assignment)))
 
+def resolve_assignment(assignment):
+  # the assignment preceded by any temporaries it needs, one per line
+  lines = []
+  lines.append(lift_assignment(assignment, TemporaryLifterBackend(lines.append))[0])
+  return "".join(lines)
+
 def find_dependent_registers(assignment):
-  if type(assignment) not in [LowLevelILSetRegSsa, LowLevelILSetRegSsaPartial]:
-    raise Exception("Couldn't resolve assignment %s type %s" % (assignment, type(assignment)))
-  # load up flattened tree
-  sources = [assignment.src]
-  todo = []
-  output = []
-  while sources:
-    source = sources.pop()
-    if type(source) in [LowLevelILSub, LowLevelILZx, LowLevelILSx, LowLevelILAnd, LowLevelILXor, LowLevelILOr, LowLevelILNot, LowLevelILLsl, LowLevelILLsr, LowLevelILRol, LowLevelILRor, LowLevelILAdd]:
-      for operand in source.operands:
-        sources.append(operand)
-    elif type(source) in [LowLevelILLoadSsa]:
-      # operands are [src, src_memory] and src_memory is just an int ref we don't want
-      sources.append(source.src)
-    elif type(source) == LowLevelILRegSsa:
-      output.append(source.src)
-    elif type(source) == LowLevelILRegSsaPartial:
-      output.append(source.full_reg)
-    elif type(source) == LowLevelILConst:
-      continue
-    else:
-      raise Exception("Couldn't process instruction %s type %s" % (source, type(source)))
-  return output
+  return lift_assignment(assignment)[1]
+
+def find_all_dependent_registers(func, base_assignment):
+  lines = []
+  write_all_dependent_registers(func, base_assignment, lines.append)
+  return [x.rstrip("\n") for x in lines]
 
-def find_all_dependent_registers(func, llil_ssa, base_assignment):
-  assignments = [base_assignment]
-  output_assignments = []
+def write_all_dependent_registers(func, base_assignment, write):
+  # streams the slice as python source through write (a file's write, say),
+  # temporaries are shared across the whole slice
+  instruments.refresh()
+  index = get_ssa_index(func)
+  backend = TemporaryLifterBackend(write)
+  visited = set()
+  # post-order walk so every definition is written before its users, the
+  # index gives the registers read on the way down and each instruction is
+  # only lifted on the way back up, once what it reads has been written
+  assignments = [(base_assignment, False)]
   while assignments:
-    assignment = assignments.pop()
-    log_info("Analysing assignment %s" % assignment)
-    output_assignments.append(assignment)
-    dependent_registers = find_dependent_registers(assignment)
-    for register in dependent_registers:
-      log_info("Adding dependent register %s" % register)
-      assignment = llil_ssa.get_ssa_reg_definition(register)
-      if assignment:
-        log_info("Defined at: %s" % assignment)
-        assignments.append(assignment)
+    assignment, expanded = assignments.pop()
+    if expanded:
+      write(lift_assignment(assignment, backend)[0] + "\n")
+      continue
+    if assignment.instr_index in visited:
+      continue
+    visited.add(assignment.instr_index)
+    instruments.trace(TRACE, "Analysing assignment %s", assignment)
+    assignments.append((assignment, True))
+    for register in index.get_uses(assignment):
+      instruments.trace(TRACE, "Adding dependent register %s", register)
+      definition = index.get_definition(register)
+      if definition:
+        instruments.trace(TRACE, "Defined at: %s", definition)
+        if definition.instr_index not in visited:
+          assignments.append((definition, False))
       else:
-        log_info("Register %s has no definition, skipping" % register)
-  # convert to pythonesque
-  output_python = []
-  while output_assignments:
-    output_python.append(resolve_assignment(output_assignments.pop()))
-  return output_python
+        instruments.trace(TRACE, "Register %s has no definition, skipping", register)
 
 def find_all_dependent_registers_from_address(address):
   func = bv.get_functions_containing(address)[0]
   base_assignment = func.get_llil_at(address).ssa_form
-  llil_ssa = func.llil.ssa_form
-  return find_all_dependent_registers(func, llil_ssa, base_assignment)
+  return find_all_dependent_registers(func, base_assignment)
 
 def find_all_dependent_registers_from_register_name(func, register_name):
-  llil_ssa = func.llil.ssa_form
-  registers = sorted(filter(lambda x: x.reg.name==register_name, llil_ssa.ssa_registers), key=lambda x: x.version)
-  if not registers:
-    log_info("Register not mentioned %s" % register_name)
+  index = get_ssa_index(func)
+  register = index.get_latest_register(register_name)
+  if not register:
+    instruments.trace(INFO, "Register not mentioned %s", register_name)
     return []
-  register = registers[-1]
-  base_assignment = ls.get_ssa_reg_definition(register)
+  base_assignment = index.get_definition(register)
   if not base_assignment:
-    log_info("Register not defined %s" % register_name)
+    instruments.trace(INFO, "Register not defined %s", register_name)
     return []
-  return find_all_dependent_registers(func, llil_ssa, base_assignment)
+  return find_all_dependent_registers(func, base_assignment)
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+# bump whenever lifting or classification changes so old entries stop matching
+PLUGIN_VERSION = "0.1.7"
+
+def function_bytes(func):
+  blocks = sorted(func.basic_blocks, key=lambda x: x.start)
+  return b"".join(func.view.read(x.start, x.length) for x in blocks)
+
+def function_identity(func):
+  # lifts hold absolute addresses (rip relative operands, return addresses
+  # pushed by calls), so the same bytes somewhere else aren't the same lift
+  blocks = sorted(func.basic_blocks, key=lambda x: x.start)
+  layout = b"%x\0" % func.start + b"".join(b"%x:%x\0" % (x.start, x.length) for x in blocks)
+  return layout + function_bytes(func)
+
+def handler_key(data, kind):
+  digest = hashlib.sha256()
+  digest.update(PLUGIN_VERSION.encode())
+  digest.update(b"\0")
+  digest.update(kind.encode())
+  digest.update(b"\0")
+  digest.update(data)
+  return digest.hexdigest()
+
+class HandlerCache(object):
+  # sqlite backed store of plain json values, least recently used entries are
+  # evicted once the compressed total goes over max_bytes
+  def __init__(self, path, max_bytes=64 * 1024 * 1024):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    # one connection shared by the analysis threads and the ui thread, sqlite
+    # connections aren't safe to use from two threads at once so everything
+    # goes through the lock. put evicts while holding it, hence reentrant
+    self.lock = threading.RLock()
+    self.connection = sqlite3.connect(path, check_same_thread=False)
+    with self.connection:
+      self.connection.execute(
+        "CREATE TABLE IF NOT EXISTS handlers ("
+        "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+
+  def get(self, key):
+    with self.lock:
+      row = self.connection.execute("SELECT value FROM handlers WHERE key = ?", (key,)).fetchone()
+      if row is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      with self.connection:
+        self.connection.execute("UPDATE handlers SET last_used = ? WHERE key = ?", (time.time(), key))
+    return json.loads(zlib.decompress(row[0]))
+
+  def put(self, key, value):
+    blob = zlib.compress(json.dumps(value, separators=(",", ":")).encode())
+    with self.lock:
+      with self.connection:
+        self.connection.execute(
+          "INSERT OR REPLACE INTO handlers (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+          (key, blob, len(blob), time.time()))
+      self.evict()
+
+  def evict(self):
+    with self.lock:
+      total = self.size()
+      if total <= self.max_bytes:
+        return
+      rows = self.connection.execute("SELECT key, size FROM handlers ORDER BY last_used ASC").fetchall()
+      with self.connection:
+        for key, size in rows:
+          if total <= self.max_bytes:
+            break
+          self.connection.execute("DELETE FROM handlers WHERE key = ?", (key,))
+          total -= size
+
+  def size(self):
+    with self.lock:
+      return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM handlers").fetchone()[0]
+
+  def __len__(self):
+    with self.lock:
+      return self.connection.execute("SELECT COUNT(*) FROM handlers").fetchone()[0]
+
+  def clear(self):
+    with self.lock:
+      with self.connection:
+        self.connection.execute("DELETE FROM handlers")
+
+  def close(self):
+    with self.lock:
+      self.connection.close()
+
+  def stats(self):
+    return {"hits": self.hits, "misses": self.misses, "entries": len(self), "bytes": self.size()}
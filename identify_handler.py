@@ -1,200 +1,348 @@
+import hashlib
+import multiprocessing
+import os
+import sys
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+  import numpy
+except ImportError:
+  # only needed for batch evaluation
+  numpy = None
+
+try:
+  from binaryninja import *
+except ImportError:
+  # worker processes only see exported snapshots, see process_snapshot
+  def log_info(message):
+    pass
+
+from analysis_session import get_analysis_session
+from compact_ir import OPCODES, CompactSlice
+from handler_cache import HandlerCache, function_identity, handler_key
+from instrumentation import INFO, TRACE, WARNING, instruments
+from llil_lifter import LifterBackend, lift_expression
+from memory_model import get_view_memory
+from snapshot_file import read_snapshot_file, write_snapshot_file
+from ssa_index import defined_registers, get_ssa_index, used_registers
+from vm_context import VmContext
+
 class AstNode(object):
-  def __init__(self, value):
-    self.value = value
-  def __repr__(self):
-    return "%s" % self.value
+  # nodes are immutable and interned: constructing a node from the same class
+  # and operands returns the existing instance, so equality is identity and
+  # the structural hash is only computed once
+  __slots__ = ("node_hash", "__weakref__")
+  FIELDS = ()
+  interned = weakref.WeakValueDictionary()
+  # identify_all_handlers can lift on a background thread while the console
+  # lifts too, two threads making the same node must get the same instance
+  interning = threading.Lock()
+
+  def __new__(cls, *operands):
+    if len(operands) != len(cls.FIELDS):
+      raise Exception("%s expects %s but got %s" % (cls.__name__, cls.FIELDS, operands))
+    key = (cls,) + operands
+    node = AstNode.interned.get(key)
+    if node is None:
+      with AstNode.interning:
+        node = AstNode.interned.get(key)
+        if node is None:
+          node = object.__new__(cls)
+          for field, operand in zip(cls.FIELDS, operands):
+            object.__setattr__(node, field, operand)
+          object.__setattr__(node, "node_hash", hash(key))
+          AstNode.interned[key] = node
+    return node
+
+  def __hash__(self):
+    return self.node_hash
+
+  def __setattr__(self, name, value):
+    raise AttributeError("%s is immutable" % type(self).__name__)
+
+  def __delattr__(self, name):
+    raise AttributeError("%s is immutable" % type(self).__name__)
+
+  def __reduce__(self):
+    # unpickling goes back through __new__ so nodes get re-interned
+    return (type(self), self.operands())
+
+  def operands(self):
+    return tuple(getattr(self, field) for field in self.FIELDS)
 
 class AstNodeAssignment(AstNode):
-  def __init__(self, dest, src):
-    self.dest = dest
-    self.src = src
+  FIELDS = __slots__ = ("dest", "src")
   def __repr__(self):
     return "%s = %s" % (self.dest, self.src)
 
 class AstNodeAssignmentPartial(AstNode):
-  def __init__(self, dest, src):
-    self.dest = dest
-    self.src = src
+  FIELDS = __slots__ = ("dest", "src")
   def __repr__(self):
     return "%s = %s" % (self.dest, self.src)
 
 class AstNodeMemoryStore(AstNode):
-  def __init__(self, dest, src):
-    self.dest = dest
-    self.src = src
+  FIELDS = __slots__ = ("dest", "src", "size")
   def __repr__(self):
     return "[%s] = %s" % (self.dest, self.src)
 
 class AstNodeConstant(AstNode):
+  FIELDS = __slots__ = ("value",)
   def __repr__(self):
     return "0x%s" % hex(self.value)
 
 class AstNodeRegisterSsa(AstNode):
-  def __init__(self, name, version):
-    self.name = name
-    self.version = version
+  FIELDS = __slots__ = ("name", "version")
   def __repr__(self):
     return "%s#%s" % (self.name, self.version)
-  def __hash__(self):
-    return hash((self.name, self.version))
-  def __eq__(self, other):
-    return type(other) == type(self) \
-      and self.name == other.name \
-      and self.version == other.version
 
 class AstNodeReadMem(AstNode):
-  def __init__(self, operand, size):
-    self.operand = operand
-    self.size = size
+  FIELDS = __slots__ = ("operand", "size")
   def __repr__(self):
     return "ReadMem(%s, %s)" % (self.operand, self.size)
 
 class AstNodeZx(AstNode):
-  def __init__(self, operand, size):
-    self.operand = operand
-    self.size = size
+  FIELDS = __slots__ = ("operand", "size")
   def __repr__(self):
     return "Zx(%s, %s)" % (self.operand, self.size)
 
+class AstNodeSx(AstNode):
+  # sign extends operand from operand_size bytes to size bytes
+  FIELDS = __slots__ = ("operand", "size", "operand_size")
+  def __repr__(self):
+    return "Sx(%s, %s)" % (self.operand, self.size)
+
 class AstNodeNot(AstNode):
-  def __init__(self, operand, size):
-    self.operand = operand
-    self.size = size
+  FIELDS = __slots__ = ("operand", "size")
   def __repr__(self):
     return "Not(%s, %s)" % (self.operand, self.size)
 
 class AstNodeNeg(AstNode):
-  def __init__(self, operand, size):
-    self.operand = operand
-    self.size = size
+  FIELDS = __slots__ = ("operand", "size")
   def __repr__(self):
     return "Neg(%s, %s)" % (self.operand, self.size)
 
 class AstNodeFlagBit(AstNode):
-  def __init__(self, operand, bit):
-    self.operand = operand
-    self.bit = bit
+  FIELDS = __slots__ = ("operand", "bit")
   def __repr__(self):
     return "FlagBit(%s, %s)" % (self.operand, self.bit)
 
 class AstNodeBswap(AstNode):
-  def __init__(self, operand):
-    self.operand = operand
+  FIELDS = __slots__ = ("operand",)
   def __repr__(self):
     return "Bswap(%s)" % (self.operand)
 
 class AstNodeBinaryOperation(AstNode):
   OPERATION = "NONE"
-  def __init__(self, lhs, rhs):
-    self.lhs = lhs
-    self.rhs = rhs
+  # size is part of the node so an 8 bit and a 32 bit add never intern together
+  FIELDS = __slots__ = ("lhs", "rhs", "size")
   def __repr__(self):
     return "%s(%s, %s)" % (self.OPERATION, self.lhs, self.rhs)
 
 class AstNodeSub(AstNodeBinaryOperation):
+  __slots__ = ()
   OPERATION = "Sub"
 
 class AstNodeAdd(AstNodeBinaryOperation):
+  __slots__ = ()
   OPERATION = "Add"
 
 class AstNodeRor(AstNodeBinaryOperation):
+  __slots__ = ()
   OPERATION = "Ror"
 
 class AstNodeRol(AstNodeBinaryOperation):
+  __slots__ = ()
   OPERATION = "Rol"
 
 class AstNodeShr(AstNodeBinaryOperation):
+  __slots__ = ()
   OPERATION = "Shr"
 
 class AstNodeShl(AstNodeBinaryOperation):
+  __slots__ = ()
   OPERATION = "Shl"
 
 class AstNodeXor(AstNodeBinaryOperation):
+  __slots__ = ()
   OPERATION = "Xor"
 
 class AstNodeOr(AstNodeBinaryOperation):
+  __slots__ = ()
   OPERATION = "Or"
 
+class AstNodeAnd(AstNodeBinaryOperation):
+  __slots__ = ()
+  OPERATION = "And"
+
+def interned_node_count():
+  return len(AstNode.interned)
+
+AST_NODE_CLASSES = {x.__name__: x for x in [
+  AstNodeAssignment, AstNodeAssignmentPartial, AstNodeMemoryStore, AstNodeConstant,
+  AstNodeRegisterSsa, AstNodeReadMem, AstNodeZx, AstNodeSx, AstNodeNot, AstNodeNeg, AstNodeFlagBit,
+  AstNodeBswap, AstNodeSub, AstNodeAdd, AstNodeRor, AstNodeRol, AstNodeShr, AstNodeShl,
+  AstNodeXor, AstNodeOr, AstNodeAnd,
+]}
+
+# llil operation name -> node class, for lifting live llil and snapshots
+AST_BINARY_OPERATIONS = {
+  "LLIL_ADD": AstNodeAdd,
+  "LLIL_SUB": AstNodeSub,
+  "LLIL_AND": AstNodeAnd,
+  "LLIL_XOR": AstNodeXor,
+  "LLIL_OR": AstNodeOr,
+  "LLIL_LSL": AstNodeShl,
+  "LLIL_LSR": AstNodeShr,
+  "LLIL_ROL": AstNodeRol,
+  "LLIL_ROR": AstNodeRor,
+}
+
+AST_UNARY_OPERATIONS = {
+  "LLIL_LOAD_SSA": AstNodeReadMem,
+  "LLIL_ZX": AstNodeZx,
+  "LLIL_NOT": AstNodeNot,
+  "LLIL_NEG": AstNodeNeg,
+}
+
+def serialize_assignments(assignments, entries=None):
+  # flattens the DAG into a node table so shared subtrees are only written
+  # once, a node operand is written as [index] into the table
+  nodes = []
+  indexes = {}
+  roots = list(assignments) + list((entries or {}).values())
+  for root in roots:
+    stack = [(root, False)]
+    while stack:
+      value, expanded = stack.pop()
+      if value in indexes:
+        continue
+      children = [x for x in value.operands() if isinstance(x, AstNode)]
+      if not expanded:
+        stack.append((value, True))
+        for child in children:
+          if child not in indexes:
+            stack.append((child, False))
+        continue
+      operands = [[indexes[x]] if isinstance(x, AstNode) else x for x in value.operands()]
+      indexes[value] = len(nodes)
+      nodes.append([type(value).__name__, operands])
+  return {
+    "nodes": nodes,
+    "assignments": [indexes[x] for x in assignments],
+    "entries": {name: indexes[x] for name, x in (entries or {}).items()},
+  }
+
+def deserialize_assignments(data):
+  nodes = []
+  for class_name, operands in data["nodes"]:
+    operands = [nodes[x[0]] if isinstance(x, list) else x for x in operands]
+    nodes.append(AST_NODE_CLASSES[class_name](*operands))
+  assignments = [nodes[x] for x in data["assignments"]]
+  entries = {name: nodes[x] for name, x in data["entries"].items()}
+  return assignments, entries
+
+# lifted slices keyed by a hash of the handler's bytes, shared across samples
+handler_cache = None
+
+def handler_cache_directory():
+  try:
+    return user_directory()
+  except NameError:
+    # replaying headless without binary ninja installed
+    directory = os.path.join(os.path.expanduser("~"), ".vmprotect_binja_plugin")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def get_handler_cache():
+  global handler_cache
+  if handler_cache is None:
+    handler_cache = HandlerCache(os.path.join(handler_cache_directory(), "vmprotect_handler_cache.sqlite"))
+  return handler_cache
+
 def try_lookup_register(name, version):
   if version == 0:
     return AstNodeRegisterSsa(name, version)
 
+# partial register name -> (mask, shift) within its 32 bit register
+PARTIAL_REGISTERS = {
+  "al": (0xFF, 0), "bl": (0xFF, 0), "cl": (0xFF, 0), "dl": (0xFF, 0),
+  "ah": (0xFF, 8), "bh": (0xFF, 8), "ch": (0xFF, 8), "dh": (0xFF, 8),
+  "ax": (0xFFFF, 0), "bx": (0xFFFF, 0), "cx": (0xFFFF, 0), "dx": (0xFFFF, 0),
+  "si": (0xFFFF, 0), "di": (0xFFFF, 0), "bp": (0xFFFF, 0), "sp": (0xFFFF, 0),
+  "sil": (0xFF, 0), "dil": (0xFF, 0), "bpl": (0xFF, 0), "spl": (0xFF, 0),
+}
+# the low halves of the x64 registers
+for name in ["eax", "ebx", "ecx", "edx", "esi", "edi", "ebp", "esp"]:
+  PARTIAL_REGISTERS[name] = (0xFFFFFFFF, 0)
+for number in range(8, 16):
+  PARTIAL_REGISTERS["r%dd" % number] = (0xFFFFFFFF, 0)
+  PARTIAL_REGISTERS["r%dw" % number] = (0xFFFF, 0)
+  PARTIAL_REGISTERS["r%db" % number] = (0xFF, 0)
+
+X64_REGISTERS = ["rax", "rbx", "rcx", "rdx", "rsi", "rdi", "rbp", "rsp"] + ["r%d" % x for x in range(8, 16)]
+X64_REGISTER_SET = frozenset(X64_REGISTERS)
+
+def register_size(name):
+  return 8 if name in X64_REGISTER_SET else 4
+
+def partial_register_read(full, partial_name):
+  mask, shift = PARTIAL_REGISTERS[partial_name]
+  size = register_size(full.name)
+  if shift:
+    full = AstNodeShr(full, AstNodeConstant(shift), size)
+  return AstNodeAnd(full, AstNodeConstant(mask), size)
+
+def partial_register_write(previous, partial_name, value):
+  # (previous & ~mask) | ((value & mask) << shift)
+  mask, shift = PARTIAL_REGISTERS[partial_name]
+  size = register_size(previous.name)
+  value = AstNodeAnd(value, AstNodeConstant(mask), size)
+  if size == 8 and mask == 0xFFFFFFFF:
+    # writing the low half of an x64 register clears the top half
+    return value
+  kept = AstNodeAnd(previous, AstNodeConstant(MASKS_BY_SIZE[size] ^ (mask << shift)), size)
+  if shift:
+    value = AstNodeShl(value, AstNodeConstant(shift), size)
+  return AstNodeOr(kept, value, size)
+
+def lift_constant(value, size):
+  # binary ninja gives constants signed (esp - 4 can come as esp + -4), the
+  # evaluators and compact slices want the unsigned value at the constant's
+  # width
+  return AstNodeConstant(value & MASKS_BY_SIZE.get(size, MASKS_BY_SIZE[8]))
+
+class AstLifterBackend(LifterBackend):
+  def constant(self, value, size):
+    return lift_constant(value, size)
+
+  def register(self, name, version, size):
+    return AstNodeRegisterSsa(name, version)
+
+  def register_partial(self, full_name, version, partial_name, size):
+    return partial_register_read(AstNodeRegisterSsa(full_name, version), partial_name)
+
+  def load(self, operand, size):
+    return AstNodeReadMem(operand, size)
+
+  def unary(self, operation, operand, size):
+    return AST_UNARY_OPERATIONS[operation](operand, size)
+
+  def sign_extend(self, operand, size, operand_size):
+    return AstNodeSx(operand, size, operand_size)
+
+  def binary(self, operation, lhs, rhs, size):
+    return AST_BINARY_OPERATIONS[operation](lhs, rhs, size)
+
+  def flag_bit(self, value):
+    # ignore for now
+    return AstNodeFlagBit("dummy flag", 0xab)
+
+AST_LIFTER_BACKEND = AstLifterBackend()
+
 def resolve_source(source):
-  # load up flattened tree
-  sources = [source]
-  todo = []
-  output = []
-  while sources:
-    source = sources.pop()
-    if type(source) in [LowLevelILSub, LowLevelILZx, LowLevelILSx, LowLevelILAnd, LowLevelILXor, LowLevelILOr, LowLevelILNot, LowLevelILLsl, LowLevelILLsr, LowLevelILRol, LowLevelILRor, LowLevelILAdd, LowLevelILNeg]:
-      todo.append(source)
-      for operand in source.operands:
-        sources.append(operand)
-    elif type(source) in [LowLevelILLoadSsa]:
-      # operands are [src, src_memory] and src_memory is just an int ref we don't want
-      todo.append(source)
-      sources.append(source.src)
-    elif type(source) in [LowLevelILConst, LowLevelILRegSsa, LowLevelILRegSsaPartial]:
-      todo.append(source)
-    elif type(source) == LowLevelILFlagBitSsa:
-      # workaround, just pushes the class and no operands
-      todo.append(source)
-    else:
-      raise Exception("Couldn't process instruction %s type %s" % (source, type(source)))
-  # process flattened tree
-  while todo:
-    value = todo.pop()
-    if type(value) == LowLevelILConst:
-      output.append(AstNodeConstant(value.constant))
-    elif type(value) == LowLevelILRegSsa:
-      register = AstNodeRegisterSsa(value.src.reg.name, value.src.version)
-      output.append(register)
-    elif type(value) == LowLevelILSub:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append(AstNodeSub(lhs, rhs))
-    elif type(value) == LowLevelILLoadSsa:
-      operand = output.pop()
-      output.append(AstNodeReadMem(operand, value.size))
-    elif type(value) == LowLevelILZx:
-      operand = output.pop()
-      output.append(AstNodeZx(operand, value.size))
-    elif type(value) == LowLevelILNot:
-      operand = output.pop()
-      output.append(AstNodeNot(operand, value.size))
-    elif type(value) == LowLevelILNeg:
-      operand = output.pop()
-      output.append(AstNodeNeg(operand, value.size))
-    elif type(value) == LowLevelILFlagBitSsa:
-      # ignore for now
-      #bit = output.pop()
-      #operand = output.pop()
-      output.append(AstNodeFlagBit("dummy flag", 0xab))
-    elif type(value) == LowLevelILAdd:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append(AstNodeAdd(lhs, rhs))
-    elif type(value) == LowLevelILXor:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append(AstNodeXor(lhs, rhs))
-    elif type(value) == LowLevelILOr:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append(AstNodeOr(lhs, rhs))
-    elif type(value) == LowLevelILRor:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append(AstNodeRor(lhs, rhs))
-    elif type(value) == LowLevelILRol:
-      rhs = output.pop()
-      lhs = output.pop()
-      output.append(AstNodeRol(lhs, rhs))
-    else:
-      raise Exception("Couldn't process %s type %s" % (value, type(value)))
-  if len(output) != 1:
-    raise Exception("expected one result but got %s" % output)
-  return output[0]
+  return lift_expression(source, AST_LIFTER_BACKEND)[0]
 
 def resolve_dest(dest):
   if type(dest) == SSARegister:
@@ -202,223 +350,2265 @@ def resolve_dest(dest):
   else:
     raise Exception("Couldn't resolve destination %s type %s" % (dest, type(dest)))
 
-def resolve_assignment(assignment):
+def lift_assignment(assignment):
+  # one walk gives the lifted assignment and the registers it depends on
   if type(assignment) == LowLevelILSetRegSsa:
     dest = resolve_dest(assignment.dest)
-    source = resolve_source(assignment.src)
-    return AstNodeAssignment(dest, source)
+    source, registers = lift_expression(assignment.src, AST_LIFTER_BACKEND)
+    return AstNodeAssignment(dest, source), registers
   elif type(assignment) == LowLevelILIntrinsicSsa:
     # this is specific opcodes
     intrinsic = assignment.intrinsic
     if type(intrinsic) == ILIntrinsic:
-      source = resolve_dest(assignment.param.src[0].src)
+      register = assignment.param.src[0].src
       dest = AstNodeRegisterSsa(assignment.output[0].reg_or_flag.name, assignment.output[0].version)
-      return AstNodeAssignment(dest, AstNodeBswap(source))
+      return AstNodeAssignment(dest, AstNodeBswap(resolve_dest(register))), [register]
     else:
       raise Exception("Couldn't resolve intrinsict %s type %s" % (assignment, type(assignment.intrinsic)))
   elif type(assignment) == LowLevelILStoreSsa:
-    # we use resolve_source because this will resolve to an expression
-    dest = resolve_source(assignment.dest)
-    source = resolve_source(assignment.src)
-    return AstNodeMemoryStore(dest, source)
+    # the destination is an expression too
+    dest, dest_registers = lift_expression(assignment.dest, AST_LIFTER_BACKEND)
+    source, registers = lift_expression(assignment.src, AST_LIFTER_BACKEND)
+    return AstNodeMemoryStore(dest, source, assignment.size), dest_registers + registers
+  elif type(assignment) == LowLevelILSetRegSsaPartial:
+    # the rest of the full register comes from its previous version
+    source, registers = lift_expression(assignment.src, AST_LIFTER_BACKEND)
+    full = assignment.full_reg
+    previous = SSARegister(full.reg, full.version - 1)
+    dest = resolve_dest(full)
+    value = partial_register_write(AstNodeRegisterSsa(full.reg.name, full.version - 1), assignment.dest.name, source)
+    return AstNodeAssignment(dest, value), registers + [previous]
   else:
     raise Exception("Couldn't resolve assignment %s type %s" % (assignment, type(assignment)))
 
+def resolve_assignment(assignment):
+  return lift_assignment(assignment)[0]
+
 def build_ast(assignment):
   pass
 
-def find_important_registers():
-  # esi = vip
-  # ebp = vsp
-  # esp = pRegs
-  # edi = pFunc
-  # ebx = key
-  pass
+# what the vm keeps in each native register
+VM_ROLES = {
+  "vip": "esi",
+  "vsp": "ebp",
+  "pregs": "esp",
+  "pfunc": "edi",
+  "key": "ebx",
+}
+
+VM_ROLES_X64 = {
+  "vip": "rsi",
+  "vsp": "rbp",
+  "pregs": "rsp",
+  "pfunc": "rdi",
+  "key": "rbx",
+}
+
+VM_ROLES_BY_ADDRESS_SIZE = {4: VM_ROLES, 8: VM_ROLES_X64}
+
+def find_important_registers(registers=None, address_size=4):
+  # role -> register name, or role -> value given the registers by name
+  roles = VM_ROLES_BY_ADDRESS_SIZE[address_size]
+  if registers is None:
+    return dict(roles)
+  return {role: registers[name] for role, name in roles.items()}
+
+def function_address_size(func):
+  return index_address_size(function_index(func))
+
+def index_address_size(index):
+  # anything touching a 64 bit register is x64
+  if X64_REGISTER_SET.intersection(index.latest_registers):
+    return 8
+  return 4
 
 def find_dependent_registers(assignment):
-  if type(assignment) in [LowLevelILSetRegSsa, LowLevelILSetRegSsaPartial]:
-    sources = [assignment.src]
-  elif type(assignment) == LowLevelILStoreSsa:
-    sources = [assignment.src, assignment.dest]
-  else:
-    raise Exception("Couldn't resolve assignment %s type %s" % (assignment, type(assignment)))
-  # load up flattened tree
-  todo = []
-  output = []
-  while sources:
-    source = sources.pop()
-    if type(source) in [LowLevelILSub, LowLevelILZx, LowLevelILSx, LowLevelILAnd, LowLevelILXor, LowLevelILOr, LowLevelILNot, LowLevelILLsl, LowLevelILLsr, LowLevelILRol, LowLevelILRor, LowLevelILAdd, LowLevelILNeg]:
-      for operand in source.operands:
-        sources.append(operand)
-    elif type(source) in [LowLevelILLoadSsa]:
-      # operands are [src, src_memory] and src_memory is just an int ref we don't want
-      sources.append(source.src)
-    elif type(source) == LowLevelILRegSsa:
-      output.append(source.src)
-    elif type(source) == LowLevelILFlagBitSsa:
-      # don't care for now
-      continue
-    elif type(source) == SSAFlag:
-      # we should track these but also don't really care for now
-      continue
-      #output.append(source.src)
-    elif type(source) == LowLevelILRegSsaPartial:
-      output.append(source.full_reg)
-    elif type(source) == LowLevelILConst or type(source) == int:
-      continue
-    else:
-      raise Exception("Couldn't process instruction %s type %s" % (source, type(source)))
-  return output
+  return lift_assignment(assignment)[1]
 
-def find_all_dependent_registers(llil_ssa, base_assignment):
-  assignments = [base_assignment]
+def slice_assignments(index, base_assignments, lift=None, liveness=None):
+  # walks the definition graph once for all roots, sharing the visited set
+  # lift gives (lifted, registers it reads) for an instruction, so each one
+  # is only walked once, output is lifted and in dependency order so every
+  # definition comes before its users. with liveness (see index_liveness)
+  # dead instructions are never walked or lifted
   output_assignments = []
-  while assignments:
-    assignment = assignments.pop()
-    log_info("Analysing assignment %s" % assignment)
-    output_assignments.append(assignment)
-    dependent_registers = find_dependent_registers(assignment)
-    for register in dependent_registers:
-      log_info("Adding dependent register %s" % register)
-      assignment = llil_ssa.get_ssa_reg_definition(register)
-      if assignment:
-        log_info("Defined at: %s" % assignment)
-        assignments.append(assignment)
-      else:
-        log_info("Register %s has no definition, skipping" % register)
-  # convert to pythonesque
-  output_python = []
-  while output_assignments:
-    output_python.append(resolve_assignment(output_assignments.pop()))
-  return output_python
+  for assignments in iter_slices(index, base_assignments, lift, liveness):
+    output_assignments += assignments
+  return output_assignments
+
+def iter_slices(index, base_assignments, lift=None, liveness=None):
+  # yields one list per base, holding only what no earlier base needed, so
+  # the lists concatenated are the whole slice with nothing repeated. a dead
+  # base gives an empty list
+  if lift is None:
+    lift = lift_assignment
+  instruments.refresh()
+  trace = instruments.trace
+  visited = set()
+  for base_assignment in base_assignments:
+    output_assignments = []
+    visited_before = len(visited)
+    if liveness is not None and not liveness.is_live(base_assignment):
+      trace(TRACE, "Assignment %s is dead, skipping", base_assignment)
+      instruments.count("pruned_instructions")
+      yield output_assignments
+      continue
+    with instruments.phase("slicing"):
+      stack = [(base_assignment, None)]
+      while stack:
+        assignment, lifted = stack.pop()
+        if lifted is not None:
+          output_assignments.append(lifted)
+          continue
+        if assignment.instr_index in visited:
+          continue
+        visited.add(assignment.instr_index)
+        trace(TRACE, "Analysing assignment %s", assignment)
+        with instruments.phase("lifting"):
+          lifted, dependent_registers = lift(assignment)
+        stack.append((assignment, lifted))
+        for register in dependent_registers:
+          trace(TRACE, "Adding dependent register %s", register)
+          definition = index.get_definition(register)
+          if definition:
+            trace(TRACE, "Defined at: %s", definition)
+            if definition.instr_index not in visited:
+              stack.append((definition, None))
+          else:
+            trace(TRACE, "Register %s has no definition, skipping", register)
+    instruments.count("sliced_instructions", len(visited) - visited_before)
+    yield output_assignments
+
+def function_index(func):
+  # replayed functions carry their exported snapshot instead of live llil
+  if getattr(func, "snapshot", None) is not None:
+    index = snapshot_indexes.get(func)
+    if index is None:
+      index = SnapshotIndex(func.snapshot)
+      snapshot_indexes[func] = index
+    return index
+  return get_ssa_index(func)
+
+def lift_slice(index, base_assignments, liveness=None):
+  # convert to pythonesque, with liveness (see index_liveness) dead bases are
+  # dropped
+  if isinstance(index, SnapshotIndex):
+    return slice_assignments(index, base_assignments, lift_snapshot_assignment, liveness)
+  return slice_assignments(index, base_assignments, liveness=liveness)
+
+def lift_slices(index, base_assignments, liveness=None):
+  if isinstance(index, SnapshotIndex):
+    return iter_slices(index, base_assignments, lift_snapshot_assignment, liveness)
+  return iter_slices(index, base_assignments, liveness=liveness)
+
+def index_liveness(index, register_names=()):
+  # junk is anything that feeds neither a store, the control flow nor the
+  # final value of a vm context register (vip, vsp, pregs, pfunc, key) or of
+  # register_names, so a register the caller asked for is never pruned.
+  # exported snapshots only hold live instructions to begin with
+  if isinstance(index, SnapshotIndex):
+    return None
+  roles = VM_ROLES_BY_ADDRESS_SIZE[index_address_size(index)].values()
+  return index.get_liveness(sorted(set(roles).union(register_names)))
+
+def lift_definition_dest(instruction):
+  if isinstance(instruction, SnapshotInstruction):
+    return AstNodeRegisterSsa(*instruction.defines[0])
+  if type(instruction) == LowLevelILSetRegSsaPartial:
+    return resolve_dest(instruction.full_reg)
+  return resolve_dest(instruction.dest)
+
+def find_store_instructions(index):
+  if isinstance(index, SnapshotIndex):
+    return [x for x in index.instructions if x.operation == "LLIL_STORE_SSA"]
+  return [x for x in index.instructions if isinstance(x, LowLevelILStoreSsa)]
+
+def session_result(func, kind, compute):
+  # kept until the function's code changes, see analysis_session. the console
+  # can run this file more than once and each run has its own AstNode classes,
+  # so results are only handed back to the copy that made them
+  return get_analysis_session(func.view).get(func, (AstNode, kind), compute)
+
+def find_all_dependent_registers(func, base_assignment):
+  return session_result(func, ("slice", base_assignment.instr_index), lambda: lift_slice(function_index(func), [base_assignment]))
 
 def find_all_dependent_registers_from_address(address):
   func = bv.get_functions_containing(address)[0]
   base_assignment = func.get_llil_at(address).ssa_form
-  llil_ssa = func.llil.ssa_form
-  return find_all_dependent_registers(func, llil_ssa, base_assignment)
+  return find_all_dependent_registers(func, base_assignment)
+
+def find_latest_definition(index, register_name):
+  register = index.get_latest_register(register_name)
+  if not register:
+    instruments.trace(INFO, "Register not mentioned %s", register_name)
+    return None
+  base_assignment = index.get_definition(register)
+  if not base_assignment:
+    instruments.trace(INFO, "Register not defined %s", register_name)
+    return None
+  return base_assignment
 
 def find_all_dependent_registers_from_register_name(func, register_name):
-  llil_ssa = func.llil.ssa_form
-  registers = sorted(filter(lambda x: x.reg.name==register_name, llil_ssa.ssa_registers), key=lambda x: x.version)
-  if not registers:
-    log_info("Register not mentioned %s" % register_name)
-    return []
-  register = registers[-1]
-  base_assignment = llil_ssa.get_ssa_reg_definition(register)
+  base_assignment = find_latest_definition(function_index(func), register_name)
   if not base_assignment:
-    log_info("Register not defined %s" % register_name)
     return []
-  return find_all_dependent_registers(llil_ssa, base_assignment)
+  return find_all_dependent_registers(func, base_assignment)
+
+def find_exit_instruction(index):
+  # the computed jump (or ret) that ends a handler
+  for instruction in reversed(index.instructions):
+    if isinstance(instruction, SnapshotInstruction):
+      if instruction.operation in ["LLIL_JUMP", "LLIL_RET"]:
+        return instruction
+    elif type(instruction) in [LowLevelILJump, LowLevelILRet]:
+      return instruction
+  return None
+
+def is_return(instruction):
+  if isinstance(instruction, SnapshotInstruction):
+    return instruction.operation == "LLIL_RET"
+  return type(instruction) == LowLevelILRet
+
+def lift_jump_target(instruction):
+  # (target expression, registers it reads)
+  if isinstance(instruction, SnapshotInstruction):
+    return lift_snapshot_expression(instruction.il[2]), instruction.uses
+  return lift_expression(instruction.dest, AST_LIFTER_BACKEND)
+
+def find_all_dependent_registers_from_register_names(func, register_names, handler=False, compact=False):
+  # one shared slice for several registers, plus the final ssa register of each
+  # with handler the stores are sliced too and the jump target is entry "jump"
+  # compact gives a CompactSlice instead of (assignments, entries), a cached
+  # slice then goes straight into arrays without making any AstNodes
+  kind = ("registers", tuple(register_names), handler, compact)
+  return session_result(func, kind, lambda: load_register_slice(func, register_names, handler, compact))
+
+def load_register_slice(func, register_names, handler, compact):
+  # from the disk cache when another session (or sample) already lifted it
+  cache = get_handler_cache()
+  kind = "handler" if handler else "final_values"
+  key = handler_key(function_identity(func), "%s:%s" % (kind, ",".join(register_names)))
+  cached = cache.get(key)
+  if cached is not None:
+    if compact:
+      return compact_serialized_assignments(cached["assignments"])
+    return deserialize_assignments(cached["assignments"])
+  assignments, entries = slice_registers(function_index(func), register_names, handler)
+  cache.put(key, {"assignments": serialize_assignments(assignments, entries), "classification": None})
+  if compact:
+    return compact_assignments(assignments, entries)
+  return assignments, entries
+
+def slice_registers(index, register_names, handler=False):
+  # register_names are liveness roots, only junk none of them need is pruned
+  liveness = index_liveness(index, register_names)
+  base_assignments = []
+  entries = {}
+  for register_name in register_names:
+    base_assignment = find_latest_definition(index, register_name)
+    if base_assignment:
+      base_assignments.append(base_assignment)
+      entries[register_name] = lift_definition_dest(base_assignment)
+  if handler:
+    base_assignments += find_store_instructions(index) + jump_target_definitions(index, entries)
+  return lift_slice(index, base_assignments, liveness), entries
+
+def jump_target_definitions(index, entries):
+  # sets entries["jump"] when the function jumps on rather than returning,
+  # gives the definitions the target reads
+  exit_instruction = find_exit_instruction(index)
+  if exit_instruction is None or is_return(exit_instruction):
+    return []
+  target, registers = lift_jump_target(exit_instruction)
+  entries["jump"] = target
+  definitions = [index.get_definition(x) for x in registers]
+  return [x for x in definitions if x]
 
 def find_all_memory_writes(func):
-  llil_ssa = func.llil.ssa_form
-  store_instructions = list(filter(lambda x: isinstance(x, LowLevelILStoreSsa), llil_ssa.instructions))
+  return session_result(func, "memory_writes", lambda: load_memory_writes(func))
+
+def load_memory_writes(func):
+  cache = get_handler_cache()
+  key = handler_key(function_identity(func), "memory_writes")
+  cached = cache.get(key)
+  if cached is not None:
+    assignments, _ = deserialize_assignments(cached["assignments"])
+    return assignments
+
+  index = function_index(func)
+  store_instructions = find_store_instructions(index)
   if not store_instructions:
-    log_info("No store instructions found")
-    return []
-  
-  assignments = []
-  for store_instruction in store_instructions:
-    assignments += find_all_dependent_registers(llil_ssa, store_instruction)
-  
+    instruments.trace(INFO, "No store instructions found")
+
+  # one walk for every store, definitions shared between stores appear once
+  assignments = lift_slice(index, store_instructions)
+
+  cache.put(key, {"assignments": serialize_assignments(assignments), "classification": None})
   return assignments
 
-def evaluate_rol(value, amount):
-  # we are assuming 32 bits which is going to be wrong later
-  bits = 32
-  mask = 0xFFFFFFFF
-  return mask & ((value << amount) | (value >> (bits - amount)))
-
-def evaluate_ror(value, amount):
-  # we are assuming 32 bits which is going to be wrong later
-  bits = 32
-  mask = 0xFFFFFFFF
-  return mask & ((value >> amount) | (value << (bits - amount)))
-
-def evaluate_add(lhs, rhs):
-  # we are assuming 32 bits which is going to be wrong later
-  mask = 0xFFFFFFFF
-  output = mask & (lhs + rhs)
+def iter_memory_writes(func):
+  # yields (store, assignments it needs that no earlier store did) in program
+  # order, lifting lazily so a consumer can stop after the store it wants.
+  # the lists aren't self-contained: evaluating a store needs everything
+  # yielded up to it, so keeping them costs what find_all_memory_writes does
+  # and stopping early only saves the lifting of the later stores
+  index = function_index(func)
+  for assignments in lift_slices(index, find_store_instructions(index)):
+    yield assignments[-1], assignments[:-1]
+
+MASKS_BY_SIZE = {1: 0xFF, 2: 0xFFFF, 4: 0xFFFFFFFF, 8: 0xFFFFFFFFFFFFFFFF}
+
+def registers_in(value):
+  output = set()
+  visited = set()
+  values = [value]
+  while values:
+    value = values.pop()
+    if value in visited:
+      continue
+    visited.add(value)
+    if isinstance(value, AstNodeRegisterSsa):
+      output.add(value)
+    else:
+      values += [x for x in value.operands() if isinstance(x, AstNode)]
+  return output
+
+def register_references(assignment):
+  # every direct reference to a register, Add(x, x) counts x twice
+  output = []
+  visited = set()
+  if isinstance(assignment, AstNodeMemoryStore):
+    values = [assignment.dest, assignment.src]
+  else:
+    values = [assignment.src]
+  while values:
+    value = values.pop()
+    if isinstance(value, AstNodeRegisterSsa):
+      output.append(value)
+    if value in visited:
+      continue
+    visited.add(value)
+    values += [x for x in value.operands() if isinstance(x, AstNode)]
   return output
 
-def evaluate_sub(lhs, rhs):
-  # we are assuming 32 bits which is going to be wrong later
-  mask = 0xFFFFFFFF
-  output = lhs - rhs
-  while output < 0:
-    output += (mask+1)
-  return mask & output
-
-def evaluate_value(value, assignments_by_register):
-  masks_by_bits = {
-    8: 0xFF,
-    16: 0xFFFF,
-    32: 0xFFFFFFFF
-  }
-  if isinstance(value, AstNodeRegisterSsa):
-    assignment = assignments_by_register[value]
-    return evaluate_value(assignment.src, assignments_by_register)
-  elif isinstance(value, AstNodeConstant):
-    return value.value
-  elif isinstance(value, AstNodeAdd):
-    lhs = evaluate_value(value.lhs, assignments_by_register)
-    rhs = evaluate_value(value.rhs, assignments_by_register)
-    return evaluate_add(lhs, rhs)
-  elif isinstance(value, AstNodeSub):
-    lhs = evaluate_value(value.lhs, assignments_by_register)
-    rhs = evaluate_value(value.rhs, assignments_by_register)
-    return evaluate_sub(lhs, rhs)
-  elif isinstance(value, AstNodeRol):
-    lhs = evaluate_value(value.lhs, assignments_by_register)
-    rhs = evaluate_value(value.rhs, assignments_by_register)
-    return evaluate_rol(lhs, rhs)
-  elif isinstance(value, AstNodeRor):
-    lhs = evaluate_value(value.lhs, assignments_by_register)
-    rhs = evaluate_value(value.rhs, assignments_by_register)
-    return evaluate_ror(lhs, rhs)
-  elif isinstance(value, AstNodeNot):
-    mask = masks_by_bits[value.size * 8]
-    operand = evaluate_value(value.operand, assignments_by_register)
-    return operand ^ mask
-  elif isinstance(value, AstNodeNeg):
-    operand = evaluate_value(value.operand, assignments_by_register)
-    return 1 + masks_by_bits[value.size*8] - operand 
-  elif isinstance(value, AstNodeXor):
-    lhs = evaluate_value(value.lhs, assignments_by_register)
-    rhs = evaluate_value(value.rhs, assignments_by_register)
-    return lhs ^ rhs
-  elif isinstance(value, AstNodeReadMem):
-    # special case for esp
-    if isinstance(value.operand, AstNodeAdd) and isinstance(value.operand.lhs, AstNodeRegisterSsa):
-      add = value.operand
-      if add.lhs.name == "esp" and evaluate_value(add.rhs, {}) == 0x28:
-        return assignments_by_register["key"]
+class Simplifier(object):
+  # bottom up rewriting to a fixpoint, nodes are interned so "unchanged" is
+  # just an identity check
+  LINEAR_TERM_LIMIT = 64
+
+  def __init__(self):
+    self.hits = {}
+    self.simplified = {}
+    self.rules = [
+      ("constant_fold", self.constant_fold),
+      ("commute_constant", self.commute_constant),
+      ("identity", self.identity),
+      ("xor_self", self.xor_self),
+      ("xor_chain", self.xor_chain),
+      ("xor_mask_to_not", self.xor_mask_to_not),
+      ("not_xor", self.not_xor),
+      ("not_not", self.not_not),
+      ("add_sub_chain", self.add_sub_chain),
+      ("rotate_merge", self.rotate_merge),
+      ("mask_narrowing", self.mask_narrowing),
+    ]
+
+  def hit(self, rule_name):
+    self.hits[rule_name] = self.hits.get(rule_name, 0) + 1
+
+  def simplify(self, value):
+    while True:
+      result = self.simplify_once(value)
+      if result is value:
+        return result
+      value = result
+
+  def simplify_once(self, root):
+    simplified = self.simplified
+    stack = [(root, False)]
+    while stack:
+      value, expanded = stack.pop()
+      if value in simplified:
+        continue
+      children = [x for x in value.operands() if isinstance(x, AstNode)]
+      if not expanded:
+        stack.append((value, True))
+        for child in children:
+          if child not in simplified:
+            stack.append((child, False))
+        continue
+      if children:
+        operands = [simplified[x] if isinstance(x, AstNode) else x for x in value.operands()]
+        value_rebuilt = type(value)(*operands)
       else:
-        raise Exception("Looks like ESP read but we didn't handle it? %s %s" % (value, type(add.rhs)))
-    address = evaluate_value(value.operand, assignments_by_register)
-    data = bv.read_int(address, value.size)
-    while data < 0:
-      data += (masks_by_bits[value.size * 8] + 1)
-    return data
+        value_rebuilt = value
+      simplified[value] = self.rewrite(value_rebuilt)
+    return simplified[root]
+
+  def rewrite(self, value):
+    while True:
+      for rule_name, rule in self.rules:
+        result = rule(value)
+        if result is not None and result is not value:
+          self.hit(rule_name)
+          value = result
+          break
+      else:
+        return value
+
+  def constant_fold(self, value):
+    # same width operations as evaluation so folding can't change a result
+    if isinstance(value, AstNodeBinaryOperation):
+      if not isinstance(value.lhs, AstNodeConstant) or not isinstance(value.rhs, AstNodeConstant):
+        return None
+      operation = WIDTH_OPERATIONS[value.size][type(value)]
+      return AstNodeConstant(operation(value.lhs.value & MASKS_BY_SIZE[value.size], value.rhs.value))
+    elif isinstance(value, (AstNodeNot, AstNodeNeg, AstNodeZx)) and isinstance(value.operand, AstNodeConstant):
+      return AstNodeConstant(WIDTH_OPERATIONS[value.size][type(value)](value.operand.value & MASKS_BY_SIZE[value.size]))
+    elif isinstance(value, AstNodeSx) and isinstance(value.operand, AstNodeConstant):
+      return AstNodeConstant(evaluate_sx(value.operand.value, value.size, value.operand_size))
+    return None
+
+  def commute_constant(self, value):
+    # constants go on the right so the chain rules only have one shape to match
+    if isinstance(value, (AstNodeAdd, AstNodeXor, AstNodeOr, AstNodeAnd)) \
+      and isinstance(value.lhs, AstNodeConstant) and not isinstance(value.rhs, AstNodeConstant):
+      return type(value)(value.rhs, value.lhs, value.size)
+    return None
+
+  def identity(self, value):
+    if isinstance(value, (AstNodeXor, AstNodeOr, AstNodeShl, AstNodeShr)) \
+      and isinstance(value.rhs, AstNodeConstant) and value.rhs.value == 0:
+      return value.lhs
+    if isinstance(value, (AstNodeRol, AstNodeRor)) \
+      and isinstance(value.rhs, AstNodeConstant) and value.rhs.value % (value.size * 8) == 0:
+      return value.lhs
+    if isinstance(value, (AstNodeOr, AstNodeAnd)) and value.lhs is value.rhs:
+      return value.lhs
+    if isinstance(value, AstNodeAnd) and isinstance(value.rhs, AstNodeConstant) \
+      and value.rhs.value & MASKS_BY_SIZE[value.size] == MASKS_BY_SIZE[value.size]:
+      return value.lhs
+    return None
+
+  def xor_self(self, value):
+    if isinstance(value, AstNodeXor) and value.lhs is value.rhs:
+      return AstNodeConstant(0)
+    return None
+
+  def xor_chain(self, value):
+    if isinstance(value, AstNodeXor) and isinstance(value.rhs, AstNodeConstant) \
+      and isinstance(value.lhs, AstNodeXor) and value.lhs.size == value.size \
+      and isinstance(value.lhs.rhs, AstNodeConstant):
+      return AstNodeXor(value.lhs.lhs, AstNodeConstant(value.lhs.rhs.value ^ value.rhs.value), value.size)
+    return None
+
+  def xor_mask_to_not(self, value):
+    if isinstance(value, AstNodeXor) and isinstance(value.rhs, AstNodeConstant) \
+      and value.rhs.value == MASKS_BY_SIZE[value.size]:
+      return AstNodeNot(value.lhs, value.size)
+    return None
+
+  def not_xor(self, value):
+    if isinstance(value, AstNodeXor) and isinstance(value.rhs, AstNodeConstant) \
+      and isinstance(value.lhs, AstNodeNot) and value.lhs.size == value.size:
+      return AstNodeXor(value.lhs.operand, AstNodeConstant(value.rhs.value ^ MASKS_BY_SIZE[value.size]), value.size)
+    return None
+
+  def not_not(self, value):
+    if isinstance(value, (AstNodeNot, AstNodeNeg)) and type(value.operand) == type(value) \
+      and value.operand.size == value.size:
+      return value.operand.operand
+    return None
+
+  def linear_terms(self, value):
+    # flattens an add/sub/neg tree of one size into coefficients, left to right
+    # so rebuilding the canonical chain and flattening it again is stable
+    size = value.size
+    terms = {}
+    constant = 0
+    stack = [(value, 1)]
+    visited = 0
+    while stack:
+      node, sign = stack.pop()
+      visited += 1
+      if visited > self.LINEAR_TERM_LIMIT:
+        # shared subtrees make the flattened form blow up, leave those alone
+        return None, None
+      if isinstance(node, (AstNodeAdd, AstNodeSub)) and node.size == size:
+        stack.append((node.rhs, sign if isinstance(node, AstNodeAdd) else -sign))
+        stack.append((node.lhs, sign))
+      elif isinstance(node, AstNodeNeg) and node.size == size:
+        stack.append((node.operand, -sign))
+      elif isinstance(node, AstNodeConstant):
+        constant += sign * node.value
+      else:
+        terms[node] = terms.get(node, 0) + sign
+    return terms, constant & MASKS_BY_SIZE[size]
+
+  def add_sub_chain(self, value):
+    if not isinstance(value, (AstNodeAdd, AstNodeSub)):
+      return None
+    size = value.size
+    terms, constant = self.linear_terms(value)
+    if terms is None:
+      return None
+    positive = [(x, c) for x, c in terms.items() if c > 0]
+    negative = [(x, -c) for x, c in terms.items() if c < 0]
+    result = None
+    for node, count in positive:
+      for _ in range(count):
+        result = node if result is None else AstNodeAdd(result, node, size)
+    for node, count in negative:
+      for _ in range(count):
+        result = AstNodeNeg(node, size) if result is None else AstNodeSub(result, node, size)
+    if result is None:
+      return AstNodeConstant(constant)
+    if constant > MASKS_BY_SIZE[size] >> 1:
+      return AstNodeSub(result, AstNodeConstant(MASKS_BY_SIZE[size] + 1 - constant), size)
+    elif constant:
+      return AstNodeAdd(result, AstNodeConstant(constant), size)
+    return result
+
+  def rotate_merge(self, value):
+    if isinstance(value, (AstNodeRol, AstNodeRor)) and isinstance(value.rhs, AstNodeConstant) \
+      and isinstance(value.lhs, (AstNodeRol, AstNodeRor)) and value.lhs.size == value.size \
+      and isinstance(value.lhs.rhs, AstNodeConstant):
+      bits = value.size * 8
+      if type(value.lhs) == type(value):
+        amount = value.rhs.value + value.lhs.rhs.value
+      else:
+        amount = value.rhs.value - value.lhs.rhs.value
+      return type(value)(value.lhs.lhs, AstNodeConstant(amount % bits), value.size)
+    return None
+
+  def mask_narrowing(self, value):
+    if isinstance(value, AstNodeZx) and isinstance(value.operand, AstNodeZx) \
+      and value.operand.size <= value.size:
+      return AstNodeZx(value.operand.operand, value.size)
+    if isinstance(value, AstNodeBinaryOperation) and not isinstance(value, (AstNodeRol, AstNodeRor, AstNodeShl, AstNodeShr)) \
+      and isinstance(value.rhs, AstNodeConstant) and value.rhs.value > MASKS_BY_SIZE[value.size]:
+      return type(value)(value.lhs, AstNodeConstant(value.rhs.value & MASKS_BY_SIZE[value.size]), value.size)
+    return None
+
+  def simplify_assignments(self, assignments, keep=None):
+    # constants and copies are always propagated, with keep (the registers the
+    # caller still needs) single use definitions get inlined and dead ones go
+    use_counts = {}
+    for assignment in assignments:
+      for register in register_references(assignment):
+        use_counts[register] = use_counts.get(register, 0) + 1
+    output = []
+    for assignment in assignments:
+      if isinstance(assignment, AstNodeMemoryStore):
+        output.append(AstNodeMemoryStore(self.simplify(assignment.dest), self.simplify(assignment.src), assignment.size))
+        continue
+      src = self.simplify(assignment.src)
+      dest = assignment.dest
+      if isinstance(src, (AstNodeConstant, AstNodeRegisterSsa)):
+        self.hit("propagate")
+        self.simplified[dest] = src
+      elif keep is not None and dest not in keep and use_counts.get(dest, 0) == 1:
+        self.hit("inline_single_use")
+        self.simplified[dest] = src
+        continue
+      output.append(AstNodeAssignment(dest, src))
+    if keep is None:
+      return output
+    # drop everything nothing live refers to any more
+    needed = set(keep)
+    live = []
+    for assignment in reversed(output):
+      if isinstance(assignment, AstNodeMemoryStore):
+        needed |= registers_in(assignment.dest) | registers_in(assignment.src)
+      elif assignment.dest in needed:
+        needed |= registers_in(assignment.src)
+      else:
+        self.hit("dead_assignment")
+        continue
+      live.append(assignment)
+    live.reverse()
+    return live
+
+def simplify_assignments(assignments, keep=None):
+  simplifier = Simplifier()
+  output = simplifier.simplify_assignments(assignments, keep)
+  instruments.trace(INFO, "Simplified %d assignments to %d: %s", len(assignments), len(output), simplifier.hits)
+  return output
+
+def width_operations(size):
+  # every operation at one operand width with the mask and bit count bound
+  # in, shift and rotate counts are masked the way x86 does (to 5 bits, 6
+  # for 64 bit operands) before rotates wrap at the width
+  bits = size * 8
+  mask = MASKS_BY_SIZE[size]
+  count_mask = 63 if bits == 64 else 31
+  def add(lhs, rhs):
+    return (lhs + rhs) & mask
+  def sub(lhs, rhs):
+    return (lhs - rhs) & mask
+  def xor(lhs, rhs):
+    return (lhs ^ rhs) & mask
+  def or_(lhs, rhs):
+    return (lhs | rhs) & mask
+  def and_(lhs, rhs):
+    return lhs & rhs & mask
+  def shl(value, amount):
+    return (value << (amount & count_mask)) & mask
+  def shr(value, amount):
+    return (value & mask) >> (amount & count_mask)
+  def rol(value, amount):
+    amount = (amount & count_mask) % bits
+    return ((value << amount) | (value >> (bits - amount))) & mask
+  def ror(value, amount):
+    amount = (amount & count_mask) % bits
+    return ((value >> amount) | (value << (bits - amount))) & mask
+  def not_(value):
+    return value ^ mask
+  def neg(value):
+    return -value & mask
+  def zx(value):
+    return value & mask
+  return {
+    AstNodeAdd: add,
+    AstNodeSub: sub,
+    AstNodeXor: xor,
+    AstNodeOr: or_,
+    AstNodeAnd: and_,
+    AstNodeShl: shl,
+    AstNodeShr: shr,
+    AstNodeRol: rol,
+    AstNodeRor: ror,
+    AstNodeNot: not_,
+    AstNodeNeg: neg,
+    AstNodeZx: zx,
+  }
+
+WIDTH_OPERATIONS = {size: width_operations(size) for size in MASKS_BY_SIZE}
+
+def evaluate_rol(value, amount, size=4):
+  return WIDTH_OPERATIONS[size][AstNodeRol](value, amount)
+
+def evaluate_ror(value, amount, size=4):
+  return WIDTH_OPERATIONS[size][AstNodeRor](value, amount)
+
+def evaluate_add(lhs, rhs, size=4):
+  return WIDTH_OPERATIONS[size][AstNodeAdd](lhs, rhs)
+
+def evaluate_sub(lhs, rhs, size=4):
+  return WIDTH_OPERATIONS[size][AstNodeSub](lhs, rhs)
+
+def evaluate_xor(lhs, rhs, size=4):
+  return WIDTH_OPERATIONS[size][AstNodeXor](lhs, rhs)
+
+def evaluate_or(lhs, rhs, size=4):
+  return WIDTH_OPERATIONS[size][AstNodeOr](lhs, rhs)
+
+def evaluate_and(lhs, rhs, size=4):
+  return WIDTH_OPERATIONS[size][AstNodeAnd](lhs, rhs)
+
+def evaluate_shl(value, amount, size=4):
+  return WIDTH_OPERATIONS[size][AstNodeShl](value, amount)
+
+def evaluate_shr(value, amount, size=4):
+  return WIDTH_OPERATIONS[size][AstNodeShr](value, amount)
+
+def evaluate_sx(value, size, operand_size):
+  value &= MASKS_BY_SIZE[operand_size]
+  if value >> (operand_size * 8 - 1):
+    value |= MASKS_BY_SIZE[size] ^ MASKS_BY_SIZE[operand_size]
+  return value
+
+# the vmenter reads the key pushed before the call into it from above the
+# registers, flags and return address it pushes itself. x64 pushes eight
+# more registers than x86 and every slot is 8 bytes
+KEY_READ_OFFSETS = {"esp": 0x28, "rsp": 0x90}
+# once simplified those reads fold back to the key's slot in the frame
+# vmenter_context sets up, just above the return address
+KEY_SLOT_OFFSETS = {"esp": 4, "rsp": 8}
+
+def is_key_offset(register, offset):
+  if offset == KEY_READ_OFFSETS[register.name]:
+    return True
+  return register.version == 0 and offset == KEY_SLOT_OFFSETS[register.name]
+
+def is_key_read(value, evaluate=None):
+  # evaluate turns the offset into a number when it isn't a constant yet
+  add = value.operand
+  if not isinstance(add, AstNodeAdd) or not isinstance(add.lhs, AstNodeRegisterSsa):
+    return False
+  if add.lhs.name not in KEY_READ_OFFSETS:
+    return False
+  if evaluate is not None:
+    rhs = evaluate(add.rhs)
+  elif isinstance(add.rhs, AstNodeConstant):
+    rhs = add.rhs.value
   else:
+    rhs = None
+  # any other stack read is an ordinary load through read_mem
+  return is_key_offset(add.lhs, rhs)
+
+# the evaluator dispatches on type() and then the node's size rather than
+# walking an isinstance chain for every node
+EVALUATION_BINARY_OPERATIONS = frozenset([
+  AstNodeAdd, AstNodeSub, AstNodeRol, AstNodeRor, AstNodeXor, AstNodeOr, AstNodeAnd, AstNodeShl, AstNodeShr,
+])
+
+EVALUATION_UNARY_OPERATIONS = (AstNodeNot, AstNodeNeg, AstNodeZx, AstNodeSx)
+
+class EvaluationContext(object):
+  # memoizes every SSA register and subexpression for one set of assignments
+  # so shared decrypt chains are only evaluated once, slices are walked post
+  # order off an explicit stack so depth doesn't touch the python stack
+  def __init__(self, assignments_by_register, read_mem=None):
+    self.assignments_by_register = assignments_by_register
+    self.read_mem = read_mem or read_view_int
+    self.values = {}
+    self.hits = 0
+    self.misses = 0
+
+  def is_key_read(self, value):
+    return is_key_read(value, self.evaluate)
+
+  def children(self, value):
+    kind = type(value)
+    if kind is AstNodeRegisterSsa:
+      assignment = self.assignments_by_register[value]
+      if isinstance(assignment, AstNode):
+        return (assignment.src,)
+      return ()
+    elif kind in EVALUATION_BINARY_OPERATIONS:
+      return (value.lhs, value.rhs)
+    elif kind is AstNodeReadMem:
+      if self.is_key_read(value):
+        return ()
+      return (value.operand,)
+    elif kind in EVALUATION_UNARY_OPERATIONS:
+      return (value.operand,)
+    elif kind is AstNodeConstant:
+      return ()
+    raise Exception("Couldn't evalute %s type %s" % (value, type(value)))
+
+  def evaluate(self, root):
+    values = self.values
+    if root in values:
+      self.hits += 1
+      return values[root]
+    # every reference to a node is counted once, as a miss the first time it
+    # is computed and as a hit after that, constants are stored as they are
+    # found rather than pushed
+    children = self.children
+    evaluate_node = self.evaluate_node
+    stack = [root, None]
+    while stack:
+      marker = stack.pop()
+      value = stack.pop()
+      if marker is not None:
+        self.misses += 1
+        values[value] = evaluate_node(value)
+        continue
+      if value in values:
+        self.hits += 1
+        continue
+      stack.append(value)
+      stack.append(True)
+      for child in children(value):
+        if child in values:
+          self.hits += 1
+        elif type(child) is AstNodeConstant:
+          self.misses += 1
+          values[child] = child.value
+        else:
+          stack.append(child)
+          stack.append(None)
+    return values[root]
+
+  def evaluate_node(self, value):
+    # operands are already in self.values
+    values = self.values
+    kind = type(value)
+    if kind in EVALUATION_BINARY_OPERATIONS:
+      return WIDTH_OPERATIONS[value.size][kind](values[value.lhs], values[value.rhs])
+    elif kind is AstNodeConstant:
+      return value.value
+    elif kind is AstNodeRegisterSsa:
+      assignment = self.assignments_by_register[value]
+      if isinstance(assignment, AstNode):
+        return values[assignment.src]
+      return assignment
+    elif kind is AstNodeNot or kind is AstNodeNeg or kind is AstNodeZx:
+      return WIDTH_OPERATIONS[value.size][kind](values[value.operand])
+    elif kind is AstNodeSx:
+      return evaluate_sx(values[value.operand], value.size, value.operand_size)
+    elif kind is AstNodeReadMem:
+      if self.is_key_read(value):
+        return self.assignments_by_register["key"]
+      return self.read_mem(values[value.operand], value.size)
     raise Exception("Couldn't evalute %s type %s" % (value, type(value)))
 
+  def stats(self):
+    return {"hits": self.hits, "misses": self.misses, "cached": len(self.values)}
+
+def read_view_int(address, size):
+  # unsigned little endian load served from the paged snapshot of bv
+  return get_view_memory(bv).read_int(address, size)
+
+def evaluate_value(value, assignments_by_register, context=None):
+  if context is None:
+    context = EvaluationContext(assignments_by_register)
+  return context.evaluate(value)
+
 def get_final_value(func, register_name, initial_registers):
   edi_vars = find_all_dependent_registers_from_register_name(func, register_name)
   edi_vars_by_name = {x.dest: x for x in edi_vars} | initial_registers
   return evaluate_value(edi_vars[-1].dest, edi_vars_by_name)
 
-def evaluate_vmenter(func, key):
-  initial_registers = {
-    # this feels weird but recursion makes us do dumb things
-    "key" : key,
-    AstNodeRegisterSsa("esp", 0) : AstNodeAssignment(AstNodeRegisterSsa("esp", 0), AstNodeConstant(0xFFFF0000))
+def get_final_values(func, register_names, initial_registers, compact=False, read_mem=None):
+  # read_mem defaults to the view, pass a VmContext's read_int for its stack
+  read_mem = read_mem or get_view_memory(func.view).read_int
+  if compact:
+    compact_slice = find_all_dependent_registers_from_register_names(func, register_names, compact=True)
+    with instruments.phase("evaluation"):
+      return evaluate_compact_slice(compact_slice, initial_registers, read_mem, register_names)
+  assignments, entries = find_all_dependent_registers_from_register_names(func, register_names)
+  assignments_by_register = {x.dest: x for x in assignments} | initial_registers
+  context = EvaluationContext(assignments_by_register, read_mem)
+  output = {}
+  with instruments.phase("evaluation"):
+    for register_name in register_names:
+      if register_name not in entries:
+        raise Exception("Couldn't find final value of %s" % register_name)
+      output[register_name] = context.evaluate(entries[register_name])
+  instruments.trace(INFO, "Evaluated %s: %s", register_names, context.stats())
+  return output
+
+NUMPY_TYPES_BY_SIZE = {1: "uint8", 2: "uint16", 4: "uint32", 8: "uint64"}
+NUMPY_SIGNED_TYPES_BY_SIZE = {1: "int8", 2: "int16", 4: "int32", 8: "int64"}
+
+class BatchEvaluationContext(object):
+  # same as EvaluationContext but every value is a numpy array holding one
+  # result per input, each node is evaluated once at the width of its size
+  def __init__(self, assignments_by_register, read_mem=read_view_int):
+    if numpy is None:
+      raise Exception("Batch evaluation needs numpy")
+    self.assignments_by_register = assignments_by_register
+    self.read_mem = read_mem
+    self.values = {}
+
+  def as_size(self, value, size):
+    return as_batch_size(value, size)
+
+  def is_key_read(self, value):
+    return is_key_read(value)
+
+  def children(self, value):
+    if isinstance(value, AstNodeRegisterSsa):
+      assignment = self.assignments_by_register[value]
+      if isinstance(assignment, AstNode):
+        return [assignment.src]
+      return []
+    elif isinstance(value, AstNodeBinaryOperation):
+      return [value.lhs, value.rhs]
+    elif isinstance(value, AstNodeReadMem):
+      if self.is_key_read(value):
+        return []
+      return [value.operand]
+    elif isinstance(value, (AstNodeNot, AstNodeNeg, AstNodeZx, AstNodeSx)):
+      return [value.operand]
+    return []
+
+  def evaluate(self, root):
+    stack = [(root, False)]
+    with numpy.errstate(over="ignore"):
+      while stack:
+        value, expanded = stack.pop()
+        if value in self.values:
+          continue
+        if expanded:
+          self.values[value] = self.evaluate_node(value)
+          continue
+        stack.append((value, True))
+        for child in self.children(value):
+          if child not in self.values:
+            stack.append((child, False))
+    return self.values[root]
+
+  def evaluate_node(self, value):
+    values = self.values
+    if isinstance(value, AstNodeConstant):
+      return numpy.asarray(value.value)
+    elif isinstance(value, AstNodeRegisterSsa):
+      assignment = self.assignments_by_register[value]
+      if isinstance(assignment, AstNode):
+        return values[assignment.src]
+      return numpy.asarray(assignment)
+    elif isinstance(value, AstNodeBinaryOperation):
+      return batch_binary(type(value), values[value.lhs], values[value.rhs], value.size)
+    elif isinstance(value, (AstNodeNot, AstNodeNeg, AstNodeZx)):
+      return batch_unary(type(value), values[value.operand], value.size)
+    elif isinstance(value, AstNodeSx):
+      return batch_sign_extend(values[value.operand], value.size, value.operand_size)
+    elif isinstance(value, AstNodeReadMem):
+      if self.is_key_read(value):
+        return self.as_size(self.assignments_by_register["key"], value.size)
+      return batch_read(self.read_mem, values[value.operand], value.size)
+    raise Exception("Couldn't evalute %s type %s" % (value, type(value)))
+
+# the numpy side of BatchEvaluationContext, shared with compact slices
+
+def as_batch_size(value, size):
+  return numpy.asarray(value).astype(NUMPY_TYPES_BY_SIZE[size], copy=False)
+
+def batch_binary(kind, lhs, rhs, size):
+  lhs = as_batch_size(lhs, size)
+  rhs = as_batch_size(rhs, size)
+  bits = size * 8
+  # counts are masked like width_operations, 8 and 16 bit shifts can
+  # still be wider than the operand and then give 0
+  count = rhs & (63 if bits == 64 else 31)
+  if kind is AstNodeAdd:
+    return lhs + rhs
+  elif kind is AstNodeSub:
+    return lhs - rhs
+  elif kind is AstNodeXor:
+    return lhs ^ rhs
+  elif kind is AstNodeOr:
+    return lhs | rhs
+  elif kind is AstNodeAnd:
+    return lhs & rhs
+  elif kind is AstNodeShl:
+    return numpy.where(count < bits, lhs << (count % bits), 0).astype(lhs.dtype)
+  elif kind is AstNodeShr:
+    return numpy.where(count < bits, lhs >> (count % bits), 0).astype(lhs.dtype)
+  elif kind is AstNodeRol:
+    amount = count % bits
+    return (lhs << amount) | (lhs >> ((bits - amount) % bits))
+  elif kind is AstNodeRor:
+    amount = count % bits
+    return (lhs >> amount) | (lhs << ((bits - amount) % bits))
+  raise Exception("Couldn't evaluate %s" % kind.__name__)
+
+def batch_unary(kind, operand, size):
+  operand = as_batch_size(operand, size)
+  if kind is AstNodeNot:
+    return ~operand
+  elif kind is AstNodeNeg:
+    return operand.dtype.type(0) - operand
+  elif kind is AstNodeZx:
+    return operand
+  raise Exception("Couldn't evaluate %s" % kind.__name__)
+
+def batch_sign_extend(operand, size, operand_size):
+  # through the signed types so numpy does the extension
+  operand = as_batch_size(operand, operand_size)
+  signed = operand.view(NUMPY_SIGNED_TYPES_BY_SIZE[operand_size])
+  return signed.astype(NUMPY_SIGNED_TYPES_BY_SIZE[size]).view(NUMPY_TYPES_BY_SIZE[size])
+
+def batch_read(read_mem, addresses, size):
+  # each distinct address is only read once
+  addresses = numpy.asarray(addresses)
+  unique, inverse = numpy.unique(addresses, return_inverse=True)
+  data = numpy.array([read_mem(int(x), size) for x in unique], dtype=NUMPY_TYPES_BY_SIZE[size])
+  return data[inverse].reshape(addresses.shape)
+
+def get_final_values_batch(func, register_names, initial_registers, read_mem=None, compact=False):
+  # initial_registers maps "key" and ssa registers to arrays (or plain ints)
+  if compact:
+    compact_slice = find_all_dependent_registers_from_register_names(func, register_names, compact=True)
+    with instruments.phase("evaluation"):
+      return evaluate_compact_slice_batch(compact_slice, initial_registers, read_mem or get_view_memory(func.view).read_int, register_names)
+  assignments, entries = find_all_dependent_registers_from_register_names(func, register_names)
+  assignments_by_register = {x.dest: x for x in assignments} | initial_registers
+  context = BatchEvaluationContext(assignments_by_register, read_mem or get_view_memory(func.view).read_int)
+  output = {}
+  with instruments.phase("evaluation"):
+    for register_name in register_names:
+      if register_name not in entries:
+        raise Exception("Couldn't find final value of %s" % register_name)
+      output[register_name] = context.evaluate(entries[register_name])
+  return output
+
+# compact slices, see compact_ir. opcodes are the AstNode class names so
+# conversion goes through these two tables
+
+COMPACT_CLASSES = [AST_NODE_CLASSES["AstNode" + x] for x in OPCODES]
+COMPACT_OPCODES = {kind: opcode for opcode, kind in enumerate(COMPACT_CLASSES)}
+
+def add_compact_node(compact, kind, operands):
+  # operands as in AstNode.operands() with node operands already converted
+  opcode = COMPACT_OPCODES.get(kind)
+  if opcode is None:
+    raise Exception("Couldn't compact %s" % kind.__name__)
+  if kind is AstNodeConstant:
+    return compact.add(opcode, value=operands[0])
+  elif kind is AstNodeRegisterSsa:
+    return compact.add_register(*operands)
+  elif kind is AstNodeSx:
+    return compact.add(opcode, operands[1], operands[0], operands[2])
+  elif kind is AstNodeFlagBit:
+    return compact.add(opcode, lhs=compact.name_index(operands[0]), value=operands[1])
+  elif kind is AstNodeBswap:
+    return compact.add(opcode, lhs=operands[0])
+  elif issubclass(kind, AstNodeBinaryOperation):
+    return compact.add(opcode, operands[2], operands[0], operands[1])
+  return compact.add(opcode, operands[1], operands[0])
+
+def compact_assignments(assignments, entries=None):
+  # assignments in dependency order, as slicing gives them
+  compact = CompactSlice()
+  indexes = {}
+  def convert(root):
+    stack = [(root, False)]
+    while stack:
+      value, expanded = stack.pop()
+      if value in indexes:
+        continue
+      if not expanded:
+        stack.append((value, True))
+        stack += [(x, False) for x in value.operands() if isinstance(x, AstNode) and x not in indexes]
+        continue
+      operands = [indexes[x] if isinstance(x, AstNode) else x for x in value.operands()]
+      indexes[value] = add_compact_node(compact, type(value), operands)
+    return indexes[root]
+  for assignment in assignments:
+    if isinstance(assignment, AstNodeMemoryStore):
+      compact.add_store(convert(assignment.dest), convert(assignment.src), assignment.size)
+    else:
+      source = convert(assignment.src)
+      compact.define(convert(assignment.dest), source)
+  for name, value in (entries or {}).items():
+    compact.entries[name] = convert(value)
+  return compact.freeze()
+
+def compact_serialized_assignments(data):
+  # straight from serialize_assignments' node table, the table is already in
+  # post order so every operand is converted before its user
+  compact = CompactSlice()
+  indexes = []
+  for class_name, operands in data["nodes"]:
+    operands = [indexes[x[0]] if isinstance(x, list) else x for x in operands]
+    if class_name == "AstNodeMemoryStore":
+      compact.add_store(operands[0], operands[1], operands[2])
+      indexes.append(None)
+    elif class_name in ["AstNodeAssignment", "AstNodeAssignmentPartial"]:
+      compact.define(operands[0], operands[1])
+      indexes.append(None)
+    else:
+      indexes.append(add_compact_node(compact, AST_NODE_CLASSES[class_name], operands))
+  compact.entries = {name: indexes[x] for name, x in data["entries"].items()}
+  return compact.freeze()
+
+def expand_compact_slice(compact):
+  # back to (assignments, entries), stores come after every assignment
+  nodes = []
+  opcodes, sizes, lhs, rhs, values = compact.opcodes, compact.sizes, compact.lhs, compact.rhs, compact.values
+  for index in range(len(compact)):
+    kind = COMPACT_CLASSES[opcodes[index]]
+    if kind is AstNodeConstant:
+      node = AstNodeConstant(values[index])
+    elif kind is AstNodeRegisterSsa:
+      node = AstNodeRegisterSsa(compact.names[lhs[index]], rhs[index])
+    elif kind is AstNodeSx:
+      node = AstNodeSx(nodes[lhs[index]], sizes[index], rhs[index])
+    elif kind is AstNodeFlagBit:
+      node = AstNodeFlagBit(compact.names[lhs[index]], values[index])
+    elif kind is AstNodeBswap:
+      node = AstNodeBswap(nodes[lhs[index]])
+    elif issubclass(kind, AstNodeBinaryOperation):
+      node = kind(nodes[lhs[index]], nodes[rhs[index]], sizes[index])
+    else:
+      node = kind(nodes[lhs[index]], sizes[index])
+    nodes.append(node)
+  assignments = [AstNodeAssignment(nodes[dest], nodes[src]) for dest, src in zip(compact.assignment_dests, compact.assignment_srcs)]
+  assignments += [AstNodeMemoryStore(nodes[dest], nodes[src], size) for dest, src, size in zip(compact.store_dests, compact.store_srcs, compact.store_sizes)]
+  return assignments, {name: nodes[x] for name, x in compact.entries.items()}
+
+def compact_key_reads(compact):
+  # ReadMem node -> [] for every read is_key_read would take as the key, so
+  # the stack pointer itself never needs a value
+  output = {}
+  read_mem = COMPACT_OPCODES[AstNodeReadMem]
+  add = COMPACT_OPCODES[AstNodeAdd]
+  register = COMPACT_OPCODES[AstNodeRegisterSsa]
+  constant = COMPACT_OPCODES[AstNodeConstant]
+  opcodes, lhs, rhs = compact.opcodes, compact.lhs, compact.rhs
+  for index in range(len(compact)):
+    if opcodes[index] != read_mem or opcodes[lhs[index]] != add:
+      continue
+    base, offset = lhs[lhs[index]], rhs[lhs[index]]
+    if opcodes[base] != register or compact.names[lhs[base]] not in KEY_READ_OFFSETS or opcodes[offset] != constant:
+      continue
+    if is_key_offset(AstNodeRegisterSsa(compact.names[lhs[base]], rhs[base]), compact.values[offset]):
+      output[index] = []
+  return output
+
+def compact_evaluation_plan(compact, register_names):
+  # (names, root nodes, needed nodes, key reads)
+  if register_names is None:
+    register_names = list(compact.entries)
+  roots = []
+  for register_name in register_names:
+    if register_name not in compact.entries:
+      raise Exception("Couldn't find final value of %s" % register_name)
+    roots.append(compact.entries[register_name])
+  key_reads = compact_key_reads(compact)
+  return register_names, roots, compact.needed(roots, key_reads), key_reads
+
+def compact_initial_register(compact, index, initial_registers):
+  register = AstNodeRegisterSsa(compact.names[compact.lhs[index]], compact.rhs[index])
+  if register not in initial_registers:
+    raise Exception("Couldn't evaluate %s, it has no definition or initial value" % register)
+  return initial_registers[register]
+
+def evaluate_compact_slice(compact, initial_registers, read_mem=None, register_names=None):
+  # one forward pass over the arrays, only touching nodes the entries need.
+  # initial_registers is as for get_final_values
+  read_mem = read_mem or read_view_int
+  register_names, roots, needed, key_reads = compact_evaluation_plan(compact, register_names)
+  opcodes, sizes, lhs, rhs, constants = compact.opcodes, compact.sizes, compact.lhs, compact.rhs, compact.values
+  values = [None] * len(compact)
+  for index in range(len(compact)):
+    if not needed[index]:
+      continue
+    kind = COMPACT_CLASSES[opcodes[index]]
+    if kind in EVALUATION_BINARY_OPERATIONS:
+      value = WIDTH_OPERATIONS[sizes[index]][kind](values[lhs[index]], values[rhs[index]])
+    elif kind is AstNodeConstant:
+      value = constants[index]
+    elif kind is AstNodeRegisterSsa:
+      definition = constants[index]
+      if definition:
+        value = values[definition - 1]
+      else:
+        value = compact_initial_register(compact, index, initial_registers)
+    elif kind is AstNodeNot or kind is AstNodeNeg or kind is AstNodeZx:
+      value = WIDTH_OPERATIONS[sizes[index]][kind](values[lhs[index]])
+    elif kind is AstNodeSx:
+      value = evaluate_sx(values[lhs[index]], sizes[index], rhs[index])
+    elif kind is AstNodeReadMem:
+      if index in key_reads:
+        value = initial_registers["key"]
+      else:
+        value = read_mem(values[lhs[index]], sizes[index])
+    else:
+      raise Exception("Couldn't evalute %s" % compact.describe(index))
+    values[index] = value
+  return {name: values[root] for name, root in zip(register_names, roots)}
+
+def evaluate_compact_slice_batch(compact, initial_registers, read_mem=read_view_int, register_names=None):
+  # evaluate_compact_slice with numpy arrays (or plain ints) for the initial
+  # registers, same as get_final_values_batch
+  if numpy is None:
+    raise Exception("Batch evaluation needs numpy")
+  register_names, roots, needed, key_reads = compact_evaluation_plan(compact, register_names)
+  opcodes, sizes, lhs, rhs, constants = compact.opcodes, compact.sizes, compact.lhs, compact.rhs, compact.values
+  values = [None] * len(compact)
+  with numpy.errstate(over="ignore"):
+    for index in range(len(compact)):
+      if not needed[index]:
+        continue
+      kind = COMPACT_CLASSES[opcodes[index]]
+      if kind in EVALUATION_BINARY_OPERATIONS:
+        value = batch_binary(kind, values[lhs[index]], values[rhs[index]], sizes[index])
+      elif kind is AstNodeConstant:
+        value = numpy.asarray(constants[index])
+      elif kind is AstNodeRegisterSsa:
+        definition = constants[index]
+        if definition:
+          value = values[definition - 1]
+        else:
+          value = numpy.asarray(compact_initial_register(compact, index, initial_registers))
+      elif kind is AstNodeNot or kind is AstNodeNeg or kind is AstNodeZx:
+        value = batch_unary(kind, values[lhs[index]], sizes[index])
+      elif kind is AstNodeSx:
+        value = batch_sign_extend(values[lhs[index]], sizes[index], rhs[index])
+      elif kind is AstNodeReadMem:
+        if index in key_reads:
+          value = as_batch_size(initial_registers["key"], sizes[index])
+        else:
+          value = batch_read(read_mem, values[lhs[index]], sizes[index])
+      else:
+        raise Exception("Couldn't evalute %s" % compact.describe(index))
+      values[index] = value
+  return {name: values[root] for name, root in zip(register_names, roots)}
+
+class SliceCompiler(object):
+  # turns an ordered assignment list into the source of one python function
+  # taking (initial_registers, read_mem), every shared node becomes one local
+  # without key_reads the [esp+0x28] read goes through read_mem like the rest
+  #
+  # for compile_batch, varying holds the initial registers (and "key") that
+  # change between rows. only nodes depending on one of those go in the loop,
+  # everything else is computed once before it
+  operators = {
+    AstNodeAdd: "+",
+    AstNodeSub: "-",
+    AstNodeXor: "^",
+    AstNodeOr: "|",
+    AstNodeAnd: "&",
+  }
+
+  def __init__(self, assignments, key_reads=True, varying=()):
+    self.assignments_by_register = {x.dest: x for x in assignments if not isinstance(x, AstNodeMemoryStore)}
+    self.key_reads = key_reads
+    self.varying = set(varying)
+    self.varies = {}
+    self.names = {}
+    self.lines = []
+    self.loop_lines = []
+    self.constants = {}
+
+  def is_key_read(self, value):
+    return self.key_reads and is_key_read(value)
+
+  def children(self, value):
+    if isinstance(value, AstNodeRegisterSsa):
+      if value in self.assignments_by_register:
+        return [self.assignments_by_register[value].src]
+      return []
+    elif isinstance(value, AstNodeBinaryOperation):
+      return [value.lhs, value.rhs]
+    elif isinstance(value, AstNodeReadMem):
+      if self.is_key_read(value):
+        return []
+      return [value.operand]
+    elif isinstance(value, (AstNodeNot, AstNodeNeg, AstNodeZx, AstNodeSx)):
+      return [value.operand]
+    return []
+
+  def constant(self, value):
+    name = "k%d" % len(self.constants)
+    self.constants[name] = value
+    return name
+
+  def temporary(self, expression, varies=False):
+    name = "v%d" % (len(self.lines) + len(self.loop_lines))
+    if varies:
+      self.loop_lines.append("    %s = %s" % (name, expression))
+    else:
+      self.lines.append("  %s = %s" % (name, expression))
+    return name
+
+  def node_varies(self, value):
+    if isinstance(value, AstNodeRegisterSsa) and value not in self.assignments_by_register:
+      return value in self.varying
+    if isinstance(value, AstNodeReadMem) and self.is_key_read(value):
+      return "key" in self.varying
+    return any(self.varies[x] for x in self.children(value))
+
+  def initial_register(self, value):
+    if value in self.varying:
+      return self.temporary("row[%s]" % self.constant(value), True)
+    return self.temporary("initial_registers[%s]" % self.constant(value))
+
+  def width_function(self, kind, size):
+    # shift and rotate by a computed amount go through width_operations
+    name = "%s_%d" % (kind.__name__[len("AstNode"):].lower(), size)
+    self.constants[name] = WIDTH_OPERATIONS[size][kind]
+    return name
+
+  def emit_shift(self, value, temporary):
+    names = self.names
+    lhs = names[value.lhs]
+    if not isinstance(value.rhs, AstNodeConstant):
+      return temporary("%s(%s, %s)" % (self.width_function(type(value), value.size), lhs, names[value.rhs]))
+    bits = value.size * 8
+    mask = hex(MASKS_BY_SIZE[value.size])
+    count = value.rhs.value & (63 if bits == 64 else 31)
+    if isinstance(value, AstNodeShl):
+      return temporary("(%s << %d) & %s" % (lhs, count, mask))
+    elif isinstance(value, AstNodeShr):
+      return temporary("(%s & %s) >> %d" % (lhs, mask, count))
+    amount = count % bits
+    if amount == 0:
+      return temporary("%s & %s" % (lhs, mask))
+    if isinstance(value, AstNodeRor):
+      amount = bits - amount
+    return temporary("((%s << %d) | (%s >> %d)) & %s" % (lhs, amount, lhs, bits - amount, mask))
+
+  def emit_node(self, value):
+    names = self.names
+    varies = self.varies[value] = self.node_varies(value)
+    temporary = lambda expression: self.temporary(expression, varies)
+    if isinstance(value, AstNodeConstant):
+      return hex(value.value)
+    elif isinstance(value, AstNodeRegisterSsa):
+      if value in self.assignments_by_register:
+        return names[self.assignments_by_register[value].src]
+      return self.initial_register(value)
+    elif isinstance(value, (AstNodeShl, AstNodeShr, AstNodeRol, AstNodeRor)):
+      return self.emit_shift(value, temporary)
+    elif isinstance(value, AstNodeBinaryOperation):
+      operator = self.operators[type(value)]
+      return temporary("(%s %s %s) & %s" % (names[value.lhs], operator, names[value.rhs], hex(MASKS_BY_SIZE[value.size])))
+    elif isinstance(value, AstNodeZx):
+      return names[value.operand]
+    elif isinstance(value, AstNodeSx):
+      return temporary("evaluate_sx(%s, %s, %s)" % (names[value.operand], value.size, value.operand_size))
+    elif isinstance(value, AstNodeNot):
+      return temporary("%s ^ %s" % (names[value.operand], hex(MASKS_BY_SIZE[value.size])))
+    elif isinstance(value, AstNodeNeg):
+      return temporary("-%s & %s" % (names[value.operand], hex(MASKS_BY_SIZE[value.size])))
+    elif isinstance(value, AstNodeReadMem):
+      if self.is_key_read(value):
+        return temporary('%s["key"]' % ("row" if varies else "initial_registers"))
+      return temporary("read_mem(%s, %s)" % (names[value.operand], value.size))
+    else:
+      raise Exception("Couldn't compile %s type %s" % (value, type(value)))
+
+  def emit(self, root):
+    stack = [(root, False)]
+    while stack:
+      value, expanded = stack.pop()
+      if value in self.names:
+        continue
+      if expanded:
+        self.names[value] = self.emit_node(value)
+        continue
+      stack.append((value, True))
+      for child in self.children(value):
+        if child not in self.names:
+          stack.append((child, False))
+    return self.names[root]
+
+  def compile(self, entries, stores=None):
+    # with stores the function returns (values, [(address, size, value), ...])
+    results = ["%r: %s" % (name, self.emit(root)) for name, root in entries.items()]
+    source = "def compiled_slice(initial_registers, read_mem):\n"
+    if stores is None:
+      source += "".join(line + "\n" for line in self.lines)
+      source += "  return {%s}\n" % ", ".join(results)
+    else:
+      writes = ["(%s, %d, %s)" % (self.emit(x.dest), x.size, self.emit(x.src)) for x in stores]
+      source += "".join(line + "\n" for line in self.lines)
+      source += "  return {%s}, [%s]\n" % (", ".join(results), ", ".join(writes))
+    namespace = dict(self.constants)
+    namespace["evaluate_sx"] = evaluate_sx
+    exec(compile(source, "<compiled slice>", "exec"), namespace)
+    compiled_slice = namespace["compiled_slice"]
+    compiled_slice.source = source
+    return compiled_slice
+
+  def compile_ordered(self, assignments, entries):
+    # assignments in program order, stores included. the function takes
+    # (initial_registers, read_mem, write_mem) and does each store through
+    # write_mem as it comes, so later loads see it
+    for assignment in assignments:
+      if not isinstance(assignment, AstNodeMemoryStore):
+        self.emit(assignment.dest)
+        continue
+      self.lines.append("  write_mem(%s, %d, %s)" % (self.emit(assignment.dest), assignment.size, self.emit(assignment.src)))
+      # a load interned before the store has to be read again after it
+      self.names = {x: name for x, name in self.names.items() if isinstance(x, (AstNodeRegisterSsa, AstNodeConstant))}
+    results = ["%r: %s" % (name, self.emit(root)) for name, root in entries.items()]
+    source = "def compiled_slice(initial_registers, read_mem, write_mem):\n"
+    source += "".join(line + "\n" for line in self.lines)
+    source += "  return {%s}\n" % ", ".join(results)
+    namespace = dict(self.constants)
+    namespace["evaluate_sx"] = evaluate_sx
+    exec(compile(source, "<compiled slice>", "exec"), namespace)
+    compiled_slice = namespace["compiled_slice"]
+    compiled_slice.source = source
+    return compiled_slice
+
+  def compile_batch(self, entries):
+    # one call evaluates every row: rows are dicts holding the varying initial
+    # registers, the rest come from initial_registers, returns a dict per row
+    results = ["%r: %s" % (name, self.emit(root)) for name, root in entries.items()]
+    source = "def compiled_batch(initial_registers, rows, read_mem):\n"
+    source += "".join(line + "\n" for line in self.lines)
+    source += "  output = []\n"
+    source += "  for row in rows:\n"
+    source += "".join(line + "\n" for line in self.loop_lines)
+    source += "    output.append({%s})\n" % ", ".join(results)
+    source += "  return output\n"
+    namespace = dict(self.constants)
+    namespace["evaluate_sx"] = evaluate_sx
+    exec(compile(source, "<compiled batch>", "exec"), namespace)
+    compiled_batch = namespace["compiled_batch"]
+    compiled_batch.source = source
+    return compiled_batch
+
+def compile_assignments(assignments, entries, stores=None, key_reads=True, varying=None):
+  if varying is not None:
+    return SliceCompiler(assignments, key_reads, varying).compile_batch(entries)
+  return SliceCompiler(assignments, key_reads).compile(entries, stores)
+
+# compiled slices live as long as the ssa index they were built from
+compiled_slices = weakref.WeakKeyDictionary()
+
+def compile_final_values(func, register_names, handler=False, key_reads=True, varying=None):
+  # with handler the compiled slice also returns the handler's memory writes
+  # and its jump target as "jump", see find_all_dependent_registers_from_register_names
+  # with varying it's a batch function instead, see SliceCompiler.compile_batch
+  index = function_index(func)
+  cache = compiled_slices.setdefault(index, {})
+  if varying is not None:
+    varying = frozenset(varying)
+  key = (tuple(register_names), handler, key_reads, varying)
+  if key not in cache:
+    assignments, entries = find_all_dependent_registers_from_register_names(func, register_names, handler)
+    for register_name in register_names:
+      if register_name not in entries:
+        raise Exception("Couldn't find final value of %s" % register_name)
+    keep = set()
+    for value in entries.values():
+      keep |= registers_in(value)
+    assignments = simplify_assignments(assignments, keep=keep)
+    stores = None
+    if handler:
+      stores = [x for x in assignments if isinstance(x, AstNodeMemoryStore)]
+    cache[key] = compile_assignments(assignments, entries, stores, key_reads, varying)
+  return cache[key]
+
+VMENTER_REGISTERS = ["edi", "esp", "ebp", "ebx", "esi"]
+VMENTER_REGISTERS_X64 = ["rdi", "rsp", "rbp", "rbx", "rsi"]
+VMENTER_REGISTERS_BY_ADDRESS_SIZE = {4: VMENTER_REGISTERS, 8: VMENTER_REGISTERS_X64}
+
+# where the made up native stack starts, it runs STACK_SIZE either way
+STACK_TOP = 0xFFFF0000
+STACK_SIZE = 0x10000
+
+def vmenter_context(view, address_size, key, memory=None):
+  # the native state a vmenter starts in: the stack pointer at STACK_TOP on
+  # the return address of the call into the vmenter, with the key pushed
+  # before that call just above it. the vmenter's own pushes and the vm
+  # scratch area (pregs) it sets up below them are ordinary stack writes
+  stack_pointer = VM_ROLES_BY_ADDRESS_SIZE[address_size]["pregs"]
+  context = VmContext(memory if memory is not None else get_view_memory(view), address_size, stack_pointer,
+    STACK_TOP - STACK_SIZE, STACK_TOP + STACK_SIZE)
+  context.registers = {x: 0 for x in TRACE_REGISTERS_BY_ADDRESS_SIZE[address_size]}
+  context.registers[stack_pointer] = STACK_TOP + 2 * address_size
+  context.push(key)
+  context.push(0)
+  return context
+
+def context_registers(context):
+  # the context's registers as the ssa registers a slice starts from
+  return {AstNodeRegisterSsa(name, 0): value for name, value in context.registers.items()}
+
+def vmenter_initial_registers(address_size, key):
+  # for batch evaluation, where every row has its own key and so the key
+  # read is an input rather than a load from the frame, see is_key_read.
+  # the registers start as they do in vmenter_context
+  stack_pointer = VM_ROLES_BY_ADDRESS_SIZE[address_size]["pregs"]
+  initial_registers = {ssa: 0 for _, ssa in INITIAL_TRACE_REGISTERS[address_size]}
+  initial_registers[AstNodeRegisterSsa(stack_pointer, 0)] = STACK_TOP
+  initial_registers["key"] = key
+  return initial_registers
+
+def ordered_slice(func, register_names, handler=False):
+  # the slice of register_names and every store, in program order rather
+  # than dependency order. vmenters and handlers are straight line code so
+  # that is a dependency order too, and it's the order the stores have to
+  # happen in. with handler the jump target is entry "jump"
+  def load():
+    index = function_index(func)
+    lift = lift_snapshot_assignment if isinstance(index, SnapshotIndex) else lift_assignment
+    ordered = []
+    def lift_in_order(instruction):
+      lifted, registers = lift(instruction)
+      ordered.append((instruction.instr_index, lifted))
+      return lifted, registers
+    base_assignments = []
+    entries = {}
+    for register_name in register_names:
+      base_assignment = find_latest_definition(index, register_name)
+      if base_assignment:
+        base_assignments.append(base_assignment)
+        entries[register_name] = lift_definition_dest(base_assignment)
+    base_assignments += find_store_instructions(index)
+    if handler:
+      base_assignments += jump_target_definitions(index, entries)
+    slice_assignments(index, base_assignments, lift_in_order, index_liveness(index, register_names))
+    return [lifted for _, lifted in sorted(ordered, key=lambda x: x[0])], entries
+  return session_result(func, ("ordered", tuple(register_names), handler), load)
+
+def compile_in_order(func, register_names, handler=False):
+  # see SliceCompiler.compile_ordered, stores go through write_mem as they
+  # happen so later loads in the same function see them
+  index = function_index(func)
+  cache = compiled_slices.setdefault(index, {})
+  key = ("ordered", tuple(register_names), handler)
+  if key not in cache:
+    assignments, entries = ordered_slice(func, register_names, handler)
+    for register_name in register_names:
+      if register_name not in entries:
+        raise Exception("Couldn't find final value of %s" % register_name)
+    cache[key] = SliceCompiler(assignments, key_reads=False).compile_ordered(assignments, entries)
+  return cache[key]
+
+def evaluate_vmenter(func, key=None, context=None):
+  # context is a VmContext to start from instead of a fresh vmenter_context
+  # for key, the vmenter's stores are written to it
+  address_size = function_address_size(func)
+  if context is None:
+    if key is None:
+      raise Exception("Couldn't evaluate vmenter without a key or a context")
+    context = vmenter_context(func.view, address_size, key)
+  elif key is not None:
+    raise Exception("Couldn't evaluate vmenter with both a key and a context, push the key in the context instead")
+  compiled_slice = compile_in_order(func, VMENTER_REGISTERS_BY_ADDRESS_SIZE[address_size])
+  with instruments.phase("evaluation"):
+    return compiled_slice(context_registers(context), context.read_int, context.write_int)
+
+def evaluate_vmenter_batch(func, inputs):
+  # inputs are keys or initial register maps (overriding the defaults
+  # evaluate_vmenter uses), gives back one result dict per input. the slice
+  # is only compiled once per set of varying registers and everything that
+  # doesn't depend on them, memory reads included, is evaluated once
+  address_size = function_address_size(func)
+  initial_registers = vmenter_initial_registers(address_size, 0)
+  rows = [{"key": x} if isinstance(x, int) else x for x in inputs]
+  varying = set()
+  for row in rows:
+    varying.update(row)
+  # a register only some rows give starts at zero in the others, like the
+  # native registers do
+  for name in varying:
+    initial_registers.setdefault(name, 0)
+  rows = [initial_registers | row for row in rows]
+  compiled_batch = compile_final_values(func, VMENTER_REGISTERS_BY_ADDRESS_SIZE[address_size], varying=varying)
+  view_read_int = get_view_memory(func.view).read_int
+  stack_reads = []
+  def read_mem(address, size):
+    # the batch slice doesn't do the vmenter's stores, so only the key read
+    # (an input here) can come from the frame
+    if STACK_TOP - STACK_SIZE <= address < STACK_TOP + STACK_SIZE:
+      stack_reads.append(address)
+      return 0
+    return view_read_int(address, size)
+  with instruments.phase("evaluation"):
+    output = compiled_batch(initial_registers, rows, read_mem)
+  if not stack_reads:
+    return output
+  # the vmenter reads its own frame, which can hold what it pushed, so each
+  # row runs against a context of its own like evaluate_vmenter does
+  instruments.trace(INFO, "%s reads its stack frame, evaluating %d rows one at a time", func.name, len(rows))
+  return [evaluate_vmenter(func, context=vmenter_row_context(func.view, address_size, x)) for x in rows]
+
+def vmenter_row_context(view, address_size, row):
+  # vmenter_context with a batch row's initial registers, the key goes just
+  # above wherever the row's stack pointer is
+  context = vmenter_context(view, address_size, row["key"])
+  for register, value in row.items():
+    if isinstance(register, AstNodeRegisterSsa):
+      context.registers[register.name] = value
+  stack_pointer = context.registers[context.stack_pointer]
+  if stack_pointer != STACK_TOP:
+    context.write_int(stack_pointer + address_size, address_size, row["key"])
+  return context
+
+# following vip through the handlers. each handler is compiled once into a
+# function from the registers on entry to its registers on exit and its jump
+# target, then the tracer just keeps calling them. stores go through to the
+# tracer's context as they happen, so a handler reading back what it just
+# wrote sees it
+
+TRACE_REGISTERS = ["eax", "ebx", "ecx", "edx", "esi", "edi", "ebp", "esp"]
+TRACE_REGISTERS_BY_ADDRESS_SIZE = {4: TRACE_REGISTERS, 8: X64_REGISTERS}
+INITIAL_TRACE_REGISTERS = {
+  size: [(x, AstNodeRegisterSsa(x, 0)) for x in names] for size, names in TRACE_REGISTERS_BY_ADDRESS_SIZE.items()
+}
+
+class HandlerSemantics(object):
+  def __init__(self, func, address_size=4):
+    index = function_index(func)
+    exit_instruction = find_exit_instruction(index)
+    # a ret (or falling off the end) leaves the vm
+    self.exits = exit_instruction is None or is_return(exit_instruction)
+    self.initial_registers = INITIAL_TRACE_REGISTERS[address_size]
+    # handlers only hand the vm context on to each other, anything else they
+    # leave in a register is junk
+    self.register_names = [x for x in VM_ROLES_BY_ADDRESS_SIZE[address_size].values() if find_latest_definition(index, x)]
+    # in program order, a handler (or the vmenter) that pushes and then
+    # reads the stack back has to see its own store
+    self.compiled = compile_in_order(func, self.register_names, handler=True)
+
+  def __call__(self, registers, read_mem, write_mem):
+    initial_registers = {ssa: registers[name] for name, ssa in self.initial_registers}
+    return self.compiled(initial_registers, read_mem, write_mem)
+
+class TraceStep(object):
+  __slots__ = ("step", "handler", "vip", "vsp", "opcode", "stores")
+
+  def __init__(self, step, handler, vip, vsp, opcode, stores):
+    self.step = step
+    self.handler = handler
+    self.vip = vip
+    self.vsp = vsp
+    self.opcode = opcode
+    self.stores = stores
+
+  def __repr__(self):
+    opcode = "-" if self.opcode is None else hex(self.opcode)
+    return "%d: %s vip=%s vsp=%s opcode=%s" % (self.step, hex(self.handler), hex(self.vip), hex(self.vsp), opcode)
+
+class VmTracer(object):
+  # context is the VmContext the vm runs against, semantics can be shared
+  # between tracers of the same view
+  def __init__(self, bv, context, handler, address_size=4, semantics=None):
+    self.bv = bv
+    self.address_size = address_size
+    self.roles = VM_ROLES_BY_ADDRESS_SIZE[address_size]
+    self.context = context
+    for name in TRACE_REGISTERS_BY_ADDRESS_SIZE[address_size]:
+      context.registers.setdefault(name, 0)
+    self.handler = handler
+    self.semantics = semantics if semantics is not None else {}
+    self.steps = 0
+    self.finished = False
+    # vip means nothing until the vmenter has run
+    self.vmenter = None
+
+  @classmethod
+  def from_vmenter(cls, func, key, memory=None):
+    # the vmenter is the first handler, memory is what the context reads
+    # through to and defaults to the view
+    address_size = function_address_size(func)
+    tracer = cls(func.view, vmenter_context(func.view, address_size, key, memory), func.start, address_size)
+    tracer.vmenter = func.start
+    return tracer
+
+  @property
+  def registers(self):
+    return self.context.registers
+
+  def fork(self):
+    # a tracer that carries on from here independently, the context's
+    # memory and the compiled handlers are shared rather than copied
+    tracer = VmTracer(self.bv, self.context.fork(), self.handler, self.address_size, self.semantics)
+    tracer.steps = self.steps
+    tracer.finished = self.finished
+    tracer.vmenter = self.vmenter
+    return tracer
+
+  def read_mem(self, address, size):
+    return self.context.read_int(address, size)
+
+  def get_semantics(self, address):
+    semantics = self.semantics.get(address)
+    if semantics is None:
+      func = self.bv.get_function_at(address)
+      if func is None:
+        return None
+      semantics = self.semantics[address] = HandlerSemantics(func, self.address_size)
+    return semantics
+
+  def step(self):
+    # runs the handler at self.handler, None once there's nothing left to run
+    if self.finished:
+      return None
+    semantics = self.get_semantics(self.handler)
+    if semantics is None:
+      instruments.trace(INFO, "No function at %s, stopping trace", hex(self.handler))
+      self.finished = True
+      return None
+    roles = find_important_registers(self.registers, self.address_size)
+    opcode = None
+    if self.handler != self.vmenter:
+      opcode = self.read_mem(roles["vip"], 1)
+    stores = []
+    def write_mem(address, size, value):
+      stores.append((address, size, value))
+      self.context.write_int(address, size, value)
+    with instruments.phase("evaluation"):
+      values = semantics(self.registers, self.read_mem, write_mem)
+    for name in semantics.register_names:
+      self.registers[name] = values[name]
+    step = TraceStep(self.steps, self.handler, roles["vip"], roles["vsp"], opcode, stores)
+    instruments.trace(TRACE, "Traced %s", step)
+    self.steps += 1
+    if semantics.exits:
+      instruments.trace(INFO, "Handler %s leaves the vm, stopping trace", hex(self.handler))
+      self.finished = True
+    else:
+      self.handler = values.get("jump", self.registers[self.roles["pfunc"]])
+    return step
+
+  def run(self, max_steps=None):
+    instruments.refresh()
+    while max_steps is None or self.steps < max_steps:
+      step = self.step()
+      if step is None:
+        return
+      yield step
+
+def trace_vm(vmenter, key, max_steps=10000):
+  return list(VmTracer.from_vmenter(vmenter, key).run(max_steps))
+
+# exporting to plain data so handlers can be lifted in other processes
+# expressions become [operation name, size, operands...] with nested lists
+# for subexpressions, instructions become [index, il, defines, uses]
+
+class SnapshotLifterBackend(LifterBackend):
+  # [operation name, size, operands...] with nested lists for subexpressions
+  def constant(self, value, size):
+    return ["LLIL_CONST", size, value]
+
+  def register(self, name, version, size):
+    return ["LLIL_REG_SSA", size, name, version]
+
+  def register_partial(self, full_name, version, partial_name, size):
+    return ["LLIL_REG_SSA_PARTIAL", size, full_name, version, partial_name]
+
+  def load(self, operand, size):
+    return ["LLIL_LOAD_SSA", size, operand]
+
+  def unary(self, operation, operand, size):
+    return [operation, size, operand]
+
+  def sign_extend(self, operand, size, operand_size):
+    return ["LLIL_SX", size, operand]
+
+  def binary(self, operation, lhs, rhs, size):
+    return [operation, size, lhs, rhs]
+
+  def flag_bit(self, value):
+    return self.unknown(value)
+
+  def unknown(self, value):
+    # kept so lifting can say what it didn't understand
+    return [value.operation.name, value.size]
+
+SNAPSHOT_LIFTER_BACKEND = SnapshotLifterBackend()
+
+def export_expression(expression):
+  return lift_expression(expression, SNAPSHOT_LIFTER_BACKEND)[0]
+
+def export_instruction(instruction):
+  name = instruction.operation.name
+  if type(instruction) == LowLevelILSetRegSsa:
+    il = [name, instruction.size, instruction.dest.reg.name, instruction.dest.version, export_expression(instruction.src)]
+  elif type(instruction) == LowLevelILStoreSsa:
+    il = [name, instruction.size, export_expression(instruction.dest), export_expression(instruction.src)]
+  elif type(instruction) == LowLevelILIntrinsicSsa and type(instruction.intrinsic) == ILIntrinsic:
+    output = instruction.output[0]
+    source = instruction.param.src[0].src
+    il = [name, instruction.size, output.reg_or_flag.name, output.version, source.reg.name, source.version]
+  elif type(instruction) == LowLevelILSetRegSsaPartial:
+    full = instruction.full_reg
+    il = [name, instruction.size, full.reg.name, full.version, instruction.dest.name, export_expression(instruction.src)]
+  elif type(instruction) in [LowLevelILJump, LowLevelILRet]:
+    il = [name, instruction.size, export_expression(instruction.dest)]
+  else:
+    il = [name, instruction.size]
+  defines = [list(x) for x in defined_registers(instruction)]
+  uses = [[x.reg.name, x.version] for x in used_registers(instruction)]
+  return [instruction.instr_index, il, defines, uses]
+
+def function_liveness(func):
+  return index_liveness(get_ssa_index(func))
+
+def prune_report(func):
+  report = function_liveness(func).report()
+  instruments.trace(INFO, "%s: %d of %d instructions are dead (%d flag writes)", func.name, report["dead"], report["instructions"], report["dead_flag_writes"])
+  return report
+
+def export_function_snapshot(func):
+  # dead instructions are left out, so they're never lifted or shipped
+  index = get_ssa_index(func)
+  liveness = function_liveness(func)
+  instructions = [export_instruction(x) for x in index.instructions if liveness.is_live(x)]
+  instruments.count("pruned_instructions", len(index.instructions) - len(instructions))
+  return {
+    "start": func.start,
+    "name": func.name,
+    "blocks": [[x.start, x.length] for x in sorted(func.basic_blocks, key=lambda x: x.start)],
+    "instructions": instructions,
   }
+
+def export_view_snapshot(bv, path, functions=None, memory_ranges=None):
+  # everything needed to slice, lift and evaluate the functions headless,
+  # memory defaults to every segment so handler bytecode reads still work
+  if functions is None:
+    functions = [x for x in bv.functions if is_candidate_handler(x)]
+  if memory_ranges is None:
+    memory_ranges = [(x.start, bv.read(x.start, x.end - x.start)) for x in bv.segments]
+  snapshots = [export_function_snapshot(x) for x in functions]
+  size = write_snapshot_file(path, snapshots, memory_ranges)
+  instruments.trace(INFO, "Exported %d functions and %d memory ranges to %s (%d bytes)", len(snapshots), len(memory_ranges), path, size)
+  return size
+
+def load_view_snapshot(path):
+  # returns a ReplayView, its functions can be passed anywhere a live
+  # function is taken (find_all_memory_writes, get_final_values, ...)
+  return read_snapshot_file(path)
+
+class SnapshotInstruction(object):
+  def __init__(self, instr_index, il, defines, uses):
+    self.instr_index = instr_index
+    self.il = il
+    self.operation = il[0]
+    self.defines = [tuple(x) for x in defines]
+    self.uses = [tuple(x) for x in uses]
+  def __repr__(self):
+    return "%s %s" % (self.instr_index, self.il)
+
+class SnapshotIndex(object):
+  # the same queries as ssa_index.SsaIndex, answered from an exported snapshot
+  def __init__(self, snapshot):
+    self.instructions = [SnapshotInstruction(*x) for x in snapshot["instructions"]]
+    self.definitions = {}
+    self.latest_registers = {}
+    for instruction in self.instructions:
+      for register in instruction.defines:
+        self.definitions[register] = instruction
+      for name, version in instruction.defines + instruction.uses:
+        latest = self.latest_registers.get(name)
+        if latest is None or version > latest[1]:
+          self.latest_registers[name] = (name, version)
+
+  def get_latest_register(self, register_name):
+    return self.latest_registers.get(register_name)
+
+  def get_definition(self, register):
+    return self.definitions.get(tuple(register))
+
+  def get_uses(self, instruction):
+    return instruction.uses
+
+snapshot_indexes = weakref.WeakKeyDictionary()
+
+def lift_snapshot_expression(expression):
+  sources = [expression]
+  todo = []
+  output = []
+  while sources:
+    source = sources.pop()
+    todo.append(source)
+    sources += [x for x in source[2:] if isinstance(x, list)]
+  while todo:
+    value = todo.pop()
+    name = value[0]
+    if name == "LLIL_CONST":
+      output.append(lift_constant(value[2], value[1]))
+    elif name == "LLIL_REG_SSA":
+      output.append(AstNodeRegisterSsa(value[2], value[3]))
+    elif name == "LLIL_REG_SSA_PARTIAL":
+      output.append(partial_register_read(AstNodeRegisterSsa(value[2], value[3]), value[4]))
+    elif name == "LLIL_FLAG_BIT_SSA":
+      output.append(AstNodeFlagBit("dummy flag", 0xab))
+    elif name in AST_UNARY_OPERATIONS:
+      operand = output.pop()
+      output.append(AST_UNARY_OPERATIONS[name](operand, value[1]))
+    elif name == "LLIL_SX":
+      operand = output.pop()
+      output.append(AstNodeSx(operand, value[1], value[2][1]))
+    elif name in AST_BINARY_OPERATIONS:
+      rhs = output.pop()
+      lhs = output.pop()
+      output.append(AST_BINARY_OPERATIONS[name](lhs, rhs, value[1]))
+    else:
+      raise Exception("Couldn't process %s" % value)
+  if len(output) != 1:
+    raise Exception("expected one result but got %s" % output)
+  return output[0]
+
+def lift_snapshot_instruction(instruction):
+  il = instruction.il
+  if instruction.operation == "LLIL_SET_REG_SSA":
+    return AstNodeAssignment(AstNodeRegisterSsa(il[2], il[3]), lift_snapshot_expression(il[4]))
+  elif instruction.operation == "LLIL_STORE_SSA":
+    return AstNodeMemoryStore(lift_snapshot_expression(il[2]), lift_snapshot_expression(il[3]), il[1])
+  elif instruction.operation == "LLIL_SET_REG_SSA_PARTIAL":
+    previous = AstNodeRegisterSsa(il[2], il[3] - 1)
+    return AstNodeAssignment(AstNodeRegisterSsa(il[2], il[3]), partial_register_write(previous, il[4], lift_snapshot_expression(il[5])))
+  elif instruction.operation == "LLIL_INTRINSIC_SSA" and len(il) == 6:
+    return AstNodeAssignment(AstNodeRegisterSsa(il[2], il[3]), AstNodeBswap(AstNodeRegisterSsa(il[4], il[5])))
+  raise Exception("Couldn't resolve assignment %s" % instruction)
+
+def lift_snapshot_assignment(instruction):
+  # snapshots already carry the registers each instruction reads
+  return lift_snapshot_instruction(instruction), instruction.uses
+
+# structural fingerprints of what a handler does to the vm, so handler types
+# are a dict lookup instead of pattern matching every lifted slice
+#
+# initial registers become their vm role (anything else is "scratch"),
+# constants of 0x100 and up become "k", and every decryption step (not, neg,
+# rotates and xor/add/sub by a constant or the rolling key) collapses into
+# one "mix" node, so handlers that only differ in register allocation or in
+# their mutated decryption chains hash the same
+
+SMALL_CONSTANT = 0x100
+MIXING_OPERATIONS = (AstNodeXor, AstNodeAdd, AstNodeSub, AstNodeRol, AstNodeRor)
+# the vm context, key and pfunc change in every handler so they're left out
+CONTEXT_ROLES = ("vip", "vsp", "pregs")
+NEAREST_MATCH_THRESHOLD = 0.6
+
+def fingerprint_token(*parts):
+  return hashlib.sha1("\0".join("%s" % x for x in parts).encode()).hexdigest()[:16]
+
+def is_small_constant(value, size):
+  # offsets like vsp - 4 show up as 0xFFFFFFFC after simplification
+  if not isinstance(value, AstNodeConstant):
+    return False
+  return min(value.value, MASKS_BY_SIZE[size] + 1 - value.value) < SMALL_CONSTANT
+
+class HandlerSignature(object):
+  __slots__ = ("fingerprint", "shingles", "components")
+
+  def __init__(self, fingerprint, shingles, components):
+    self.fingerprint = fingerprint
+    # every subtree digest, for similarity when the fingerprint misses
+    self.shingles = shingles
+    self.components = components
+
+  def similarity(self, other):
+    if not self.shingles and not other.shingles:
+      return 1.0
+    return len(self.shingles & other.shingles) / float(len(self.shingles | other.shingles))
+
+class HandlerFingerprinter(object):
+  # digests are memoized per node, and registers are looked through to their
+  # definition so it doesn't matter how much the simplifier inlined
+  def __init__(self, assignments, address_size=4, roles=None):
+    if roles is None:
+      roles = VM_ROLES_BY_ADDRESS_SIZE[address_size]
+    self.roles = {name: role for role, name in roles.items()}
+    self.definitions = {x.dest: x.src for x in assignments if isinstance(x, AstNodeAssignment)}
+    self.digests = {}
+    # nodes computed only from constants and the rolling key
+    self.keys = set()
+    # nodes that are a decryption step of something else
+    self.mixes = set()
+    self.shingles = set()
+
+  def children(self, value):
+    if isinstance(value, AstNodeRegisterSsa):
+      source = self.definitions.get(value)
+      return [source] if source is not None else []
+    return [x for x in value.operands() if isinstance(x, AstNode)]
+
+  def digest(self, root):
+    digests = self.digests
+    stack = [(root, False)]
+    while stack:
+      value, expanded = stack.pop()
+      if value in digests:
+        continue
+      if not expanded:
+        stack.append((value, True))
+        stack += [(x, False) for x in self.children(value) if x not in digests]
+        continue
+      digests[value] = self.canonical(value)
+      # decryption keys and rotate counts would only dilute the similarity
+      if value not in self.keys:
+        self.shingles.add(digests[value])
+    return digests[root]
+
+  def canonical(self, value):
+    digests = self.digests
+    if isinstance(value, AstNodeRegisterSsa):
+      source = self.definitions.get(value)
+      if source is not None:
+        if source in self.keys:
+          self.keys.add(value)
+        if source in self.mixes:
+          self.mixes.add(value)
+        return digests[source]
+      role = self.roles.get(value.name, "scratch")
+      if role == "key":
+        self.keys.add(value)
+      return fingerprint_token("reg", role)
+    if isinstance(value, AstNodeConstant):
+      self.keys.add(value)
+      return fingerprint_token("const", value.value if value.value < SMALL_CONSTANT else "k")
+    children = [x for x in value.operands() if isinstance(x, AstNode)]
+    if not isinstance(value, AstNodeReadMem) and all(x in self.keys for x in children):
+      self.keys.add(value)
+      return fingerprint_token("key")
+    operand = self.mixed_operand(value)
+    if operand is not None:
+      self.mixes.add(value)
+      if operand in self.mixes:
+        return digests[operand]
+      return fingerprint_token("mix", digests[operand])
+    return fingerprint_token(type(value).__name__, *[digests[x] if isinstance(x, AstNode) else x for x in value.operands()])
+
+  def mixed_operand(self, value):
+    # the value being decrypted when value is one decryption step, else None
+    if isinstance(value, (AstNodeNot, AstNodeNeg)):
+      return value.operand
+    if not isinstance(value, MIXING_OPERATIONS):
+      return None
+    lhs, rhs = value.lhs, value.rhs
+    if lhs in self.keys and isinstance(value, (AstNodeXor, AstNodeAdd)):
+      lhs, rhs = rhs, lhs
+    if rhs not in self.keys or lhs in self.keys:
+      return None
+    # vsp + 4 is an offset, not decryption, unless it's part of a chain
+    if isinstance(value, (AstNodeAdd, AstNodeSub)) and is_small_constant(rhs, value.size) \
+      and lhs not in self.mixes:
+      return None
+    return lhs
+
+  def signature(self, stores, entries, exits=False):
+    # entries are native register name -> final value, as from slice_registers
+    components = []
+    for store in stores:
+      components.append(fingerprint_token("store", store.size, self.digest(store.dest), self.digest(store.src)))
+    for name, value in entries.items():
+      role = self.roles.get(name)
+      if role not in CONTEXT_ROLES:
+        continue
+      digest = self.digest(value)
+      if digest != fingerprint_token("reg", role):
+        components.append(fingerprint_token("set", role, digest))
+    if exits:
+      components.append(fingerprint_token("exit"))
+    components.sort()
+    return HandlerSignature(fingerprint_token(*components), frozenset(self.shingles.union(components)), len(components))
+
+def handler_templates(address_size=4):
+  # name -> (stores, context updates, exits) written in terms of the vm roles.
+  # decryption is written as one xor with a made up key since the fingerprint
+  # only sees that a value was mixed, non-operand handlers step vip past the
+  # next opcode byte
+  roles = VM_ROLES_BY_ADDRESS_SIZE[address_size]
+  size = address_size
+  vip, vsp, pregs = [AstNodeRegisterSsa(roles[x], 0) for x in ["vip", "vsp", "pregs"]]
+  def constant(value):
+    return AstNodeConstant(value & MASKS_BY_SIZE[size])
+  def offset(base, amount):
+    return AstNodeAdd(base, constant(amount), size)
+  def load(address):
+    return AstNodeReadMem(address, size)
+  def decrypt(value):
+    return AstNodeXor(value, constant(0x5A5A5A5A), size)
+  def store(address, value):
+    return AstNodeMemoryStore(address, value, size)
+  vreg = AstNodeAdd(pregs, decrypt(AstNodeZx(AstNodeReadMem(vip, 1), size)), size)
+  top = load(vsp)
+  second = load(offset(vsp, size))
+  push = offset(vsp, -size)
+  pop = offset(vsp, size)
+  step = offset(vip, 1)
+  return {
+    "vpushimm": ([store(push, decrypt(load(vip)))], {"vsp": push, "vip": offset(vip, size + 1)}, False),
+    "vpushreg": ([store(push, load(vreg))], {"vsp": push, "vip": offset(vip, 2)}, False),
+    "vpopreg": ([store(vreg, top)], {"vsp": pop, "vip": offset(vip, 2)}, False),
+    "vadd": ([store(pop, AstNodeAdd(top, second, size))], {"vsp": pop, "vip": step}, False),
+    "vnor": ([store(pop, AstNodeAnd(AstNodeNot(top, size), AstNodeNot(second, size), size))], {"vsp": pop, "vip": step}, False),
+    "vnand": ([store(pop, AstNodeOr(AstNodeNot(top, size), AstNodeNot(second, size), size))], {"vsp": pop, "vip": step}, False),
+    "vload": ([store(vsp, load(top))], {"vip": step}, False),
+    "vstore": ([store(top, second)], {"vsp": offset(vsp, 2 * size), "vip": step}, False),
+    "vpushvsp": ([store(push, vsp)], {"vsp": push, "vip": step}, False),
+    "vpopvsp": ([], {"vsp": top, "vip": step}, False),
+    "vjmp": ([], {"vsp": pop, "vip": decrypt(top)}, False),
+    "vexit": ([], {"pregs": vsp}, True),
+  }
+
+def template_signature(stores, updates, exits, address_size=4):
+  # templates go through the same simplifier as lifted handlers
+  simplifier = Simplifier()
+  roles = VM_ROLES_BY_ADDRESS_SIZE[address_size]
+  stores = [AstNodeMemoryStore(simplifier.simplify(x.dest), simplifier.simplify(x.src), x.size) for x in stores]
+  entries = {roles[role]: simplifier.simplify(value) for role, value in updates.items()}
+  return HandlerFingerprinter([], address_size).signature(stores, entries, exits)
+
+class HandlerTypeIndex(object):
+  # fingerprint -> handler type, falling back to the most similar known
+  # signature for mutated variants
+  def __init__(self, threshold=NEAREST_MATCH_THRESHOLD):
+    self.threshold = threshold
+    self.types = {}
+    self.signatures = []
+
+  def add(self, handler_type, signature):
+    self.types.setdefault(signature.fingerprint, handler_type)
+    self.signatures.append((handler_type, signature))
+
+  def lookup(self, signature):
+    handler_type = self.types.get(signature.fingerprint)
+    if handler_type is not None:
+      return {"type": handler_type, "match": "exact", "score": 1.0}
+    best_type = None
+    best_score = 0.0
+    for known_type, known in self.signatures:
+      score = signature.similarity(known)
+      if score > best_score:
+        best_type, best_score = known_type, score
+    if best_score >= self.threshold:
+      return {"type": best_type, "match": "nearest", "score": round(best_score, 3)}
+    return {"type": None, "match": None, "score": round(best_score, 3)}
+
+handler_type_indexes = {}
+
+def get_handler_type_index(address_size=4):
+  index = handler_type_indexes.get(address_size)
+  if index is None:
+    index = HandlerTypeIndex()
+    for handler_type, (stores, updates, exits) in sorted(handler_templates(address_size).items()):
+      index.add(handler_type, template_signature(stores, updates, exits, address_size))
+    handler_type_indexes[address_size] = index
+  return index
+
+def classify_handler(assignments, entries=None, exits=False, address_size=4):
+  # category is the coarse fallback: which part of the vm context the
+  # handler writes to, pregs (vm registers) or vsp (vm stack)
+  roles = VM_ROLES_BY_ADDRESS_SIZE[address_size]
+  stores = [x for x in assignments if isinstance(x, AstNodeMemoryStore)]
+  writes = set()
+  for store in stores:
+    names = set(x.name for x in registers_in(store.dest))
+    if roles["pregs"] in names:
+      writes.add("vregister_write")
+    elif roles["vsp"] in names:
+      writes.add("vstack_write")
+    else:
+      writes.add("memory_write")
+  signature = HandlerFingerprinter(assignments, address_size).signature(stores, entries or {}, exits)
+  match = get_handler_type_index(address_size).lookup(signature)
   return {
-    "edi": get_final_value(func, "edi", initial_registers),
-    "esp": get_final_value(func, "esp", initial_registers),
-    "ebp": get_final_value(func, "ebp", initial_registers),
-    "ebx": get_final_value(func, "ebx", initial_registers),
-    "esi": get_final_value(func, "esi", initial_registers)
+    "type": match["type"],
+    "match": match["match"],
+    "score": match["score"],
+    "fingerprint": signature.fingerprint,
+    "category": "+".join(sorted(writes)) or "no_store",
+    "stores": len(stores),
+    "assignments": len(assignments),
   }
+
+def describe_classification(classification):
+  if classification.get("type") is None:
+    return classification["category"]
+  return "%s (%s match, %.2f)" % (classification["type"], classification["match"], classification["score"])
+
+def process_snapshot(snapshot):
+  # runs in a worker process, everything in and out is plain data
+  try:
+    index = SnapshotIndex(snapshot)
+    address_size = index_address_size(index)
+    register_names = list(VM_ROLES_BY_ADDRESS_SIZE[address_size].values())
+    assignments, entries = slice_registers(index, register_names, handler=True)
+    exit_instruction = find_exit_instruction(index)
+    exits = exit_instruction is not None and is_return(exit_instruction)
+    keep = set()
+    for value in entries.values():
+      keep |= registers_in(value)
+    assignments = Simplifier().simplify_assignments(assignments, keep=keep)
+    return {
+      "start": snapshot["start"],
+      "assignments": serialize_assignments(assignments, entries),
+      "classification": classify_handler(assignments, entries, exits, address_size),
+    }
+  except Exception as e:
+    return {"start": snapshot["start"], "error": "%s" % e}
+
+def classify_function(func):
+  # the same result identify_all_handlers caches, for one function in process
+  return session_result(func, "classification", lambda: load_classification(func))
+
+def load_classification(func):
+  cache = get_handler_cache()
+  key = handler_key(function_identity(func), "identify")
+  cached = cache.get(key)
+  if cached is not None:
+    return cached["classification"]
+  snapshot = getattr(func, "snapshot", None)
+  if snapshot is None:
+    snapshot = export_function_snapshot(func)
+  result = process_snapshot(snapshot)
+  if "error" in result:
+    raise Exception("Couldn't classify %s: %s" % (func.name, result["error"]))
+  cache.put(key, {"assignments": result["assignments"], "classification": result["classification"]})
+  return result["classification"]
+
+def is_candidate_handler(func):
+  # handlers end in a computed jump (or ret) and touch memory
+  instructions = get_ssa_index(func).instructions
+  return any(type(x) in [LowLevelILJump, LowLevelILRet] for x in instructions) \
+    and any(type(x) == LowLevelILStoreSsa for x in instructions)
+
+HANDLER_TAG_TYPE = "VMProtect handler"
+
+def apply_handler_result(func, result):
+  bv = func.view
+  if HANDLER_TAG_TYPE not in bv.tag_types:
+    bv.create_tag_type(HANDLER_TAG_TYPE, "V")
+  classification = result["classification"]
+  assignments, _ = deserialize_assignments(result["assignments"])
+  func.add_tag(HANDLER_TAG_TYPE, classification["type"] or classification["category"])
+  func.comment = "\n".join([describe_classification(classification)] + ["%s" % x for x in assignments])
+
+def identify_all_handlers(bv, functions=None, max_workers=None, progress=None, cancelled=None):
+  # the console copy of this script can't be pickled, so workers get the
+  # function from the importable module instead
+  import identify_handler as worker_module
+  instruments.refresh()
+  if functions is None:
+    functions = [x for x in bv.functions if is_candidate_handler(x)]
+  cache = get_handler_cache()
+  results = {}
+  pending = {}
+  for func in functions:
+    key = handler_key(function_identity(func), "identify")
+    cached = cache.get(key)
+    if cached is not None:
+      results[func.start] = cached
+    else:
+      pending[func.start] = (key, export_function_snapshot(func))
+  done = len(results)
+  if progress:
+    progress(done, len(functions))
+  for start, result in identify_snapshots(worker_module, pending, max_workers, cancelled):
+    if "error" in result:
+      instruments.trace(WARNING, "Couldn't identify handler at %s: %s", hex(start), result["error"])
+    else:
+      cache.put(pending[start][0], {"assignments": result["assignments"], "classification": result["classification"]})
+      results[start] = result
+    done += 1
+    if progress:
+      progress(done, len(functions))
+  for func in functions:
+    if func.start in results:
+      apply_handler_result(func, results[func.start])
+  return results
+
+def worker_interpreter():
+  # spawn starts workers with sys.executable, which inside binary ninja is
+  # the gui rather than a python. None when there's no python to be found
+  candidates = [sys.executable, getattr(sys, "_base_executable", None)]
+  for name in ["python3", "python", "python.exe"]:
+    candidates += [os.path.join(sys.exec_prefix, "bin", name), os.path.join(sys.exec_prefix, name)]
+  for candidate in candidates:
+    if candidate and os.path.basename(candidate).lower().startswith("python") and os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+      return candidate
+  return None
+
+def identify_snapshots(worker_module, pending, max_workers=None, cancelled=None):
+  # yields (start, result) for each pending snapshot as it's done, in worker
+  # processes when there's an interpreter to start them with
+  if not pending:
+    return
+  interpreter = worker_interpreter()
+  if interpreter is None:
+    instruments.trace(WARNING, "No python interpreter for worker processes, identifying handlers in process")
+    for start, (key, snapshot) in pending.items():
+      if cancelled and cancelled():
+        return
+      yield start, worker_module.process_snapshot(snapshot)
+    return
+  context = multiprocessing.get_context("spawn")
+  context.set_executable(interpreter)
+  with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+    futures = {executor.submit(worker_module.process_snapshot, snapshot): start for start, (key, snapshot) in pending.items()}
+    for future in as_completed(futures):
+      if cancelled and cancelled():
+        for x in futures:
+          x.cancel()
+        return
+      yield futures[future], future.result()
+
+def start_identify_all_handlers(bv, functions=None, max_workers=None):
+  task = BackgroundTask("Identifying VMProtect handlers", can_cancel=True)
+  def progress(done, total):
+    task.progress = "Identifying VMProtect handlers %d/%d" % (done, total)
+  def run():
+    try:
+      identify_all_handlers(bv, functions, max_workers, progress, lambda: task.cancelled)
+    finally:
+      task.finish()
+  threading.Thread(target=run, daemon=True).start()
+  return task
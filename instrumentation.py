@@ -0,0 +1,146 @@
+import json
+import time
+
+try:
+  from binaryninja import Settings, log_info, log_warn
+except ImportError:
+  # headless replay and worker processes, there is nowhere to log to
+  Settings = None
+  def log_info(message):
+    pass
+  def log_warn(message):
+    pass
+
+# trace messages are only formatted when they'll be shown, profiling
+# (phase timers and counters) costs one attribute check per phase when off
+#
+# both are driven by plugin settings:
+#   vmprotect.logLevel   "warning", "info" or "trace"
+#   vmprotect.profiling  collect timings, see instruments.report()
+
+WARNING = 30
+INFO = 20
+TRACE = 10
+
+LEVELS_BY_NAME = {"warning": WARNING, "info": INFO, "trace": TRACE}
+
+SETTINGS_GROUP = "vmprotect"
+LOG_LEVEL_SETTING = "vmprotect.logLevel"
+PROFILING_SETTING = "vmprotect.profiling"
+
+class PhaseTimer(object):
+  __slots__ = ("timing", "start")
+
+  def __init__(self, timing):
+    self.timing = timing
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exception):
+    self.timing[0] += 1
+    self.timing[1] += time.perf_counter() - self.start
+
+class NullPhase(object):
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exception):
+    pass
+
+NULL_PHASE = NullPhase()
+
+class Instrumentation(object):
+  def __init__(self, level=INFO, profiling=False):
+    self.level = level
+    self.profiling = profiling
+    self.timings = {}
+    self.counters = {}
+    # per llil operation, filled by llil_lifter while profiling
+    self.operations = {}
+
+  def trace(self, level, message, *args):
+    # args are only formatted into message when the level is shown
+    if level < self.level:
+      return
+    if args:
+      message = message % args
+    if level >= WARNING:
+      log_warn(message)
+    else:
+      log_info(message)
+
+  def tracing(self):
+    return self.level <= TRACE
+
+  def phase(self, name):
+    # with instruments.phase("slicing"): ..., phases can nest and then the
+    # outer one includes the inner
+    if not self.profiling:
+      return NULL_PHASE
+    timing = self.timings.get(name)
+    if timing is None:
+      timing = self.timings[name] = [0, 0.0]
+    return PhaseTimer(timing)
+
+  def count(self, name, amount=1):
+    if self.profiling:
+      self.counters[name] = self.counters.get(name, 0) + amount
+
+  def operation_counts(self):
+    # None when off so the lifter's check is a single identity test
+    if self.profiling:
+      return self.operations
+    return None
+
+  def reset(self):
+    self.timings = {}
+    self.counters = {}
+    self.operations = {}
+
+  def report(self):
+    return {
+      "profiling": self.profiling,
+      "phases": {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in sorted(self.timings.items())},
+      "counters": dict(sorted(self.counters.items())),
+      "operations": dict(sorted(self.operations.items(), key=lambda x: -x[1])),
+    }
+
+  def dump_report(self, path):
+    with open(path, "w") as handle:
+      json.dump(self.report(), handle, indent=2)
+
+  def refresh(self):
+    # picks up changes to the plugin settings, cheap enough to call at the
+    # start of every analysis
+    if Settings is None:
+      return
+    settings = Settings()
+    self.level = LEVELS_BY_NAME.get(settings.get_string(LOG_LEVEL_SETTING), INFO)
+    self.profiling = settings.get_bool(PROFILING_SETTING)
+
+def register_settings():
+  if Settings is None:
+    return
+  settings = Settings()
+  settings.register_group(SETTINGS_GROUP, "VMProtect")
+  settings.register_setting(LOG_LEVEL_SETTING, json.dumps({
+    "title": "Log level",
+    "type": "string",
+    "default": "info",
+    "enum": ["warning", "info", "trace"],
+    "description": "trace logs every instruction and register visited while slicing, which is slow on big functions",
+  }))
+  settings.register_setting(PROFILING_SETTING, json.dumps({
+    "title": "Profiling",
+    "type": "boolean",
+    "default": False,
+    "description": "Time slicing, lifting, evaluation and memory reads and count lifted LLIL operations",
+  }))
+
+instruments = Instrumentation()
+register_settings()
+instruments.refresh()
@@ -0,0 +1,149 @@
+# one walk over an llil ssa expression tree that gives back both the lifted
+# expression and the ssa registers it reads. what the expression is lifted
+# to is up to the backend: ast nodes in identify_handler, python source in
+# extract_handler, plain lists for exported snapshots
+#
+# dispatch is on the operation name through OPERATIONS, the name is looked
+# up once per llil class rather than asking the (ffi backed) enum every node
+
+from instrumentation import instruments
+
+class LifterBackend(object):
+  def constant(self, value, size):
+    raise Exception("Backend can't lift constants")
+
+  def register(self, name, version, size):
+    raise Exception("Backend can't lift registers")
+
+  def register_partial(self, full_name, version, partial_name, size):
+    raise Exception("Backend can't lift partial register %s" % partial_name)
+
+  def load(self, operand, size):
+    raise Exception("Backend can't lift loads")
+
+  def unary(self, operation, operand, size):
+    raise Exception("Backend can't lift %s" % operation)
+
+  def sign_extend(self, operand, size, operand_size):
+    raise Exception("Backend can't lift LLIL_SX")
+
+  def binary(self, operation, lhs, rhs, size):
+    raise Exception("Backend can't lift %s" % operation)
+
+  def flag_bit(self, value):
+    raise Exception("Backend can't lift flag bits")
+
+  def unknown(self, value):
+    raise Exception("Couldn't process instruction %s type %s" % (value, type(value)))
+
+def expand_binary(source, sources, registers):
+  # lhs is pushed first so it comes off the todo list (and the output) first
+  sources.append(source.left)
+  sources.append(source.right)
+
+def expand_source(source, sources, registers):
+  sources.append(source.src)
+
+def expand_load(source, sources, registers):
+  # operands are [src, src_memory] and src_memory is just an int ref we don't want
+  sources.append(source.src)
+
+def expand_register(source, sources, registers):
+  registers.append(source.src)
+
+def expand_register_partial(source, sources, registers):
+  registers.append(source.full_reg)
+
+def expand_leaf(source, sources, registers):
+  pass
+
+def emit_binary(backend, value, operation, output):
+  rhs = output.pop()
+  lhs = output.pop()
+  output.append(backend.binary(operation, lhs, rhs, value.size))
+
+def emit_unary(backend, value, operation, output):
+  output.append(backend.unary(operation, output.pop(), value.size))
+
+def emit_sign_extend(backend, value, operation, output):
+  output.append(backend.sign_extend(output.pop(), value.size, value.src.size))
+
+def emit_load(backend, value, operation, output):
+  output.append(backend.load(output.pop(), value.size))
+
+def emit_constant(backend, value, operation, output):
+  output.append(backend.constant(value.constant, value.size))
+
+def emit_register(backend, value, operation, output):
+  output.append(backend.register(value.src.reg.name, value.src.version, value.size))
+
+def emit_register_partial(backend, value, operation, output):
+  output.append(backend.register_partial(value.full_reg.reg.name, value.full_reg.version, value.src.name, value.size))
+
+def emit_flag_bit(backend, value, operation, output):
+  output.append(backend.flag_bit(value))
+
+BINARY = (expand_binary, emit_binary)
+UNARY = (expand_source, emit_unary)
+
+OPERATIONS = {
+  "LLIL_ADD": BINARY,
+  "LLIL_SUB": BINARY,
+  "LLIL_AND": BINARY,
+  "LLIL_OR": BINARY,
+  "LLIL_XOR": BINARY,
+  "LLIL_LSL": BINARY,
+  "LLIL_LSR": BINARY,
+  "LLIL_ROL": BINARY,
+  "LLIL_ROR": BINARY,
+  "LLIL_ZX": UNARY,
+  "LLIL_NOT": UNARY,
+  "LLIL_NEG": UNARY,
+  "LLIL_SX": (expand_source, emit_sign_extend),
+  "LLIL_LOAD_SSA": (expand_load, emit_load),
+  "LLIL_CONST": (expand_leaf, emit_constant),
+  "LLIL_CONST_PTR": (expand_leaf, emit_constant),
+  "LLIL_REG_SSA": (expand_register, emit_register),
+  "LLIL_REG_SSA_PARTIAL": (expand_register_partial, emit_register_partial),
+  "LLIL_FLAG_BIT_SSA": (expand_leaf, emit_flag_bit),
+}
+
+operation_names = {}
+
+def operation_name(value):
+  kind = type(value)
+  name = operation_names.get(kind)
+  if name is None:
+    name = value.operation.name
+    operation_names[kind] = name
+  return name
+
+def lift_expression(source, backend):
+  # returns (lifted expression, ssa registers read in walk order)
+  registers = []
+  counts = instruments.operation_counts()
+  # load up flattened tree
+  sources = [source]
+  todo = []
+  while sources:
+    source = sources.pop()
+    operation = operation_name(source)
+    if counts is not None:
+      counts[operation] = counts.get(operation, 0) + 1
+    handlers = OPERATIONS.get(operation)
+    if handlers is None:
+      todo.append((source, operation, None))
+      continue
+    todo.append((source, operation, handlers[1]))
+    handlers[0](source, sources, registers)
+  # process flattened tree
+  output = []
+  while todo:
+    value, operation, emit = todo.pop()
+    if emit is None:
+      output.append(backend.unknown(value))
+    else:
+      emit(backend, value, operation, output)
+  if len(output) != 1:
+    raise Exception("expected one result but got %s" % output)
+  return output[0], registers
@@ -0,0 +1,119 @@
+import struct
+import weakref
+
+from instrumentation import instruments
+
+try:
+  from binaryninja import BinaryDataNotification
+except ImportError:
+  # worker processes are handed memory snapshots and never watch a view
+  BinaryDataNotification = object
+
+PAGE_SIZE = 0x1000
+
+FORMATS_BY_SIZE = {1: struct.Struct("<B"), 2: struct.Struct("<H"), 4: struct.Struct("<I"), 8: struct.Struct("<Q")}
+
+class PagedMemory(object):
+  # reads the view a page at a time and serves unsigned little endian loads
+  # out of the cached pages
+  def __init__(self, view, page_size=PAGE_SIZE):
+    self.view = view
+    self.page_size = page_size
+    self.pages = {}
+    self.page_reads = 0
+    self.loads = 0
+
+  def backed_ranges(self, start, end):
+    # (start, end) of each part of [start, end) a segment covers, views
+    # without segments are read as they are
+    segments = getattr(self.view, "segments", None)
+    if segments is None:
+      return [(start, end)]
+    return [(max(start, x.start), min(end, x.end)) for x in segments if x.start < end and start < x.end]
+
+  def read_page(self, page_index):
+    # segments can start or end mid page, only their part is read and the
+    # rest is zero. a page no segment touches is empty, so reads from it fail
+    start = page_index * self.page_size
+    ranges = self.backed_ranges(start, start + self.page_size)
+    if ranges == [(start, start + self.page_size)]:
+      return self.view.read(start, self.page_size)
+    if not ranges:
+      return b""
+    page = bytearray(self.page_size)
+    for low, high in ranges:
+      data = self.view.read(low, high - low)
+      page[low - start:low - start + len(data)] = data
+    return bytes(page)
+
+  def page(self, page_index):
+    page = self.pages.get(page_index)
+    if page is None:
+      self.page_reads += 1
+      with instruments.phase("memory_reads"):
+        page = self.read_page(page_index)
+      self.pages[page_index] = page
+    return page
+
+  def read(self, address, length):
+    page_index, offset = divmod(address, self.page_size)
+    if offset + length <= self.page_size:
+      page = self.page(page_index)
+      if offset + length > len(page):
+        raise Exception("Couldn't read %d bytes at %s" % (length, hex(address)))
+      return memoryview(page)[offset:offset + length]
+    # straddles pages, the only case that copies
+    output = bytearray()
+    while length:
+      chunk = min(length, self.page_size - offset)
+      output += self.read(page_index * self.page_size + offset, chunk)
+      length -= chunk
+      page_index += 1
+      offset = 0
+    return memoryview(output)
+
+  def read_int(self, address, size):
+    self.loads += 1
+    page_index, offset = divmod(address, self.page_size)
+    if offset + size <= self.page_size:
+      page = self.pages.get(page_index)
+      if page is None:
+        page = self.page(page_index)
+      if offset + size <= len(page):
+        return FORMATS_BY_SIZE[size].unpack_from(page, offset)[0]
+    return FORMATS_BY_SIZE[size].unpack_from(self.read(address, size))[0]
+
+  def invalidate(self, address, length):
+    first = address // self.page_size
+    last = (address + length - 1) // self.page_size
+    for page_index in range(first, last + 1):
+      self.pages.pop(page_index, None)
+
+  def stats(self):
+    return {"loads": self.loads, "page_reads": self.page_reads, "pages": len(self.pages)}
+
+class MemoryInvalidator(BinaryDataNotification):
+  def __init__(self, memory):
+    BinaryDataNotification.__init__(self)
+    self.memory = memory
+
+  def data_written(self, view, offset, length):
+    self.memory.invalidate(offset, length)
+
+  def data_removed(self, view, offset, length):
+    self.memory.invalidate(offset, length)
+
+  def data_inserted(self, view, offset, length):
+    # everything after offset moved
+    self.memory.pages.clear()
+
+# dropped with the view, like analysis_session.sessions
+view_memories = weakref.WeakKeyDictionary()
+
+def get_view_memory(view):
+  memory = view_memories.get(view)
+  if memory is None:
+    memory = PagedMemory(weakref.proxy(view))
+    view.register_notification(MemoryInvalidator(memory))
+    view_memories[view] = memory
+  return memory
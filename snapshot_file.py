@@ -0,0 +1,271 @@
+import struct
+import zlib
+
+# on disk format for exported functions and the memory they run against, so
+# slicing, lifting and evaluation can be replayed without binary ninja
+#
+#   header      MAGIC, format version, string count, memory range count
+#   strings     string count utf-8 strings, each a varint length then bytes
+#   memory      per range: start, length, compressed length, zlib data
+#   body        one tagged value holding the list of function snapshots
+#
+# body values are a tag byte followed by varints, strings are written once in
+# the table and referenced by position after that
+
+MAGIC = b"VMPS"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<4sHII")
+MEMORY_RANGE = struct.Struct("<QII")
+
+TAG_NONE = 0
+TAG_INT = 1
+TAG_NEGATIVE_INT = 2
+TAG_STRING = 3
+TAG_LIST = 4
+TAG_DICT = 5
+TAG_BYTES = 6
+TAG_TRUE = 7
+TAG_FALSE = 8
+
+def write_varint(output, value):
+  while value > 0x7F:
+    output.append((value & 0x7F) | 0x80)
+    value >>= 7
+  output.append(value)
+
+def read_varint(data, offset):
+  value = 0
+  shift = 0
+  while True:
+    if offset >= len(data):
+      raise Exception("Couldn't read varint, the data ends at %d" % len(data))
+    byte = data[offset]
+    offset += 1
+    value |= (byte & 0x7F) << shift
+    if byte < 0x80:
+      return value, offset
+    shift += 7
+
+class Encoder(object):
+  def __init__(self):
+    self.strings = []
+    self.string_indexes = {}
+    self.output = bytearray()
+
+  def string(self, value):
+    index = self.string_indexes.get(value)
+    if index is None:
+      index = len(self.strings)
+      self.strings.append(value)
+      self.string_indexes[value] = index
+    return index
+
+  def encode(self, root):
+    output = self.output
+    stack = [root]
+    while stack:
+      value = stack.pop()
+      # bool is an int so it has to be checked first
+      if value is None:
+        output.append(TAG_NONE)
+      elif value is True:
+        output.append(TAG_TRUE)
+      elif value is False:
+        output.append(TAG_FALSE)
+      elif isinstance(value, int):
+        if value < 0:
+          output.append(TAG_NEGATIVE_INT)
+          write_varint(output, -value)
+        else:
+          output.append(TAG_INT)
+          write_varint(output, value)
+      elif isinstance(value, str):
+        output.append(TAG_STRING)
+        write_varint(output, self.string(value))
+      elif isinstance(value, (list, tuple)):
+        output.append(TAG_LIST)
+        write_varint(output, len(value))
+        stack += reversed(value)
+      elif isinstance(value, dict):
+        output.append(TAG_DICT)
+        write_varint(output, len(value))
+        for key, item in reversed(list(value.items())):
+          stack.append(item)
+          stack.append(key)
+      elif isinstance(value, (bytes, bytearray, memoryview)):
+        output.append(TAG_BYTES)
+        write_varint(output, len(value))
+        output += value
+      else:
+        raise Exception("Couldn't encode %s type %s" % (value, type(value)))
+    return output
+
+def take(data, offset, length):
+  # (data[offset:offset + length], the offset after it), a slice past the end
+  # would quietly come back short. compact_ir reads with this too
+  end = offset + length
+  if end > len(data):
+    raise Exception("Couldn't read %d bytes at %d, the data ends at %d" % (length, offset, len(data)))
+  return data[offset:end], end
+
+class Decoder(object):
+  def __init__(self, data, strings):
+    self.data = data
+    self.strings = strings
+
+  def decode(self, offset):
+    # containers are filled in place, each stack entry is a container and the
+    # number of values it still needs
+    data = self.data
+    end = len(data)
+    root = []
+    stack = [(root, 1)]
+    while stack:
+      container, remaining = stack.pop()
+      if remaining == 0:
+        continue
+      stack.append((container, remaining - 1))
+      if offset >= end:
+        raise Exception("Couldn't decode a value, the data ends at %d" % end)
+      tag = data[offset]
+      offset += 1
+      if tag == TAG_LIST or tag == TAG_DICT:
+        length, offset = read_varint(data, offset)
+        if tag == TAG_LIST:
+          child = []
+          stack.append((child, length))
+        else:
+          child = {}
+          stack.append((DictFiller(child), length * 2))
+        value = child
+      elif tag == TAG_INT:
+        value, offset = read_varint(data, offset)
+      elif tag == TAG_NEGATIVE_INT:
+        value, offset = read_varint(data, offset)
+        value = -value
+      elif tag == TAG_STRING:
+        index, offset = read_varint(data, offset)
+        value = self.strings[index]
+      elif tag == TAG_BYTES:
+        length, offset = read_varint(data, offset)
+        value, offset = take(data, offset, length)
+        value = bytes(value)
+      elif tag == TAG_NONE:
+        value = None
+      elif tag == TAG_TRUE:
+        value = True
+      elif tag == TAG_FALSE:
+        value = False
+      else:
+        raise Exception("Couldn't decode tag %d at %d" % (tag, offset - 1))
+      container.append(value)
+    return root[0], offset
+
+class DictFiller(object):
+  # looks like a list to the decoder, alternates between keys and values
+  def __init__(self, output):
+    self.output = output
+    self.key = None
+    self.has_key = False
+
+  def append(self, value):
+    if self.has_key:
+      self.output[self.key] = value
+      self.has_key = False
+    else:
+      self.key = value
+      self.has_key = True
+
+def write_snapshot_file(path, functions, memory_ranges):
+  # functions are export_function_snapshot dicts, memory_ranges are
+  # (start, bytes) pairs
+  encoder = Encoder()
+  body = encoder.encode(functions)
+  output = bytearray()
+  output += HEADER.pack(MAGIC, FORMAT_VERSION, len(encoder.strings), len(memory_ranges))
+  for value in encoder.strings:
+    encoded = value.encode()
+    write_varint(output, len(encoded))
+    output += encoded
+  for start, data in memory_ranges:
+    compressed = zlib.compress(bytes(data))
+    output += MEMORY_RANGE.pack(start, len(data), len(compressed))
+    output += compressed
+  output += body
+  with open(path, "wb") as handle:
+    handle.write(output)
+  return len(output)
+
+def read_snapshot_file(path):
+  with open(path, "rb") as handle:
+    data = handle.read()
+  if len(data) < HEADER.size:
+    raise Exception("%s isn't a snapshot file" % path)
+  magic, version, string_count, range_count = HEADER.unpack_from(data, 0)
+  if magic != MAGIC:
+    raise Exception("%s isn't a snapshot file" % path)
+  if version != FORMAT_VERSION:
+    raise Exception("%s is snapshot format %d but we read %d" % (path, version, FORMAT_VERSION))
+  offset = HEADER.size
+  strings = []
+  for _ in range(string_count):
+    length, offset = read_varint(data, offset)
+    value, offset = take(data, offset, length)
+    strings.append(value.decode())
+  memory_ranges = []
+  for _ in range(range_count):
+    header, offset = take(data, offset, MEMORY_RANGE.size)
+    start, length, compressed_length = MEMORY_RANGE.unpack(header)
+    compressed, offset = take(data, offset, compressed_length)
+    memory = zlib.decompress(compressed)
+    if len(memory) != length:
+      raise Exception("%s has %d bytes at %s but says it has %d" % (path, len(memory), hex(start), length))
+    memory_ranges.append((start, memory))
+  functions, offset = Decoder(data, strings).decode(offset)
+  if offset != len(data):
+    raise Exception("%s has %d bytes after its functions" % (path, len(data) - offset))
+  return ReplayView(functions, memory_ranges)
+
+class ReplayBlock(object):
+  def __init__(self, start, length):
+    self.start = start
+    self.length = length
+    self.end = start + length
+
+class ReplayFunction(object):
+  # stands in for a binaryninja Function, analysis code checks for .snapshot
+  # and uses the exported instructions instead of live llil
+  def __init__(self, view, snapshot):
+    self.view = view
+    self.snapshot = snapshot
+    self.start = snapshot["start"]
+    self.name = snapshot["name"]
+    self.basic_blocks = [ReplayBlock(start, length) for start, length in snapshot.get("blocks", [])]
+
+  def __repr__(self):
+    return "<replayed func: %s@%s>" % (self.name, hex(self.start))
+
+class ReplayView(object):
+  # the parts of BinaryView the analysis touches, backed by exported memory
+  def __init__(self, functions, memory_ranges):
+    self.memory_ranges = sorted(memory_ranges, key=lambda x: x[0])
+    # exported ranges stand in for segments, see memory_model.PagedMemory
+    self.segments = [ReplayBlock(start, len(data)) for start, data in self.memory_ranges]
+    self.functions = [ReplayFunction(self, x) for x in functions]
+    self.functions_by_start = {x.start: x for x in self.functions}
+
+  def read(self, address, length):
+    # like BinaryView.read, short or empty when the range isn't all there
+    for start, data in self.memory_ranges:
+      if start <= address < start + len(data):
+        offset = address - start
+        return data[offset:offset + length]
+    return b""
+
+  def get_function_at(self, address):
+    return self.functions_by_start.get(address)
+
+  def register_notification(self, notification):
+    # nothing ever changes underneath a replay
+    pass
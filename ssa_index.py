@@ -0,0 +1,190 @@
+try:
+  from binaryninja import (
+    LowLevelILFlagBitSsa,
+    LowLevelILFlagPhi,
+    LowLevelILFlagSsa,
+    LowLevelILInstruction,
+    LowLevelILIntrinsicSsa,
+    LowLevelILLoadSsa,
+    LowLevelILRegPhi,
+    LowLevelILRegSsa,
+    LowLevelILRegSsaPartial,
+    LowLevelILSetFlagSsa,
+    LowLevelILSetRegSsa,
+    LowLevelILSetRegSsaPartial,
+    SSARegister,
+  )
+except ImportError:
+  # worker processes only handle exported snapshots and never build an index
+  pass
+
+from analysis_session import get_analysis_session
+
+def register_key(register):
+  return (register.reg.name, register.version)
+
+def flag_key(flag):
+  return (flag.flag.name, flag.version)
+
+def defined_registers(instruction):
+  # returns (name, version) for everything the instruction writes
+  if isinstance(instruction, (LowLevelILSetRegSsa, LowLevelILRegPhi)):
+    return [register_key(instruction.dest)]
+  elif isinstance(instruction, LowLevelILSetRegSsaPartial):
+    return [register_key(instruction.full_reg)]
+  elif isinstance(instruction, LowLevelILIntrinsicSsa):
+    return [(x.reg_or_flag.name, x.version) for x in instruction.output]
+  return []
+
+def used_registers(instruction):
+  if isinstance(instruction, (LowLevelILSetRegSsa, LowLevelILSetRegSsaPartial)):
+    sources = [instruction.src]
+  elif isinstance(instruction, LowLevelILRegPhi):
+    sources = list(instruction.src)
+  elif isinstance(instruction, LowLevelILIntrinsicSsa):
+    sources = [instruction.param]
+  else:
+    sources = list(instruction.operands)
+  output = []
+  while sources:
+    source = sources.pop()
+    if isinstance(source, SSARegister):
+      output.append(source)
+    elif isinstance(source, LowLevelILRegSsa):
+      output.append(source.src)
+    elif isinstance(source, LowLevelILRegSsaPartial):
+      output.append(source.full_reg)
+    elif isinstance(source, LowLevelILLoadSsa):
+      # src_memory is just an int ref we don't want
+      sources.append(source.src)
+    elif isinstance(source, LowLevelILInstruction):
+      sources += source.operands
+    elif isinstance(source, list):
+      sources += source
+  if isinstance(instruction, LowLevelILSetRegSsaPartial):
+    # the bytes not written come from the previous version
+    full = instruction.full_reg
+    output.append(SSARegister(full.reg, full.version - 1))
+  return output
+
+def defined_flags(instruction):
+  if isinstance(instruction, (LowLevelILSetFlagSsa, LowLevelILFlagPhi)):
+    return [flag_key(instruction.dest)]
+  return []
+
+def used_flags(instruction):
+  if isinstance(instruction, LowLevelILFlagPhi):
+    return [flag_key(x) for x in instruction.src]
+  output = []
+  sources = list(instruction.operands)
+  while sources:
+    source = sources.pop()
+    if isinstance(source, (LowLevelILFlagSsa, LowLevelILFlagBitSsa)):
+      output.append(flag_key(source.src))
+    elif isinstance(source, LowLevelILInstruction):
+      sources += source.operands
+    elif isinstance(source, list):
+      sources += source
+  return output
+
+class SsaIndex(object):
+  # def-use information for one function's llil ssa form, built in one pass
+  def __init__(self, llil_ssa):
+    self.llil_ssa = llil_ssa
+    self.instructions = list(llil_ssa.instructions)
+    self.latest_registers = {}
+    self.definitions = {}
+    self.flag_definitions = {}
+    self.uses = {}
+    self.users = {}
+    self.liveness = {}
+    for register in llil_ssa.ssa_registers:
+      latest = self.latest_registers.get(register.reg.name)
+      if latest is None or register.version > latest.version:
+        self.latest_registers[register.reg.name] = register
+    for instruction in self.instructions:
+      for key in defined_registers(instruction):
+        self.definitions[key] = instruction
+      for key in defined_flags(instruction):
+        self.flag_definitions[key] = instruction
+    for instruction in self.instructions:
+      registers = used_registers(instruction)
+      self.uses[instruction.instr_index] = registers
+      for register in registers:
+        definition = self.definitions.get(register_key(register))
+        if definition is not None:
+          self.users.setdefault(definition.instr_index, []).append(instruction)
+
+  def get_latest_register(self, register_name):
+    return self.latest_registers.get(register_name)
+
+  def get_definition(self, register):
+    return self.definitions.get(register_key(register))
+
+  def get_uses(self, instruction):
+    return self.uses.get(instruction.instr_index, [])
+
+  def get_users(self, instruction):
+    return self.users.get(instruction.instr_index, [])
+
+  def get_liveness(self, register_names):
+    register_names = tuple(register_names)
+    liveness = self.liveness.get(register_names)
+    if liveness is None:
+      liveness = self.liveness[register_names] = Liveness(self, register_names)
+    return liveness
+
+class Liveness(object):
+  # mark and sweep over the def-use chains. the roots are everything with an
+  # effect beyond defining a register or flag (stores, jumps, rets, ifs,
+  # calls) plus the final version of each register in register_names, and
+  # anything the roots don't reach is junk
+  def __init__(self, index, register_names):
+    self.total = len(index.instructions)
+    self.live = set()
+    self.flag_writes = set()
+    roots = []
+    for instruction in index.instructions:
+      if defined_flags(instruction):
+        self.flag_writes.add(instruction.instr_index)
+      elif not defined_registers(instruction):
+        roots.append(instruction)
+    for name in register_names:
+      register = index.get_latest_register(name)
+      if register is not None:
+        definition = index.get_definition(register)
+        if definition is not None:
+          roots.append(definition)
+    stack = roots
+    while stack:
+      instruction = stack.pop()
+      if instruction.instr_index in self.live:
+        continue
+      self.live.add(instruction.instr_index)
+      for register in index.get_uses(instruction):
+        definition = index.get_definition(register)
+        if definition is not None and definition.instr_index not in self.live:
+          stack.append(definition)
+      for key in used_flags(instruction):
+        definition = index.flag_definitions.get(key)
+        if definition is not None and definition.instr_index not in self.live:
+          stack.append(definition)
+
+  def is_live(self, instruction):
+    return instruction.instr_index in self.live
+
+  def report(self):
+    return {
+      "instructions": self.total,
+      "live": len(self.live),
+      "dead": self.total - len(self.live),
+      "dead_flag_writes": len(self.flag_writes - self.live),
+    }
+
+def get_ssa_index(func):
+  # one index per function and analysis generation, so it's only rebuilt
+  # once the function's code changed, see analysis_session
+  return get_analysis_session(func.view).get(func, "ssa_index", lambda: SsaIndex(func.llil.ssa_form))
+
+def invalidate_ssa_index(func):
+  get_analysis_session(func.view).invalidate(func)
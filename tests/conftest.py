@@ -0,0 +1,15 @@
+import os
+import sys
+
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+# the same stand in for binaryninja the benchmarks run against
+sys.path.insert(0, os.path.join(ROOT_DIRECTORY, "benchmarks"))
+sys.path.insert(0, ROOT_DIRECTORY)
+
+import fake_binaryninja
+fake_binaryninja.install()
+
+import fixtures
+
+cold_caches = fixtures.cold_caches
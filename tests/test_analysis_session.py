@@ -0,0 +1,117 @@
+# session results survive updates that don't touch a function's code, and
+# the session stays consistent with notifications arriving on other threads
+import threading
+
+import analysis_session
+from fake_binaryninja import BinaryView
+from synthetic import make_handler
+
+def notify_updated(view, func):
+  for notification in view.notifications:
+    notification.function_updated(view, func)
+
+def test_tagging_keeps_results():
+  view = BinaryView()
+  func = make_handler(view, 0x401000, 16)
+  session = analysis_session.get_analysis_session(view)
+  first = session.get(func, "test", lambda: object())
+  func.add_tag("vmprotect", "vadd")
+  func.comment = "vadd"
+  notify_updated(view, func)
+  assert session.get(func, "test", lambda: object()) is first
+  assert session.generation(func) == 0
+
+def test_code_change_drops_results():
+  view = BinaryView()
+  func = make_handler(view, 0x401000, 16)
+  session = analysis_session.get_analysis_session(view)
+  first = session.get(func, "test", lambda: object())
+  func.code = bytes(len(func.code))
+  notify_updated(view, func)
+  assert session.generation(func) == 1
+  assert session.get(func, "test", lambda: object()) is not first
+
+def test_change_while_computing_isnt_kept():
+  view = BinaryView()
+  func = make_handler(view, 0x401000, 16)
+  session = analysis_session.get_analysis_session(view)
+  def compute():
+    session.get(func, "other", lambda: 1)
+    session.invalidate(func)
+    return "stale"
+  assert session.get(func, "test", compute) == "stale"
+  assert session.get(func, "test", lambda: "fresh") == "fresh"
+
+class SlowView(BinaryView):
+  # holds every thread in register_notification until they've all got there
+  def __init__(self, threads):
+    BinaryView.__init__(self)
+    self.barrier = threading.Barrier(threads)
+
+  def register_notification(self, notification):
+    try:
+      self.barrier.wait(0.5)
+    except threading.BrokenBarrierError:
+      pass
+    BinaryView.register_notification(self, notification)
+
+def run_threads(count, target):
+  threads = [threading.Thread(target=target) for _ in range(count)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+def test_one_session_per_view_across_threads():
+  view = SlowView(2)
+  found = []
+  run_threads(2, lambda: found.append(analysis_session.get_analysis_session(view)))
+  assert found[0] is found[1]
+  assert len(view.notifications) == 1
+
+def test_threads_computing_together_get_one_result():
+  view = BinaryView()
+  func = make_handler(view, 0x401000, 16)
+  session = analysis_session.get_analysis_session(view)
+  barrier = threading.Barrier(2)
+  found = []
+  def compute():
+    barrier.wait(5)
+    return object()
+  run_threads(2, lambda: found.append(session.get(func, "test", compute)))
+  assert found[0] is found[1]
+  assert session.get(func, "test", object) is found[0]
+
+def test_notifications_on_another_thread():
+  view = BinaryView()
+  funcs = [make_handler(view, 0x401000 + i * 0x1000, 4, seed=i) for i in range(4)]
+  session = analysis_session.get_analysis_session(view)
+  errors = []
+  done = threading.Event()
+  def notify():
+    # alternates between code changes and changes that leave the code alone
+    try:
+      i = 0
+      while not done.is_set():
+        func = funcs[i % len(funcs)]
+        if i % 2:
+          func.code = func.code[::-1]
+        notify_updated(view, func)
+        i += 1
+    except Exception as e:
+      errors.append(e)
+  def read():
+    try:
+      for i in range(2000):
+        func = funcs[i % len(funcs)]
+        value = session.get(func, "test", lambda: (func.start, session.generation(func)))
+        assert value[0] == func.start
+        session.stats()
+    except Exception as e:
+      errors.append(e)
+  notifier = threading.Thread(target=notify)
+  notifier.start()
+  run_threads(4, read)
+  done.set()
+  notifier.join()
+  assert errors == []
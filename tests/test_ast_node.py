@@ -0,0 +1,43 @@
+# AstNodes are interned, immutable and pickle back to the same instance
+import pickle
+import threading
+
+import pytest
+
+from identify_handler import AstNodeAdd, AstNodeConstant, AstNodeRegisterSsa
+
+def test_equal_nodes_are_one_instance():
+  value = AstNodeAdd(AstNodeRegisterSsa("eax", 1), AstNodeConstant(4), 4)
+  assert value is AstNodeAdd(AstNodeRegisterSsa("eax", 1), AstNodeConstant(4), 4)
+  assert value is not AstNodeAdd(AstNodeRegisterSsa("eax", 1), AstNodeConstant(4), 2)
+
+def test_nodes_are_immutable():
+  value = AstNodeConstant(4)
+  with pytest.raises(AttributeError):
+    value.value = 5
+  with pytest.raises(AttributeError):
+    del value.value
+
+def test_wrong_operand_count():
+  with pytest.raises(Exception, match="expects"):
+    AstNodeConstant(1, 2)
+
+def test_pickle_reinterns():
+  value = AstNodeAdd(AstNodeRegisterSsa("eax", 1), AstNodeConstant(4), 4)
+  assert pickle.loads(pickle.dumps(value)) is value
+
+def test_threads_get_the_same_instance():
+  # every thread makes the same fresh nodes at once
+  threads = 8
+  barrier = threading.Barrier(threads)
+  results = [None] * threads
+  def make(index):
+    barrier.wait()
+    results[index] = [AstNodeConstant(0x7E570000 + x) for x in range(2000)]
+  workers = [threading.Thread(target=make, args=(x,)) for x in range(threads)]
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+  for result in results[1:]:
+    assert all(x is y for x, y in zip(result, results[0]))
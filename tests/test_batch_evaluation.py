@@ -0,0 +1,59 @@
+# numpy batch evaluation gives every row what scalar evaluation gives it
+import random
+
+import pytest
+
+import identify_handler
+from identify_handler import (
+  AstNodeAdd, AstNodeAnd, AstNodeNeg, AstNodeNot, AstNodeOr, AstNodeRol, AstNodeRor, AstNodeShl, AstNodeShr,
+  AstNodeSub, AstNodeXor,
+)
+from fake_binaryninja import BinaryView
+from synthetic import make_handler, make_vmenter
+
+numpy = pytest.importorskip("numpy")
+
+BINARY_OPERATIONS = [AstNodeAdd, AstNodeSub, AstNodeXor, AstNodeOr, AstNodeAnd, AstNodeShl, AstNodeShr, AstNodeRol, AstNodeRor]
+
+def read_mem(address, size):
+  return (address * 0x9E3779B1 >> 7) & identify_handler.MASKS_BY_SIZE[size]
+
+@pytest.mark.parametrize("size", [1, 2, 4, 8])
+def test_operations_match_scalar(size):
+  generator = random.Random(size)
+  bits = size * 8
+  lhs = [generator.getrandbits(bits) for _ in range(64)]
+  rhs = [generator.randrange(bits * 2) for _ in range(64)]
+  operations = identify_handler.WIDTH_OPERATIONS[size]
+  for kind in BINARY_OPERATIONS:
+    output = identify_handler.batch_binary(kind, numpy.array(lhs, dtype="uint64"), numpy.array(rhs, dtype="uint64"), size)
+    assert [int(x) for x in output] == [operations[kind](x, y) for x, y in zip(lhs, rhs)], kind.__name__
+  for kind in [AstNodeNot, AstNodeNeg]:
+    output = identify_handler.batch_unary(kind, numpy.array(lhs, dtype="uint64"), size)
+    assert [int(x) for x in output] == [operations[kind](x) for x in lhs], kind.__name__
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("make, names", [(make_vmenter, identify_handler.VMENTER_REGISTERS), (make_handler, ["eax", "ebp", "esi"])])
+def test_rows_match_scalar(cold_caches, make, names, compact):
+  func = make(BinaryView(), 0x401000, 24, 0.3, seed=5)
+  keys = [0x401000 + i * 0x1111 for i in range(16)]
+  stack_pointers = [identify_handler.STACK_TOP - i * 0x100 for i in range(16)]
+  esp = identify_handler.AstNodeRegisterSsa("esp", 0)
+  initial_registers = identify_handler.vmenter_initial_registers(4, 0)
+  initial_registers["key"] = numpy.array(keys, dtype="uint32")
+  initial_registers[esp] = numpy.array(stack_pointers, dtype="uint32")
+  values = identify_handler.get_final_values_batch(func, names, initial_registers, read_mem, compact)
+  for row, (key, stack_pointer) in enumerate(zip(keys, stack_pointers)):
+    scalar_registers = identify_handler.vmenter_initial_registers(4, key)
+    scalar_registers[esp] = stack_pointer
+    expected = identify_handler.get_final_values(func, names, scalar_registers, read_mem=read_mem)
+    assert {x: int(numpy.broadcast_to(values[x], (16,))[row]) for x in names} == expected
+
+def test_each_address_is_read_once():
+  reads = []
+  def counting_read(address, size):
+    reads.append(address)
+    return address + 1
+  output = identify_handler.batch_read(counting_read, numpy.array([8, 4, 8, 8, 4], dtype="uint32"), 4)
+  assert [int(x) for x in output] == [9, 5, 9, 9, 5]
+  assert sorted(reads) == [4, 8]
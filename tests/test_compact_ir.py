@@ -0,0 +1,102 @@
+# CompactSlice.to_bytes and from_bytes give back the same arrays, and
+# from_bytes turns down anything that isn't a whole slice
+import struct
+
+import pytest
+
+import identify_handler
+from compact_ir import FORMAT_VERSION, HEADER, CompactSlice, OPCODE_INDEXES
+from fake_binaryninja import (
+  BinaryView, Function, LowLevelILAdd, LowLevelILConst, LowLevelILRegSsa, LowLevelILRet, LowLevelILSetRegSsa,
+  SSARegister,
+)
+from synthetic import make_vmenter
+
+def small_slice():
+  # eax#1 = ebx#0 + 4, [eax#1] = ecx#0, with a store and every array in use
+  compact = CompactSlice()
+  ebx = compact.add_register("ebx", 0)
+  four = compact.add(OPCODE_INDEXES["Constant"], value=4)
+  source = compact.add(OPCODE_INDEXES["Add"], 4, ebx, four)
+  eax = compact.add_register("eax", 1)
+  compact.define(eax, source)
+  compact.add_store(eax, compact.add_register("ecx", 0), 4)
+  compact.entries = {"eax": eax, "jump": source}
+  return compact.freeze()
+
+def assert_same(loaded, compact):
+  assert [list(x) for x in loaded.arrays()] == [list(x) for x in compact.arrays()]
+  assert loaded.names == compact.names
+  assert loaded.entries == compact.entries
+
+def test_round_trip():
+  compact = small_slice()
+  loaded = CompactSlice.from_bytes(compact.to_bytes())
+  assert_same(loaded, compact)
+  assert loaded.interned is None
+  assert loaded.definition(compact.entries["eax"]) == compact.entries["jump"]
+
+def test_empty_round_trip():
+  assert_same(CompactSlice.from_bytes(CompactSlice().freeze().to_bytes()), CompactSlice())
+
+def test_lifted_slice_round_trip(cold_caches):
+  func = make_vmenter(BinaryView(), 0x401000, 64, 0.5)
+  compact = identify_handler.find_all_dependent_registers_from_register_names(func, identify_handler.VMENTER_REGISTERS, compact=True)
+  loaded = CompactSlice.from_bytes(compact.to_bytes())
+  assert_same(loaded, compact)
+  initial_registers = identify_handler.vmenter_initial_registers(4, 0x1000)
+  read_mem = identify_handler.get_view_memory(func.view).read_int
+  assert identify_handler.evaluate_compact_slice(loaded, initial_registers, read_mem) == \
+    identify_handler.evaluate_compact_slice(compact, initial_registers, read_mem)
+
+def test_from_memoryview():
+  compact = small_slice()
+  assert_same(CompactSlice.from_bytes(memoryview(bytearray(compact.to_bytes()))), compact)
+
+def test_wrong_magic():
+  data = b"VMPX" + small_slice().to_bytes()[4:]
+  with pytest.raises(Exception, match="bad magic or version"):
+    CompactSlice.from_bytes(data)
+
+def test_wrong_version():
+  data = bytearray(small_slice().to_bytes())
+  struct.pack_into("<H", data, 4, FORMAT_VERSION + 1)
+  with pytest.raises(Exception, match="bad magic or version"):
+    CompactSlice.from_bytes(bytes(data))
+
+def test_every_truncation_is_rejected():
+  data = small_slice().to_bytes()
+  for length in range(len(data)):
+    with pytest.raises(Exception, match="Couldn't read"):
+      CompactSlice.from_bytes(data[:length])
+
+def test_trailing_bytes():
+  with pytest.raises(Exception, match="1 bytes left over"):
+    CompactSlice.from_bytes(small_slice().to_bytes() + b"\x00")
+
+def test_header_is_counted():
+  data = small_slice().to_bytes()
+  assert HEADER.unpack_from(data, 0)[2:] == (5, 3, 1, 1, 2)
+
+def test_negative_constant():
+  # hand built slices can still hold a signed constant
+  esp = identify_handler.AstNodeRegisterSsa("esp", 1)
+  initial = identify_handler.AstNodeRegisterSsa("esp", 0)
+  assignments = [identify_handler.AstNodeAssignment(esp, identify_handler.AstNodeAdd(initial, identify_handler.AstNodeConstant(-4), 4))]
+  compact = identify_handler.compact_assignments(assignments, {"esp": esp})
+  loaded = CompactSlice.from_bytes(compact.to_bytes())
+  expected = identify_handler.EvaluationContext({esp: assignments[0], initial: 0x1000}).evaluate(esp)
+  assert expected == 0xFFC
+  assert identify_handler.evaluate_compact_slice(loaded, {initial: 0x1000}) == {"esp": expected}
+
+def test_lifted_negative_constant(cold_caches):
+  # esp#1 = esp#0 + -4, as binary ninja can give a push
+  func = Function(BinaryView(), 0x401000, [
+    LowLevelILSetRegSsa(4, SSARegister("esp", 1), LowLevelILAdd(4, LowLevelILRegSsa(4, SSARegister("esp", 0)), LowLevelILConst(4, -4))),
+    LowLevelILRet(4, LowLevelILRegSsa(4, SSARegister("esp", 1))),
+  ])
+  assignments, _ = identify_handler.find_all_dependent_registers_from_register_names(func, ["esp"])
+  assert assignments[0].src.rhs is identify_handler.AstNodeConstant(0xFFFFFFFC)
+  initial_registers = {identify_handler.AstNodeRegisterSsa("esp", 0): 0x1000}
+  assert identify_handler.get_final_values(func, ["esp"], initial_registers, compact=True) == {"esp": 0xFFC}
+  assert identify_handler.get_final_values(func, ["esp"], initial_registers) == {"esp": 0xFFC}
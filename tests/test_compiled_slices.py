@@ -0,0 +1,57 @@
+# compiled slices give what EvaluationContext gives for the same assignments
+import random
+
+import pytest
+
+import identify_handler
+from identify_handler import (
+  AstNodeAdd, AstNodeAnd, AstNodeAssignment, AstNodeConstant, AstNodeNeg, AstNodeNot, AstNodeOr, AstNodeRegisterSsa,
+  AstNodeRol, AstNodeRor, AstNodeShl, AstNodeShr, AstNodeSub, AstNodeSx, AstNodeXor, AstNodeZx,
+)
+from fake_binaryninja import BinaryView
+from synthetic import make_handler, make_vmenter
+
+BINARY_OPERATIONS = [AstNodeAdd, AstNodeSub, AstNodeXor, AstNodeOr, AstNodeAnd, AstNodeShl, AstNodeShr, AstNodeRol, AstNodeRor]
+
+def read_mem(address, size):
+  return (address * 0x9E3779B1 >> 7) & identify_handler.MASKS_BY_SIZE[size]
+
+# the registers each kind of synthetic function defines
+@pytest.mark.parametrize("make, names", [(make_vmenter, identify_handler.VMENTER_REGISTERS), (make_handler, ["eax", "ebp", "esi"])])
+@pytest.mark.parametrize("seed", range(4))
+def test_compiled_matches_interpreted(cold_caches, make, names, seed):
+  func = make(BinaryView(), 0x401000, 24, 0.3, seed)
+  initial_registers = identify_handler.vmenter_initial_registers(4, 0x12345678)
+  compiled_slice = identify_handler.compile_final_values(func, names)
+  assert compiled_slice(initial_registers, read_mem) == identify_handler.get_final_values(func, names, initial_registers, read_mem=read_mem)
+
+@pytest.mark.parametrize("size", [1, 2, 4, 8])
+def test_every_operation_at_every_width(size):
+  generator = random.Random(size)
+  eax = AstNodeRegisterSsa("eax", 0)
+  ecx = AstNodeRegisterSsa("ecx", 0)
+  mask = identify_handler.MASKS_BY_SIZE[size]
+  assignments = []
+  entries = {}
+  for i, kind in enumerate(BINARY_OPERATIONS):
+    # by a computed amount, then by constants around the width
+    for j, rhs in enumerate([ecx, AstNodeConstant(0), AstNodeConstant(size * 8), AstNodeConstant(size * 8 + 3)]):
+      dest = AstNodeRegisterSsa("r%d_%d" % (i, j), 1)
+      assignments.append(AstNodeAssignment(dest, kind(eax, rhs, size)))
+      entries[dest.name] = dest
+  for i, value in enumerate([AstNodeNot(eax, size), AstNodeNeg(eax, size), AstNodeZx(eax, size), AstNodeSx(AstNodeAnd(eax, AstNodeConstant(0xFF), 1), size, 1)]):
+    dest = AstNodeRegisterSsa("u%d" % i, 1)
+    assignments.append(AstNodeAssignment(dest, value))
+    entries[dest.name] = dest
+  compiled_slice = identify_handler.compile_assignments(assignments, entries)
+  for _ in range(20):
+    initial_registers = {eax: generator.getrandbits(size * 8) & mask, ecx: generator.randrange(size * 8 * 2)}
+    context = identify_handler.EvaluationContext({x.dest: x for x in assignments} | initial_registers, read_mem)
+    assert compiled_slice(initial_registers, read_mem) == {name: context.evaluate(x) for name, x in entries.items()}
+
+def test_compiled_once_per_index(cold_caches):
+  func = make_handler(BinaryView(), 0x401000, 8)
+  names = ["eax", "ebp", "esi"]
+  compiled_slice = identify_handler.compile_final_values(func, names)
+  assert identify_handler.compile_final_values(func, names) is compiled_slice
+  assert identify_handler.compile_final_values(func, names, handler=True) is not compiled_slice
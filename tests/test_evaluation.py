@@ -0,0 +1,66 @@
+# EvaluationContext evaluates each ssa register and subexpression once, off
+# an explicit stack
+import sys
+
+import identify_handler
+from identify_handler import AstNodeAdd, AstNodeAssignment, AstNodeConstant, AstNodeReadMem, AstNodeRegisterSsa, AstNodeXor
+
+def doubling_chain(length):
+  # eax#i = eax#i-1 + eax#i-1, 2**length paths down to eax#0 without sharing
+  assignments = {}
+  for version in range(1, length + 1):
+    previous = AstNodeRegisterSsa("eax", version - 1)
+    dest = AstNodeRegisterSsa("eax", version)
+    assignments[dest] = AstNodeAssignment(dest, AstNodeAdd(previous, previous, 4))
+  return assignments
+
+def test_shared_registers_are_evaluated_once():
+  assignments = doubling_chain(64)
+  assignments[AstNodeRegisterSsa("eax", 0)] = 1
+  context = identify_handler.EvaluationContext(assignments, lambda address, size: 0)
+  # 2**64 wraps to 0 at 32 bits
+  assert context.evaluate(AstNodeRegisterSsa("eax", 64)) == 0
+  assert context.evaluate(AstNodeRegisterSsa("eax", 20)) == 1 << 20
+  # each register and each add is computed once, the second evaluate is a hit
+  assert context.misses == 64 * 2 + 1
+  assert context.stats()["cached"] == 64 * 2 + 1
+
+def test_shared_loads_are_read_once():
+  ecx = AstNodeRegisterSsa("ecx", 0)
+  load = AstNodeReadMem(AstNodeAdd(ecx, AstNodeConstant(8), 4), 4)
+  eax = AstNodeRegisterSsa("eax", 1)
+  edx = AstNodeRegisterSsa("edx", 1)
+  assignments = {
+    ecx: 0x1000,
+    eax: AstNodeAssignment(eax, AstNodeXor(load, AstNodeConstant(0xFF), 4)),
+    edx: AstNodeAssignment(edx, AstNodeAdd(load, load, 4)),
+  }
+  reads = []
+  def read_mem(address, size):
+    reads.append((address, size))
+    return 0x10
+  context = identify_handler.EvaluationContext(assignments, read_mem)
+  assert context.evaluate(eax) == 0xEF
+  assert context.evaluate(edx) == 0x20
+  assert reads == [(0x1008, 4)]
+
+def test_evaluate_value_matches_a_context():
+  assignments = doubling_chain(8)
+  assignments[AstNodeRegisterSsa("eax", 0)] = 3
+  assert identify_handler.evaluate_value(AstNodeRegisterSsa("eax", 8), assignments) == 3 << 8
+
+def test_deep_chains_dont_recurse():
+  # far deeper than the recursion limit, as a register chain and as one tree
+  depth = sys.getrecursionlimit() * 10
+  assignments = {AstNodeRegisterSsa("eax", 0): 5}
+  tree = AstNodeConstant(5)
+  for version in range(1, depth + 1):
+    dest = AstNodeRegisterSsa("eax", version)
+    assignments[dest] = AstNodeAssignment(dest, AstNodeXor(AstNodeRegisterSsa("eax", version - 1), AstNodeConstant(version), 4))
+    tree = AstNodeXor(tree, AstNodeConstant(version), 4)
+  expected = 5
+  for version in range(1, depth + 1):
+    expected ^= version
+  context = identify_handler.EvaluationContext(assignments, lambda address, size: 0)
+  assert context.evaluate(AstNodeRegisterSsa("eax", depth)) == expected
+  assert context.evaluate(tree) == expected
@@ -0,0 +1,66 @@
+# the temporaries extract_handler names keep its output linear in the llil
+# and still compute what the expression does
+from extract_handler import STRING_LIFTER_BACKEND, TemporaryLifterBackend
+from fake_binaryninja import LowLevelILAdd, LowLevelILConst, LowLevelILRegSsa, LowLevelILRol, LowLevelILRor, LowLevelILXor, SSARegister
+from llil_lifter import lift_expression
+
+MASK = 0xFFFFFFFF
+
+def R(name, version):
+  return LowLevelILRegSsa(4, SSARegister(name, version))
+
+def C(value):
+  return LowLevelILConst(4, value)
+
+def rotate_chain(depth):
+  # each rotate repeats its operand, so unnamed source doubles every level
+  source = R("esi", 0)
+  for i in range(depth):
+    kind = LowLevelILRol if i % 2 else LowLevelILRor
+    source = kind(4, LowLevelILXor(4, LowLevelILAdd(4, source, C(i)), C(0x5A5A5A5A)), C(i % 31 + 1))
+  return source
+
+def reference(value, depth):
+  for i in range(depth):
+    value = (((value + i) & MASK) ^ 0x5A5A5A5A)
+    amount = i % 31 + 1
+    if i % 2:
+      value = ((value << amount) | (value >> (32 - amount))) & MASK
+    else:
+      value = ((value >> amount) | (value << (32 - amount))) & MASK
+  return value
+
+def run(lines, result, esi):
+  namespace = {"esi_0": esi}
+  exec("".join(lines), namespace)
+  return eval(result, namespace)
+
+def test_named_output_is_linear():
+  lines = []
+  result, registers = lift_expression(rotate_chain(200), TemporaryLifterBackend(lines.append))
+  assert registers == [SSARegister("esi", 0)]
+  assert len(result) + sum(len(x) for x in lines) < 200 * 200
+  assert all(len(x) < 4 * TemporaryLifterBackend.INLINE_LIMIT for x in lines)
+
+def test_named_output_computes_the_same():
+  for depth in [1, 6, 40]:
+    lines = []
+    result, _ = lift_expression(rotate_chain(depth), TemporaryLifterBackend(lines.append))
+    for esi in [0, 1, 0xDEADBEEF]:
+      assert run(lines, result, esi) == reference(esi, depth)
+  # small enough to lift without names, both agree
+  unnamed, _ = lift_expression(rotate_chain(6), STRING_LIFTER_BACKEND)
+  assert run([], unnamed, 0x12345678) == reference(0x12345678, 6)
+
+def test_repeated_subexpressions_share_a_name():
+  # both rotates name eax_1 + 1, it's only written once
+  def rotate():
+    return LowLevelILRol(4, LowLevelILAdd(4, R("eax", 1), C(1)), C(3))
+  lines = []
+  result, _ = lift_expression(LowLevelILXor(4, rotate(), LowLevelILAdd(4, rotate(), R("ebx", 0))), TemporaryLifterBackend(lines.append))
+  assert lines[0] == "t0 = (eax_1 + 0x1)\n"
+  assert "".join(lines).count("eax_1") == 1
+  namespace = {"eax_1": 0xFFFFFFFF, "ebx_0": 5}
+  exec("".join(lines), namespace)
+  # eax_1 + 1 wraps to 0, so the rotates are 0 too
+  assert eval(result, namespace) & MASK == 5
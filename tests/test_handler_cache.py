@@ -0,0 +1,43 @@
+# HandlerCache round trips, eviction, and the shared connection used from
+# several threads at once
+import threading
+
+from handler_cache import HandlerCache, handler_key
+
+def test_round_trip():
+  cache = HandlerCache(":memory:")
+  key = handler_key(b"\x90\xc3", "handler")
+  assert cache.get(key) is None
+  cache.put(key, {"type": "vadd", "operands": [1, 2]})
+  assert cache.get(key) == {"type": "vadd", "operands": [1, 2]}
+  assert cache.stats()["hits"] == 1
+  assert cache.stats()["misses"] == 1
+  cache.close()
+
+def test_evicts_least_recently_used():
+  cache = HandlerCache(":memory:", max_bytes=0)
+  cache.put("a", list(range(100)))
+  assert len(cache) == 0
+  cache.close()
+
+def test_threads_share_the_connection():
+  cache = HandlerCache(":memory:")
+  errors = []
+  def work(thread):
+    try:
+      for i in range(300):
+        key = "%d:%d" % (thread, i % 20)
+        cache.put(key, [thread, i])
+        value = cache.get(key)
+        assert value[0] == thread
+        len(cache)
+    except Exception as e:
+      errors.append(e)
+  threads = [threading.Thread(target=work, args=(x,)) for x in range(8)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert errors == []
+  assert len(cache) == 8 * 20
+  cache.close()
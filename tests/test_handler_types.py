@@ -0,0 +1,186 @@
+# each reference handler type is recognised exactly from a handler written
+# the way vmprotect writes it, whatever registers it uses for scratch
+import pytest
+
+import identify_handler
+from fake_binaryninja import (
+  BinaryView, Function, LowLevelILAdd, LowLevelILAnd, LowLevelILConst, LowLevelILJump, LowLevelILLoadSsa,
+  LowLevelILNot, LowLevelILOr, LowLevelILRegSsa, LowLevelILRet, LowLevelILRol, LowLevelILSetRegSsa,
+  LowLevelILStoreSsa, LowLevelILSub, LowLevelILXor, LowLevelILZx, SSARegister,
+)
+
+class Builder(object):
+  # straight line llil ssa, versions counted per register. scratch names the
+  # two registers handlers compute in
+  def __init__(self, scratch=("eax", "ecx")):
+    self.scratch = scratch
+    self.versions = {}
+    self.instructions = []
+
+  def register(self, name):
+    return LowLevelILRegSsa(4, SSARegister(name, self.versions.get(name, 0)))
+
+  def set(self, name, source):
+    self.versions[name] = self.versions.get(name, 0) + 1
+    self.instructions.append(LowLevelILSetRegSsa(4, SSARegister(name, self.versions[name]), source))
+
+  def const(self, value):
+    return LowLevelILConst(4, value)
+
+  def load(self, address, size=4):
+    return LowLevelILLoadSsa(size, address, 0)
+
+  def store(self, address, value):
+    self.instructions.append(LowLevelILStoreSsa(4, address, 1, 0, value))
+
+  def offset(self, name, amount):
+    if amount < 0:
+      return LowLevelILSub(4, self.register(name), self.const(-amount))
+    return LowLevelILAdd(4, self.register(name), self.const(amount))
+
+  def decrypt(self, name):
+    self.set(name, LowLevelILXor(4, self.register(name), self.const(0x1234)))
+
+  def vreg(self):
+    # pregs + the decrypted operand byte at vip
+    first = self.scratch[0]
+    self.set(first, LowLevelILZx(4, self.load(self.register("esi"), 1)))
+    self.decrypt(first)
+    return LowLevelILAdd(4, self.register("esp"), self.register(first))
+
+  def finish(self, step=1, exits=False):
+    if step:
+      self.set("esi", self.offset("esi", step))
+    if exits:
+      self.instructions.append(LowLevelILRet(4, self.register("esp")))
+    else:
+      self.instructions.append(LowLevelILJump(4, self.register("edi")))
+    return self.instructions
+
+def vpushimm(b):
+  a = b.scratch[0]
+  b.set(a, b.load(b.register("esi")))
+  b.decrypt(a)
+  b.set("ebp", b.offset("ebp", -4))
+  b.store(b.register("ebp"), b.register(a))
+  return b.finish(5)
+
+def vpushreg(b):
+  a = b.scratch[1]
+  b.set(a, b.load(b.vreg()))
+  b.set("ebp", b.offset("ebp", -4))
+  b.store(b.register("ebp"), b.register(a))
+  return b.finish(2)
+
+def vpopreg(b):
+  a = b.scratch[1]
+  b.set(a, b.load(b.register("ebp")))
+  b.set("ebp", b.offset("ebp", 4))
+  b.store(b.vreg(), b.register(a))
+  return b.finish(2)
+
+def binary(operation):
+  # pops two, writes the result over the second
+  def handler(b):
+    a, c = b.scratch
+    b.set(a, b.load(b.register("ebp")))
+    b.set(c, b.load(b.offset("ebp", 4)))
+    b.set("ebp", b.offset("ebp", 4))
+    b.store(b.register("ebp"), operation(b.register(a), b.register(c)))
+    return b.finish()
+  return handler
+
+vadd = binary(lambda x, y: LowLevelILAdd(4, x, y))
+vnor = binary(lambda x, y: LowLevelILAnd(4, LowLevelILNot(4, x), LowLevelILNot(4, y)))
+vnand = binary(lambda x, y: LowLevelILOr(4, LowLevelILNot(4, x), LowLevelILNot(4, y)))
+
+def vload(b):
+  a = b.scratch[0]
+  b.set(a, b.load(b.register("ebp")))
+  b.store(b.register("ebp"), b.load(b.register(a)))
+  return b.finish()
+
+def vstore(b):
+  a, c = b.scratch
+  b.set(a, b.load(b.register("ebp")))
+  b.set(c, b.load(b.offset("ebp", 4)))
+  b.set("ebp", b.offset("ebp", 8))
+  b.store(b.register(a), b.register(c))
+  return b.finish()
+
+def vpushvsp(b):
+  a = b.scratch[0]
+  b.set(a, b.register("ebp"))
+  b.set("ebp", b.offset("ebp", -4))
+  b.store(b.register("ebp"), b.register(a))
+  return b.finish()
+
+def vpopvsp(b):
+  b.set("ebp", b.load(b.register("ebp")))
+  return b.finish()
+
+def vjmp(b):
+  b.set("esi", b.load(b.register("ebp")))
+  b.set("ebp", b.offset("ebp", 4))
+  b.decrypt("esi")
+  return b.finish(0)
+
+def vexit(b):
+  # mov esp, ebp then ret
+  b.set("esp", b.register("ebp"))
+  return b.finish(0, exits=True)
+
+HANDLERS = {
+  "vpushimm": vpushimm, "vpushreg": vpushreg, "vpopreg": vpopreg, "vadd": vadd, "vnor": vnor, "vnand": vnand,
+  "vload": vload, "vstore": vstore, "vpushvsp": vpushvsp, "vpopvsp": vpopvsp, "vjmp": vjmp, "vexit": vexit,
+}
+
+def classify(instructions):
+  func = Function(BinaryView(), 0x402000, instructions)
+  return identify_handler.classify_function(func)
+
+def test_every_template_has_a_handler():
+  assert sorted(HANDLERS) == sorted(identify_handler.handler_templates())
+
+@pytest.mark.parametrize("name", sorted(HANDLERS))
+def test_exact_match(cold_caches, name):
+  result = classify(HANDLERS[name](Builder()))
+  assert (result["type"], result["match"], result["score"]) == (name, "exact", 1.0)
+
+@pytest.mark.parametrize("name", sorted(HANDLERS))
+def test_other_scratch_registers(cold_caches, name):
+  result = classify(HANDLERS[name](Builder(("edx", "ebx"))))
+  assert (result["type"], result["match"]) == (name, "exact")
+
+def test_templates_are_distinct():
+  index = identify_handler.get_handler_type_index()
+  assert len(index.types) == len(identify_handler.handler_templates())
+
+def test_longer_decryption_is_still_exact(cold_caches):
+  # xor, rol and add with constants all collapse into the same mix step
+  b = Builder()
+  b.set("eax", b.load(b.register("esi")))
+  b.decrypt("eax")
+  b.set("eax", LowLevelILRol(4, b.register("eax"), b.const(7)))
+  b.set("eax", LowLevelILAdd(4, b.register("eax"), b.const(0x9E3779B9)))
+  b.set("ebp", b.offset("ebp", -4))
+  b.store(b.register("ebp"), b.register("eax"))
+  result = classify(b.finish(5))
+  assert (result["type"], result["match"]) == ("vpushimm", "exact")
+
+def test_vadd_without_its_pop_is_only_near(cold_caches):
+  # the store still lands on the second value but vsp stays put
+  b = Builder()
+  b.set("eax", b.load(b.register("ebp")))
+  b.set("ecx", b.load(b.offset("ebp", 4)))
+  b.store(b.offset("ebp", 4), LowLevelILAdd(4, b.register("eax"), b.register("ecx")))
+  result = classify(b.finish())
+  assert (result["type"], result["match"]) == ("vadd", "nearest")
+  assert result["score"] < 1.0
+
+def test_unrelated_function_has_no_type(cold_caches):
+  b = Builder()
+  b.store(b.const(0x500000), b.const(1))
+  result = classify(b.finish(0))
+  assert result["type"] is None
+  assert result["category"] == "memory_write"
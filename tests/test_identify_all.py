@@ -0,0 +1,66 @@
+# identify_all_handlers tags every candidate with what classify_function
+# gives, on worker processes or in process when there's no python to start
+import identify_handler
+from fake_binaryninja import (
+  BinaryView, Function, LowLevelILConst, LowLevelILRegSsa, LowLevelILRet, LowLevelILSetRegSsa, SSARegister,
+)
+from synthetic import make_handler
+
+def make_view():
+  view = BinaryView()
+  handlers = [make_handler(view, 0x401000 + i * 0x1000, 8, seed=i) for i in range(3)]
+  # never stores, so it isn't a candidate
+  Function(view, 0x410000, [
+    LowLevelILSetRegSsa(4, SSARegister("eax", 1), LowLevelILConst(4, 1)),
+    LowLevelILRet(4, LowLevelILRegSsa(4, SSARegister("esp", 0))),
+  ])
+  return view, handlers
+
+def in_process(monkeypatch):
+  monkeypatch.setattr(identify_handler, "worker_interpreter", lambda: None)
+
+def test_in_process(cold_caches, monkeypatch):
+  in_process(monkeypatch)
+  view, handlers = make_view()
+  progress = []
+  results = identify_handler.identify_all_handlers(view, handlers, progress=lambda done, total: progress.append((done, total)))
+  assert sorted(results) == [x.start for x in handlers]
+  assert progress == [(0, 3), (1, 3), (2, 3), (3, 3)]
+  for func in handlers:
+    assert results[func.start]["classification"] == identify_handler.classify_function(func)
+    assert func.tags == [(identify_handler.HANDLER_TAG_TYPE, results[func.start]["classification"]["type"])]
+
+def test_only_candidates(cold_caches, monkeypatch):
+  in_process(monkeypatch)
+  view, handlers = make_view()
+  assert sorted(identify_handler.identify_all_handlers(view)) == [x.start for x in handlers]
+
+def test_cached_results_skip_the_workers(cold_caches, monkeypatch):
+  in_process(monkeypatch)
+  view, handlers = make_view()
+  first = identify_handler.identify_all_handlers(view, handlers)
+  def no_workers(*args, **kwargs):
+    raise AssertionError("identified a cached handler again")
+  monkeypatch.setattr(identify_handler, "process_snapshot", no_workers)
+  second = identify_handler.identify_all_handlers(view, handlers)
+  assert {x: y["classification"] for x, y in second.items()} == {x: y["classification"] for x, y in first.items()}
+
+def test_cancelled(cold_caches, monkeypatch):
+  in_process(monkeypatch)
+  view, handlers = make_view()
+  assert identify_handler.identify_all_handlers(view, handlers, cancelled=lambda: True) == {}
+  assert all(x.tags == [] for x in handlers)
+
+def test_worker_errors_are_skipped(cold_caches, monkeypatch):
+  in_process(monkeypatch)
+  view, handlers = make_view()
+  monkeypatch.setattr(identify_handler, "process_snapshot", lambda snapshot: {"start": snapshot["start"], "error": "broken"})
+  assert identify_handler.identify_all_handlers(view, handlers) == {}
+
+def test_workers_match_in_process(cold_caches, monkeypatch):
+  view, handlers = make_view()
+  pooled = identify_handler.identify_all_handlers(view, handlers, max_workers=2)
+  identify_handler.handler_cache.clear()
+  in_process(monkeypatch)
+  view, handlers = make_view()
+  assert identify_handler.identify_all_handlers(view, handlers) == pooled
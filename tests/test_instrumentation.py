@@ -0,0 +1,76 @@
+# trace messages are only formatted when shown, and profiling only collects
+# anything while it's on
+import json
+
+import pytest
+
+import identify_handler
+import instrumentation
+from fake_binaryninja import BinaryView
+from instrumentation import INFO, TRACE, WARNING, Instrumentation, instruments
+from synthetic import make_handler
+
+class Unformattable(object):
+  def __str__(self):
+    raise AssertionError("formatted a hidden message")
+  __repr__ = __str__
+
+@pytest.fixture
+def logged(monkeypatch):
+  messages = []
+  monkeypatch.setattr(instrumentation, "log_info", lambda x: messages.append(("info", x)))
+  monkeypatch.setattr(instrumentation, "log_warn", lambda x: messages.append(("warn", x)))
+  return messages
+
+@pytest.fixture
+def profiling(monkeypatch):
+  monkeypatch.setattr(instruments, "profiling", True)
+  instruments.reset()
+  yield instruments
+  instruments.reset()
+
+def test_hidden_messages_arent_formatted(logged):
+  logger = Instrumentation(INFO)
+  logger.trace(TRACE, "visiting %s", Unformattable())
+  assert logged == []
+  assert not logger.tracing()
+
+def test_shown_messages(logged):
+  logger = Instrumentation(TRACE)
+  logger.trace(TRACE, "visiting %s", 5)
+  logger.trace(WARNING, "broken %d%%", 50)
+  logger.trace(INFO, "no args %s")
+  assert logged == [("info", "visiting 5"), ("warn", "broken 50%"), ("info", "no args %s")]
+
+def test_nothing_collected_when_off():
+  profiler = Instrumentation()
+  assert profiler.phase("slicing") is profiler.phase("lifting")
+  with profiler.phase("slicing"):
+    profiler.count("visited")
+  assert profiler.operation_counts() is None
+  assert profiler.report() == {"profiling": False, "phases": {}, "counters": {}, "operations": {}}
+
+def test_phases_and_counters(tmp_path):
+  profiler = Instrumentation(profiling=True)
+  for _ in range(3):
+    with profiler.phase("slicing"):
+      with profiler.phase("lifting"):
+        profiler.count("visited", 2)
+  report = profiler.report()
+  assert report["phases"]["slicing"]["calls"] == 3
+  assert report["phases"]["lifting"]["calls"] == 3
+  assert report["phases"]["slicing"]["seconds"] >= report["phases"]["lifting"]["seconds"]
+  assert report["counters"] == {"visited": 6}
+  path = tmp_path / "report.json"
+  profiler.dump_report(str(path))
+  assert json.loads(path.read_text()) == report
+  profiler.reset()
+  assert profiler.report()["phases"] == {}
+
+def test_profiling_the_pipeline(cold_caches, profiling):
+  func = make_handler(BinaryView(), 0x401000, 16)
+  identify_handler.find_all_dependent_registers_from_register_names(func, ["eax", "ebp", "esi"], handler=True)
+  report = profiling.report()
+  assert {"slicing", "lifting"} <= set(report["phases"])
+  assert report["counters"]["sliced_instructions"] > 0
+  assert report["operations"]["LLIL_ADD"] > 0
@@ -0,0 +1,46 @@
+# junk is pruned from slices, but never a register the caller asked for
+import identify_handler
+from fake_binaryninja import (
+  BinaryView, Function, LowLevelILAdd, LowLevelILConst, LowLevelILJump, LowLevelILRegSsa, LowLevelILSetRegSsa,
+  SSARegister,
+)
+
+def R(name, version):
+  return LowLevelILRegSsa(4, SSARegister(name, version))
+
+def C(value):
+  return LowLevelILConst(4, value)
+
+def S(name, version, source):
+  return LowLevelILSetRegSsa(4, SSARegister(name, version), source)
+
+def non_role_register():
+  # eax is no vm role register, edx#1 is junk nothing reads
+  return Function(BinaryView(), 0x401000, [
+    S("edx", 1, LowLevelILAdd(4, R("ecx", 0), C(3))),
+    S("eax", 1, LowLevelILAdd(4, R("ecx", 0), C(5))),
+    LowLevelILJump(4, R("edi", 0)),
+  ])
+
+def test_final_value_of_a_non_role_register(cold_caches):
+  func = non_role_register()
+  ecx = identify_handler.AstNodeRegisterSsa("ecx", 0)
+  assert identify_handler.get_final_values(func, ["eax"], {ecx: 10}) == {"eax": 15}
+  assert identify_handler.get_final_values(func, ["eax"], {ecx: 10}, compact=True) == {"eax": 15}
+
+def test_slice_of_a_non_role_register(cold_caches):
+  assignments, entries = identify_handler.find_all_dependent_registers_from_register_names(non_role_register(), ["eax"])
+  assert entries == {"eax": identify_handler.AstNodeRegisterSsa("eax", 1)}
+  assert [x.dest for x in assignments] == [identify_handler.AstNodeRegisterSsa("eax", 1)]
+
+def test_ordered_slice_of_a_non_role_register(cold_caches):
+  assignments, entries = identify_handler.ordered_slice(non_role_register(), ["eax"])
+  assert entries == {"eax": identify_handler.AstNodeRegisterSsa("eax", 1)}
+  assert [x.dest for x in assignments] == [identify_handler.AstNodeRegisterSsa("eax", 1)]
+
+def test_junk_is_still_pruned(cold_caches):
+  func = non_role_register()
+  liveness = identify_handler.function_liveness(func)
+  index = identify_handler.function_index(func)
+  assert [liveness.is_live(x) for x in index.instructions] == [False, False, True]
+  assert identify_handler.index_liveness(index, ["eax"]).is_live(index.instructions[1])
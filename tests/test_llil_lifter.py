@@ -0,0 +1,74 @@
+# lift_expression walks an llil tree once and hands each node to a backend,
+# every backend sees the same tree
+import sys
+
+import pytest
+
+import identify_handler
+from fake_binaryninja import (
+  ILRegister, LowLevelILAdd, LowLevelILConst, LowLevelILIf, LowLevelILLoadSsa, LowLevelILNot, LowLevelILRegSsa,
+  LowLevelILRegSsaPartial, LowLevelILSub, LowLevelILSx, LowLevelILXor, SSARegister,
+)
+from llil_lifter import OPERATIONS, LifterBackend, lift_expression
+from synthetic import expression
+
+class TupleBackend(LifterBackend):
+  def constant(self, value, size):
+    return value
+
+  def register(self, name, version, size):
+    return "%s#%d" % (name, version)
+
+  def register_partial(self, full_name, version, partial_name, size):
+    return "%s.%s#%d" % (full_name, partial_name, version)
+
+  def load(self, operand, size):
+    return ("load", operand, size)
+
+  def unary(self, operation, operand, size):
+    return (operation, operand, size)
+
+  def sign_extend(self, operand, size, operand_size):
+    return ("sx", operand, size, operand_size)
+
+  def binary(self, operation, lhs, rhs, size):
+    return (operation, lhs, rhs, size)
+
+def R(name, version):
+  return LowLevelILRegSsa(4, SSARegister(name, version))
+
+def C(value):
+  return LowLevelILConst(4, value)
+
+def test_backend_sees_the_tree():
+  source = LowLevelILAdd(4,
+    LowLevelILLoadSsa(4, LowLevelILSub(4, R("esp", 1), C(4)), 3),
+    LowLevelILXor(4, LowLevelILNot(4, R("eax", 2)), LowLevelILSx(4, LowLevelILRegSsaPartial(1, SSARegister("ecx", 0), ILRegister("cl")))))
+  lifted, registers = lift_expression(source, TupleBackend())
+  assert lifted == ("LLIL_ADD",
+    ("load", ("LLIL_SUB", "esp#1", 4, 4), 4),
+    ("LLIL_XOR", ("LLIL_NOT", "eax#2", 4), ("sx", "ecx.cl#0", 4, 1), 4), 4)
+  assert set(registers) == {SSARegister("esp", 1), SSARegister("eax", 2), SSARegister("ecx", 0)}
+
+def test_unknown_operations_go_to_the_backend():
+  with pytest.raises(Exception, match="Couldn't process instruction"):
+    lift_expression(LowLevelILAdd(4, C(1), LowLevelILIf(0, C(1), 0, 0)), TupleBackend())
+
+def test_every_operation_has_both_halves():
+  for operation, handlers in OPERATIONS.items():
+    assert len(handlers) == 2 and all(callable(x) for x in handlers), operation
+
+@pytest.mark.parametrize("seed", range(8))
+def test_ast_and_snapshot_lifts_agree(seed):
+  # the snapshot lifter works from exported plain data, the ast lifter from
+  # llil, the same expression has to come out of both
+  source = expression(64, seed)
+  lifted = identify_handler.resolve_source(source)
+  assert identify_handler.lift_snapshot_expression(identify_handler.export_expression(source)) is lifted
+
+def test_deep_expressions_dont_recurse():
+  source = R("esi", 0)
+  for i in range(sys.getrecursionlimit() * 5):
+    source = LowLevelILAdd(4, source, C(i))
+  lifted, registers = lift_expression(source, TupleBackend())
+  assert registers == [SSARegister("esi", 0)]
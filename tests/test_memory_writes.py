@@ -0,0 +1,74 @@
+# iter_memory_writes yields each store with only what no earlier store
+# needed, so consumers keep what came before
+import pytest
+
+import identify_handler
+from fake_binaryninja import (
+  BinaryView, Function, LowLevelILAdd, LowLevelILConst, LowLevelILJump, LowLevelILRegSsa, LowLevelILSetRegSsa,
+  LowLevelILStoreSsa, LowLevelILXor, SSARegister,
+)
+from identify_handler import AstNodeRegisterSsa, EvaluationContext
+
+def R(name, version):
+  return LowLevelILRegSsa(4, SSARegister(name, version))
+
+def C(value):
+  return LowLevelILConst(4, value)
+
+def S(name, version, source):
+  return LowLevelILSetRegSsa(4, SSARegister(name, version), source)
+
+def three_stores():
+  # the second store reuses the first one's ecx#1, the third needs nothing
+  # either of them did
+  return Function(BinaryView(), 0x401000, [
+    S("ecx", 1, LowLevelILAdd(4, R("ebx", 0), C(1))),
+    LowLevelILStoreSsa(4, R("ebp", 0), 1, 0, R("ecx", 1)),
+    S("eax", 1, LowLevelILXor(4, R("ecx", 1), C(5))),
+    LowLevelILStoreSsa(4, LowLevelILAdd(4, R("ebp", 0), C(4)), 1, 0, R("eax", 1)),
+    S("edx", 1, LowLevelILAdd(4, R("esi", 0), C(2))),
+    LowLevelILStoreSsa(4, LowLevelILAdd(4, R("ebp", 0), C(8)), 1, 0, R("edx", 1)),
+    LowLevelILJump(4, R("edi", 0)),
+  ])
+
+INITIAL_REGISTERS = {AstNodeRegisterSsa(name, 0): value for name, value in [("ebx", 10), ("esi", 20), ("ebp", 0x1000)]}
+
+def evaluate(assignments, value):
+  registers = {x.dest: x for x in assignments if isinstance(x, identify_handler.AstNodeAssignment)}
+  return EvaluationContext(registers | INITIAL_REGISTERS).evaluate(value)
+
+def test_stores_in_program_order(cold_caches):
+  writes = list(identify_handler.iter_memory_writes(three_stores()))
+  assert [evaluate([], x.dest) for x, _ in writes] == [0x1000, 0x1004, 0x1008]
+  assert [len(x) for _, x in writes] == [1, 1, 1]
+
+def test_concatenated_is_the_whole_slice(cold_caches):
+  func = three_stores()
+  streamed = []
+  for store, assignments in identify_handler.iter_memory_writes(func):
+    streamed += assignments + [store]
+  assert set(streamed) == set(identify_handler.find_all_memory_writes(func))
+  assert len(streamed) == len(set(streamed))
+
+def test_later_stores_need_earlier_lists(cold_caches):
+  kept = []
+  values = []
+  for store, assignments in identify_handler.iter_memory_writes(three_stores()):
+    kept += assignments
+    values.append(evaluate(kept, store.src))
+  assert values == [11, 11 ^ 5, 22]
+  # on its own the second store's list is missing ecx#1
+  _, (store, assignments) = list(identify_handler.iter_memory_writes(three_stores()))[:2]
+  with pytest.raises(Exception):
+    evaluate(assignments, store.src)
+
+def test_stopping_early_lifts_less(cold_caches, monkeypatch):
+  lifted = []
+  lift_assignment = identify_handler.lift_assignment
+  def counting_lift(instruction):
+    lifted.append(instruction.instr_index)
+    return lift_assignment(instruction)
+  monkeypatch.setattr(identify_handler, "lift_assignment", counting_lift)
+  writes = identify_handler.iter_memory_writes(three_stores())
+  next(writes)
+  assert sorted(lifted) == [0, 1]
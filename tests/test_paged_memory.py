@@ -0,0 +1,71 @@
+# PagedMemory serves the view's bytes a page at a time, only what segments
+# back is read and the rest of a page they touch is zero
+import pytest
+
+from memory_model import MemoryInvalidator, PagedMemory
+
+class Segment(object):
+  def __init__(self, start, end):
+    self.start = start
+    self.end = end
+
+class View(object):
+  # reading outside a segment is a bug in the caller
+  def __init__(self, segments):
+    self.segments = [Segment(start, end) for start, end in segments]
+    self.reads = []
+
+  def byte(self, address):
+    return (address * 7 + 3) & 0xFF
+
+  def read(self, address, length):
+    self.reads.append((address, length))
+    assert any(x.start <= address and address + length <= x.end for x in self.segments)
+    return bytes(self.byte(address + i) for i in range(length))
+
+def expected(view, address, length):
+  return bytes(view.byte(x) if any(y.start <= x < y.end for y in view.segments) else 0 for x in range(address, address + length))
+
+def test_reads_match_the_view():
+  view = View([(0x1000, 0x4000)])
+  memory = PagedMemory(view, 0x100)
+  for address, length in [(0x1000, 4), (0x10FE, 4), (0x1234, 0x300), (0x3FFC, 4)]:
+    assert bytes(memory.read(address, length)) == expected(view, address, length)
+  assert memory.read_int(0x10FE, 4) == int.from_bytes(expected(view, 0x10FE, 4), "little")
+  assert memory.read_int(0x2000, 8) == int.from_bytes(expected(view, 0x2000, 8), "little")
+
+def test_pages_are_read_once():
+  view = View([(0x1000, 0x4000)])
+  memory = PagedMemory(view, 0x100)
+  for _ in range(3):
+    memory.read_int(0x1010, 4)
+    memory.read_int(0x1020, 2)
+  assert view.reads == [(0x1000, 0x100)]
+  assert memory.stats() == {"loads": 6, "page_reads": 1, "pages": 1}
+
+def test_segments_ending_mid_page():
+  view = View([(0x1000, 0x1080), (0x10C0, 0x1100)])
+  memory = PagedMemory(view, 0x100)
+  assert bytes(memory.read(0x1070, 0x60)) == expected(view, 0x1070, 0x60)
+  assert memory.read_int(0x1080, 4) == 0
+  assert sorted(view.reads) == [(0x1000, 0x80), (0x10C0, 0x40)]
+
+def test_unbacked_pages_fail():
+  memory = PagedMemory(View([(0x1000, 0x1100)]), 0x100)
+  with pytest.raises(Exception, match="Couldn't read"):
+    memory.read_int(0x2000, 4)
+  with pytest.raises(Exception, match="Couldn't read"):
+    memory.read(0x10FC, 8)
+
+def test_writes_invalidate_their_pages():
+  view = View([(0x1000, 0x2000)])
+  memory = PagedMemory(view, 0x100)
+  invalidator = MemoryInvalidator(memory)
+  memory.read_int(0x1000, 4)
+  memory.read_int(0x1200, 4)
+  invalidator.data_written(view, 0x10FF, 2)
+  assert memory.stats()["pages"] == 1
+  memory.read_int(0x1000, 4)
+  assert view.reads[-1] == (0x1000, 0x100)
+  invalidator.data_inserted(view, 0x1800, 4)
+  assert memory.stats()["pages"] == 0
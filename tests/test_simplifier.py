@@ -0,0 +1,193 @@
+# one test per Simplifier rule, plus random expressions checked against
+# evaluating them unsimplified
+import random
+
+import pytest
+
+from identify_handler import (
+  AstNodeAdd, AstNodeAnd, AstNodeAssignment, AstNodeConstant, AstNodeNeg, AstNodeNot, AstNodeOr,
+  AstNodeRegisterSsa, AstNodeRol, AstNodeRor, AstNodeShl, AstNodeShr, AstNodeSub, AstNodeSx,
+  AstNodeXor, AstNodeZx, EvaluationContext, MASKS_BY_SIZE, Simplifier, simplify_assignments,
+)
+
+X = AstNodeRegisterSsa("eax", 1)
+Y = AstNodeRegisterSsa("ebx", 1)
+
+def C(value):
+  return AstNodeConstant(value)
+
+def simplify(value):
+  simplifier = Simplifier()
+  return simplifier.simplify(value), simplifier.hits
+
+def test_constant_fold():
+  result, hits = simplify(AstNodeAdd(C(0xFFFFFFFF), C(2), 4))
+  assert result is C(1)
+  assert hits["constant_fold"] == 1
+  assert simplify(AstNodeSx(C(0x80), 4, 1))[0] is C(0xFFFFFF80)
+  assert simplify(AstNodeNot(C(0), 2))[0] is C(0xFFFF)
+
+def test_commute_constant():
+  result, hits = simplify(AstNodeAnd(C(0xFF), X, 4))
+  assert result is AstNodeAnd(X, C(0xFF), 4)
+  assert hits["commute_constant"] == 1
+
+@pytest.mark.parametrize("value", [
+  AstNodeXor(X, C(0), 4),
+  AstNodeOr(X, C(0), 4),
+  AstNodeShl(X, C(0), 4),
+  AstNodeShr(X, C(0), 4),
+  AstNodeRol(X, C(32), 4),
+  AstNodeRor(X, C(0), 4),
+  AstNodeOr(X, X, 4),
+  AstNodeAnd(X, X, 4),
+  AstNodeAnd(X, C(0xFFFFFFFF), 4),
+])
+def test_identity(value):
+  result, hits = simplify(value)
+  assert result is X
+  assert hits["identity"] == 1
+
+def test_xor_self():
+  result, hits = simplify(AstNodeXor(X, X, 4))
+  assert result is C(0)
+  assert hits["xor_self"] == 1
+
+def test_xor_chain():
+  result, hits = simplify(AstNodeXor(AstNodeXor(X, C(0x1234), 4), C(0x00FF), 4))
+  assert result is AstNodeXor(X, C(0x12CB), 4)
+  assert hits["xor_chain"] == 1
+
+def test_xor_chain_keeps_sizes_apart():
+  value = AstNodeXor(AstNodeXor(X, C(0x1234), 2), C(0x00FF), 4)
+  assert simplify(value)[0] is value
+
+def test_xor_mask_to_not():
+  result, hits = simplify(AstNodeXor(X, C(0xFFFF), 2))
+  assert result is AstNodeNot(X, 2)
+  assert hits["xor_mask_to_not"] == 1
+
+def test_not_xor():
+  result, hits = simplify(AstNodeXor(AstNodeNot(X, 4), C(0x0F), 4))
+  assert result is AstNodeXor(X, C(0xFFFFFFF0), 4)
+  assert hits["not_xor"] == 1
+
+@pytest.mark.parametrize("kind", [AstNodeNot, AstNodeNeg])
+def test_not_not(kind):
+  result, hits = simplify(kind(kind(X, 4), 4))
+  assert result is X
+  assert hits["not_not"] == 1
+
+def test_not_not_keeps_sizes_apart():
+  value = AstNodeNot(AstNodeNot(X, 2), 4)
+  assert simplify(value)[0] is value
+
+def test_add_sub_chain():
+  result, hits = simplify(AstNodeSub(AstNodeAdd(AstNodeAdd(X, C(5), 4), Y, 4), AstNodeAdd(Y, C(7), 4), 4))
+  assert result is AstNodeSub(X, C(2), 4)
+  assert hits["add_sub_chain"] >= 1
+
+def test_add_sub_chain_cancels_to_constant():
+  assert simplify(AstNodeSub(AstNodeAdd(X, C(3), 4), X, 4))[0] is C(3)
+
+def test_rotate_merge():
+  result, hits = simplify(AstNodeRol(AstNodeRol(X, C(13), 4), C(25), 4))
+  assert result is AstNodeRol(X, C(6), 4)
+  assert hits["rotate_merge"] == 1
+  assert simplify(AstNodeRor(AstNodeRol(X, C(3), 2), C(5), 2))[0] is AstNodeRor(X, C(2), 2)
+
+def test_mask_narrowing():
+  result, hits = simplify(AstNodeZx(AstNodeZx(X, 2), 4))
+  assert result is AstNodeZx(X, 4)
+  assert hits["mask_narrowing"] == 1
+  assert simplify(AstNodeAdd(X, C(0x1000000FF), 4))[0] is AstNodeAdd(X, C(0xFF), 4)
+
+def test_simplify_assignments_propagates_and_inlines():
+  a = AstNodeRegisterSsa("ecx", 1)
+  b = AstNodeRegisterSsa("ecx", 2)
+  c = AstNodeRegisterSsa("edx", 1)
+  dead = AstNodeRegisterSsa("esi", 1)
+  assignments = [
+    AstNodeAssignment(a, C(0x10)),
+    AstNodeAssignment(b, AstNodeXor(AstNodeXor(X, a, 4), C(0x10), 4)),
+    AstNodeAssignment(dead, AstNodeAdd(X, C(1), 4)),
+    AstNodeAssignment(c, AstNodeAdd(b, C(1), 4)),
+  ]
+  assert simplify_assignments(assignments, keep={c}) == [AstNodeAssignment(c, AstNodeAdd(X, C(1), 4))]
+
+# random expressions over two registers per width, so x ^ x, x - x and the
+# chain rules come up often. lifted slices read narrow registers through a
+# mask, so a register never holds more than the operations reading it take
+
+SIZES = [1, 2, 4, 8]
+REGISTERS = {size: [AstNodeRegisterSsa("r%d" % size, 1), AstNodeRegisterSsa("s%d" % size, 1)] for size in SIZES}
+BINARY_KINDS = [AstNodeAdd, AstNodeSub, AstNodeXor, AstNodeOr, AstNodeAnd, AstNodeShl, AstNodeShr, AstNodeRol, AstNodeRor]
+
+def random_constant(rng, size):
+  mask = MASKS_BY_SIZE[size]
+  return C(rng.choice([0, 1, mask, mask >> 1, rng.randrange(0x40), rng.randrange(mask + 1)]))
+
+def random_expression(rng, size, depth):
+  # every node's operands are already no wider than its size, the way lifted
+  # slices are built
+  if depth == 0 or rng.random() < 0.15:
+    if rng.random() < 0.6:
+      return rng.choice(REGISTERS[size])
+    return random_constant(rng, size)
+  choice = rng.random()
+  if choice < 0.6:
+    kind = rng.choice(BINARY_KINDS)
+    lhs = random_expression(rng, size, depth - 1)
+    if kind in (AstNodeShl, AstNodeShr, AstNodeRol, AstNodeRor) and rng.random() < 0.7:
+      rhs = C(rng.randrange(size * 8 * 2))
+    elif rng.random() < 0.4:
+      rhs = random_constant(rng, size)
+    else:
+      rhs = random_expression(rng, size, depth - 1)
+    return kind(lhs, rhs, size)
+  elif choice < 0.8:
+    kind = rng.choice([AstNodeNot, AstNodeNeg])
+    return kind(random_expression(rng, size, depth - 1), size)
+  smaller = [x for x in SIZES if x < size]
+  if not smaller:
+    return AstNodeNot(random_expression(rng, size, depth - 1), size)
+  operand_size = rng.choice(smaller)
+  operand = random_expression(rng, operand_size, depth - 1)
+  if rng.random() < 0.5:
+    return AstNodeZx(operand, size)
+  return AstNodeSx(operand, size, operand_size)
+
+def evaluate(value, registers):
+  return EvaluationContext(dict(registers)).evaluate(value)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_expressions_keep_their_value(seed):
+  rng = random.Random(seed)
+  for _ in range(50):
+    size = rng.choice(SIZES)
+    value = random_expression(rng, size, 5)
+    simplified, _ = simplify(value)
+    for _ in range(4):
+      registers = {x: rng.randrange(MASKS_BY_SIZE[size] + 1) for size in SIZES for x in REGISTERS[size]}
+      assert evaluate(simplified, registers) == evaluate(value, registers), (value, simplified, registers)
+
+@pytest.mark.parametrize("seed", range(10))
+def test_random_assignments_keep_their_value(seed):
+  # chains where later definitions read earlier ones, simplified with only
+  # the last definition kept
+  rng = random.Random(seed)
+  assignments = []
+  for version in range(2, 12):
+    dest = AstNodeRegisterSsa("r4", version)
+    value = random_expression(rng, 4, 3)
+    if assignments and rng.random() < 0.8:
+      previous = rng.choice(assignments).dest
+      value = rng.choice([AstNodeAdd, AstNodeXor, AstNodeSub])(value, previous, 4)
+    assignments.append(AstNodeAssignment(dest, value))
+  last = assignments[-1].dest
+  simplified = simplify_assignments(assignments, keep={last})
+  for _ in range(4):
+    registers = {x: rng.randrange(MASKS_BY_SIZE[size] + 1) for size in SIZES for x in REGISTERS[size]}
+    expected = EvaluationContext({x.dest: x for x in assignments} | registers).evaluate(last)
+    actual = EvaluationContext({x.dest: x for x in simplified} | registers).evaluate(last)
+    assert actual == expected, (assignments, simplified)
@@ -0,0 +1,36 @@
+# one shared backward slice for several registers holds what the separate
+# slices do, each definition once and before anything using it
+import identify_handler
+from fake_binaryninja import BinaryView
+from synthetic import make_vmenter
+
+def vmenter():
+  return make_vmenter(BinaryView(), 0x401000, 32, 0.5, seed=7)
+
+def test_shared_slice_is_the_union_of_single_slices(cold_caches):
+  func = vmenter()
+  names = identify_handler.VMENTER_REGISTERS
+  assignments, entries = identify_handler.find_all_dependent_registers_from_register_names(func, names)
+  dests = [x.dest for x in assignments]
+  assert len(dests) == len(set(dests))
+  single = set()
+  for name in names:
+    single.update(x.dest for x in identify_handler.find_all_dependent_registers_from_register_name(func, name))
+  assert set(dests) == single
+  assert sorted(entries) == sorted(names)
+
+def test_shared_slice_is_in_dependency_order(cold_caches):
+  assignments, _ = identify_handler.find_all_dependent_registers_from_register_names(vmenter(), identify_handler.VMENTER_REGISTERS)
+  defined = set()
+  for assignment in assignments:
+    for register in identify_handler.register_references(assignment):
+      assert register.version == 0 or register in defined
+    defined.add(assignment.dest)
+
+def test_shared_values_match_single_values(cold_caches):
+  func = vmenter()
+  names = identify_handler.VMENTER_REGISTERS
+  initial_registers = identify_handler.vmenter_initial_registers(4, 0x401000)
+  values = identify_handler.get_final_values(func, names, initial_registers)
+  for name in names:
+    assert identify_handler.get_final_values(func, [name], initial_registers) == {name: values[name]}
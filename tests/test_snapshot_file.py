@@ -0,0 +1,102 @@
+# the VMPS format round trips values and memory, and turns down anything that
+# isn't a whole snapshot file
+import pytest
+
+import identify_handler
+from fake_binaryninja import BinaryView
+from snapshot_file import HEADER, MEMORY_RANGE, read_snapshot_file, write_snapshot_file
+from synthetic import make_vmenter
+
+FUNCTIONS = [
+  {
+    "start": 0x401000,
+    "name": "vmenter",
+    "blocks": [[0x401000, 0x20], [0x401020, 4]],
+    "values": [None, True, False, 0, 0x7F, 0x80, 1 << 64, -1, -(1 << 40), "", "esp", "esp", b"", b"\x00\xff" * 100],
+    "nested": {"a": {"b": [[], {}, [[1, "c"]]]}, 5: "five"},
+  },
+  {"start": 0x402000, "name": "handler", "blocks": [], "values": []},
+]
+MEMORY_RANGES = [(0x600000, bytes(range(256)) * 16), (0x400000, b""), (0x500000, b"\x90" * 3)]
+
+def write(tmp_path, functions=FUNCTIONS, memory_ranges=MEMORY_RANGES):
+  path = str(tmp_path / "snapshot.vmps")
+  write_snapshot_file(path, functions, memory_ranges)
+  return path
+
+def test_round_trip(tmp_path):
+  view = read_snapshot_file(write(tmp_path))
+  assert [x.snapshot for x in view.functions] == FUNCTIONS
+  assert view.memory_ranges == sorted(MEMORY_RANGES)
+  assert [(x.start, x.length) for x in view.get_function_at(0x401000).basic_blocks] == [(0x401000, 0x20), (0x401020, 4)]
+  assert view.get_function_at(0x403000) is None
+
+def test_replay_view_reads(tmp_path):
+  view = read_snapshot_file(write(tmp_path))
+  assert view.read(0x600010, 4) == bytes([0x10, 0x11, 0x12, 0x13])
+  assert view.read(0x500002, 4) == b"\x90"
+  assert view.read(0x700000, 4) == b""
+  assert [(x.start, x.end) for x in view.segments] == [(0x400000, 0x400000), (0x500000, 0x500003), (0x600000, 0x601000)]
+
+def test_wrong_magic(tmp_path):
+  path = write(tmp_path)
+  with open(path, "r+b") as handle:
+    handle.write(b"VMPX")
+  with pytest.raises(Exception, match="isn't a snapshot file"):
+    read_snapshot_file(path)
+
+def test_wrong_version(tmp_path):
+  path = write(tmp_path)
+  with open(path, "r+b") as handle:
+    handle.seek(4)
+    handle.write(b"\x02\x00")
+  with pytest.raises(Exception, match="snapshot format 2"):
+    read_snapshot_file(path)
+
+def test_empty_and_short_files(tmp_path):
+  path = tmp_path / "short.vmps"
+  for data in [b"", b"VMPS", b"VMPS\x01\x00"]:
+    path.write_bytes(data)
+    with pytest.raises(Exception, match="isn't a snapshot file"):
+      read_snapshot_file(str(path))
+
+def test_every_truncation_is_rejected(tmp_path):
+  path = write(tmp_path)
+  with open(path, "rb") as handle:
+    data = handle.read()
+  short = tmp_path / "short.vmps"
+  for length in range(HEADER.size, len(data)):
+    short.write_bytes(data[:length])
+    with pytest.raises(Exception):
+      read_snapshot_file(str(short))
+
+def test_wrong_memory_length(tmp_path):
+  # no strings, so the first memory range comes straight after the header
+  path = write(tmp_path, [], [(0x600000, bytes(64))])
+  with open(path, "r+b") as handle:
+    data = bytearray(handle.read())
+    start, length, compressed_length = MEMORY_RANGE.unpack_from(data, HEADER.size)
+    MEMORY_RANGE.pack_into(data, HEADER.size, start, length + 1, compressed_length)
+    handle.seek(0)
+    handle.write(data)
+  with pytest.raises(Exception, match="has 64 bytes at 0x600000 but says it has 65"):
+    read_snapshot_file(path)
+
+def test_trailing_bytes(tmp_path):
+  path = write(tmp_path)
+  with open(path, "ab") as handle:
+    handle.write(b"\x00")
+  with pytest.raises(Exception, match="1 bytes after its functions"):
+    read_snapshot_file(path)
+
+def test_replayed_function_evaluates_the_same(tmp_path, cold_caches):
+  func = make_vmenter(BinaryView(), 0x401000, 64, 0.5)
+  # the fake view's one segment is the whole address space, so only the
+  # code is exported and both sides load through the live view
+  initial_registers = identify_handler.vmenter_initial_registers(4, 0x1000)
+  read_mem = identify_handler.get_view_memory(func.view).read_int
+  expected = identify_handler.get_final_values(func, identify_handler.VMENTER_REGISTERS, initial_registers, read_mem=read_mem)
+  path = str(tmp_path / "vmenter.vmps")
+  identify_handler.export_view_snapshot(func.view, path, functions=[func], memory_ranges=[(func.start, func.code)])
+  replayed = identify_handler.load_view_snapshot(path).get_function_at(0x401000)
+  assert identify_handler.get_final_values(replayed, identify_handler.VMENTER_REGISTERS, initial_registers, read_mem=read_mem) == expected
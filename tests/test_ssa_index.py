@@ -0,0 +1,68 @@
+# SsaIndex answers what get_ssa_reg_definition does, plus uses and users,
+# in one pass over the function
+from fake_binaryninja import (
+  BinaryView, Function, ILIntrinsic, LowLevelILAdd, LowLevelILConst, LowLevelILFlagSsa, LowLevelILIf,
+  LowLevelILIntrinsicSsa, LowLevelILJump, LowLevelILLoadSsa, LowLevelILRegPhi, LowLevelILRegSsa,
+  LowLevelILRegSsaPartial, LowLevelILSetFlagSsa, LowLevelILSetRegSsa, LowLevelILSetRegSsaPartial, SSAFlag,
+  SSARegister, SSARegisterOrFlag,
+)
+from ssa_index import SsaIndex, get_ssa_index, invalidate_ssa_index
+from synthetic import make_vmenter
+
+def R(name, version):
+  return LowLevelILRegSsa(4, SSARegister(name, version))
+
+def C(value):
+  return LowLevelILConst(4, value)
+
+def S(name, version, source):
+  return LowLevelILSetRegSsa(4, SSARegister(name, version), source)
+
+def mixed():
+  return Function(BinaryView(), 0x401000, [
+    S("eax", 1, LowLevelILAdd(4, R("ecx", 0), C(1))),
+    LowLevelILSetRegSsaPartial(1, SSARegister("eax", 2), "al", R("edx", 0)),
+    LowLevelILRegPhi(4, SSARegister("ebx", 2), [SSARegister("ebx", 0), SSARegister("ebx", 1)]),
+    LowLevelILIntrinsicSsa(4, [SSARegisterOrFlag("edx", 1)], ILIntrinsic("rdtsc"), []),
+    LowLevelILSetFlagSsa(0, SSAFlag("z", 1), LowLevelILRegSsaPartial(1, SSARegister("eax", 2), "al")),
+    LowLevelILIf(0, LowLevelILFlagSsa(0, SSAFlag("z", 1)), 6, 6),
+    LowLevelILJump(4, LowLevelILLoadSsa(4, R("eax", 2), 0)),
+  ])
+
+def test_definitions_match_the_function():
+  func = mixed()
+  index = SsaIndex(func.llil)
+  for register in func.llil.ssa_registers:
+    expected = func.llil.get_ssa_reg_definition(register)
+    if expected is not None:
+      assert index.get_definition(register) is expected
+  instructions = func.llil.instructions
+  assert index.get_definition(SSARegister("ebx", 2)) is instructions[2]
+  assert index.get_definition(SSARegister("edx", 1)) is instructions[3]
+  assert index.get_definition(SSARegister("ecx", 0)) is None
+
+def test_uses_and_users():
+  func = mixed()
+  index = SsaIndex(func.llil)
+  instructions = func.llil.instructions
+  # a partial write keeps the bytes it doesn't write from the previous version
+  assert set(index.get_uses(instructions[1])) == {SSARegister("edx", 0), SSARegister("eax", 1)}
+  assert set(index.get_uses(instructions[2])) == {SSARegister("ebx", 0), SSARegister("ebx", 1)}
+  assert index.get_uses(instructions[6]) == [SSARegister("eax", 2)]
+  assert index.get_users(instructions[0]) == [instructions[1]]
+  assert index.get_users(instructions[1]) == [instructions[4], instructions[6]]
+  assert index.flag_definitions[("z", 1)] is instructions[4]
+
+def test_latest_register():
+  index = SsaIndex(mixed().llil)
+  assert index.get_latest_register("eax") == SSARegister("eax", 2)
+  assert index.get_latest_register("ebx") == SSARegister("ebx", 2)
+  assert index.get_latest_register("esi") is None
+
+def test_one_index_until_invalidated(cold_caches):
+  func = make_vmenter(BinaryView(), 0x401000, 8)
+  index = get_ssa_index(func)
+  assert get_ssa_index(func) is index
+  assert index.get_liveness(["eax"]) is index.get_liveness(["eax"])
+  invalidate_ssa_index(func)
+  assert get_ssa_index(func) is not index
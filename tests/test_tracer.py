@@ -0,0 +1,112 @@
+# VmTracer follows vip from the vmenter through the handlers it dispatches to
+import struct
+
+import identify_handler
+from fake_binaryninja import (
+  BinaryView, Function, LowLevelILAdd, LowLevelILConst, LowLevelILJump, LowLevelILLoadSsa, LowLevelILLsl,
+  LowLevelILRegSsa, LowLevelILRet, LowLevelILSetRegSsa, LowLevelILStoreSsa, LowLevelILSub, LowLevelILZx,
+  SSARegister,
+)
+
+TABLE = 0x500000
+BYTECODE = 0x600000
+
+def R(name, version):
+  return LowLevelILRegSsa(4, SSARegister(name, version))
+
+def C(value):
+  return LowLevelILConst(4, value)
+
+def S(name, version, source):
+  return LowLevelILSetRegSsa(4, SSARegister(name, version), source)
+
+class View(BinaryView):
+  # the fake view with a handler table and bytecode written over it
+  def __init__(self, memory):
+    BinaryView.__init__(self)
+    self.memory = memory
+
+  def read(self, address, length):
+    for start, data in self.memory:
+      if start <= address < start + len(data):
+        return data[address - start:address - start + length]
+    return BinaryView.read(self, address, length)
+
+def dispatch(esi):
+  # eax = byte at vip, vip += 1, jump through the table
+  return [
+    S("eax", 9, LowLevelILZx(4, LowLevelILLoadSsa(1, R("esi", esi), 0))),
+    S("edi", 1, LowLevelILLoadSsa(4, LowLevelILAdd(4, C(TABLE), LowLevelILLsl(4, R("eax", 9), C(2))), 0)),
+    S("esi", esi + 1, LowLevelILAdd(4, R("esi", esi), C(1))),
+    LowLevelILJump(4, R("edi", 1)),
+  ]
+
+def make_vm():
+  # vmenter, then push imm8 / add / exit handlers, running push 5, push 7,
+  # add, exit
+  view = View([(TABLE, struct.pack("<III", 0x402000, 0x403000, 0x404000)), (BYTECODE, bytes([0, 5, 0, 7, 1, 2]) + bytes(16))])
+  vmenter = Function(view, 0x401000, [
+    S("esp", 1, LowLevelILSub(4, R("esp", 0), C(0x24))),
+    S("esi", 1, LowLevelILLoadSsa(4, LowLevelILAdd(4, R("esp", 1), C(0x28)), 0)),
+    S("ebp", 1, LowLevelILSub(4, R("esp", 0), C(0x100))),
+  ] + dispatch(1))
+  Function(view, 0x402000, [
+    S("ebp", 1, LowLevelILSub(4, R("ebp", 0), C(4))),
+    S("eax", 1, LowLevelILZx(4, LowLevelILLoadSsa(1, R("esi", 0), 0))),
+    S("esi", 1, LowLevelILAdd(4, R("esi", 0), C(1))),
+    LowLevelILStoreSsa(4, R("ebp", 1), 1, 0, R("eax", 1)),
+  ] + dispatch(1))
+  Function(view, 0x403000, [
+    S("eax", 1, LowLevelILLoadSsa(4, R("ebp", 0), 0)),
+    S("ecx", 1, LowLevelILLoadSsa(4, LowLevelILAdd(4, R("ebp", 0), C(4)), 0)),
+    S("ebp", 1, LowLevelILAdd(4, R("ebp", 0), C(4))),
+    LowLevelILStoreSsa(4, R("ebp", 1), 1, 0, LowLevelILAdd(4, R("eax", 1), R("ecx", 1))),
+  ] + dispatch(0))
+  Function(view, 0x404000, [
+    S("eax", 1, LowLevelILLoadSsa(4, R("ebp", 0), 0)),
+    LowLevelILRet(4, R("esp", 0)),
+  ])
+  return vmenter
+
+def test_trace(cold_caches):
+  tracer = identify_handler.VmTracer.from_vmenter(make_vm(), BYTECODE)
+  steps = list(tracer.run())
+  assert [x.handler for x in steps] == [0x401000, 0x402000, 0x402000, 0x403000, 0x404000]
+  # dispatch has already stepped past each handler's own opcode, so what a
+  # step reads at vip is its operand or the next opcode
+  assert [x.opcode for x in steps] == [None, 5, 7, 2, 0]
+  assert [x.vip for x in steps[1:]] == [BYTECODE + 1, BYTECODE + 3, BYTECODE + 5, BYTECODE + 6]
+  assert steps[1].stores == [(identify_handler.STACK_TOP - 0x104, 4, 5)]
+  assert tracer.finished
+  assert tracer.read_mem(tracer.registers["ebp"], 4) == 12
+
+def test_fork_runs_on_its_own(cold_caches):
+  tracer = identify_handler.VmTracer.from_vmenter(make_vm(), BYTECODE)
+  list(tracer.run(2))
+  fork = tracer.fork()
+  list(fork.run())
+  assert fork.read_mem(fork.registers["ebp"], 4) == 12
+  assert tracer.steps == 2
+  assert tracer.read_mem(tracer.registers["ebp"], 4) == 5
+
+def push_then_read():
+  # push 0x1234, mov edi, [esp], then the key from above the return address
+  return Function(BinaryView(), 0x401000, [
+    S("esp", 1, LowLevelILSub(4, R("esp", 0), C(4))),
+    LowLevelILStoreSsa(4, R("esp", 1), 1, 0, C(0x1234)),
+    S("edi", 1, LowLevelILLoadSsa(4, R("esp", 1), 1)),
+    S("esi", 1, LowLevelILLoadSsa(4, LowLevelILAdd(4, R("esp", 1), C(8)), 1)),
+    S("ebp", 1, R("esp", 1)),
+    S("ebx", 1, R("esi", 1)),
+    LowLevelILJump(4, R("edi", 1)),
+  ])
+
+def test_vmenter_step_matches_evaluate_vmenter(cold_caches):
+  func = push_then_read()
+  expected = identify_handler.evaluate_vmenter(func, 0xAAAA)
+  tracer = identify_handler.VmTracer.from_vmenter(func, 0xAAAA)
+  step = tracer.step()
+  assert step.stores == [(identify_handler.STACK_TOP - 4, 4, 0x1234)]
+  for name in ["esi", "ebp", "edi", "ebx"]:
+    assert tracer.registers[name] == expected[name]
+  assert tracer.handler == 0x1234
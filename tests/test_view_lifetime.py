@@ -0,0 +1,37 @@
+# per view state goes away with its view
+import gc
+import weakref
+
+import analysis_session
+import memory_model
+from fake_binaryninja import BinaryView
+from synthetic import make_handler
+
+def test_closed_view_drops_its_session():
+  view = BinaryView()
+  func = make_handler(view, 0x401000, 16)
+  session = analysis_session.get_analysis_session(view)
+  session.get(func, "test", lambda: 1)
+  assert analysis_session.get_analysis_session(view) is session
+  # views earlier tests let go of are collected first
+  gc.collect()
+  sessions = len(analysis_session.sessions)
+  view_reference = weakref.ref(view)
+  del view, func, session
+  gc.collect()
+  assert view_reference() is None
+  assert len(analysis_session.sessions) == sessions - 1
+
+def test_closed_view_drops_its_memory():
+  view = BinaryView()
+  func = make_handler(view, 0x401000, 16)
+  memory = memory_model.get_view_memory(view)
+  assert memory.read_int(0x401000, 1) == func.code[0]
+  assert memory_model.get_view_memory(view) is memory
+  gc.collect()
+  memories = len(memory_model.view_memories)
+  view_reference = weakref.ref(view)
+  del view, func, memory
+  gc.collect()
+  assert view_reference() is None
+  assert len(memory_model.view_memories) == memories - 1
@@ -0,0 +1,141 @@
+# PersistentMap against a dict, and VmContext forks and snapshots keeping
+# their writes apart
+import random
+
+import pytest
+
+from vm_context import EMPTY_MAP, TRIE_BITS, PersistentMap, VmContext
+
+STACK_LOW = 0xFFFE0000
+STACK_HIGH = 0xFFFF1000
+
+class Base(object):
+  # one backed range, like memory_model.PagedMemory over a single segment
+  def __init__(self, start, data):
+    self.start = start
+    self.data = data
+
+  def read_int(self, address, size):
+    offset = address - self.start
+    if offset < 0 or offset + size > len(self.data):
+      raise Exception("Couldn't read %d bytes at %x" % (size, address))
+    return int.from_bytes(self.data[offset:offset + size], "little")
+
+def make_context():
+  context = VmContext(Base(0x1000, bytes(range(256))), 4, "esp", STACK_LOW, STACK_HIGH)
+  context.registers["esp"] = 0xFFFF0000
+  return context
+
+def test_empty_map():
+  assert len(EMPTY_MAP) == 0
+  assert EMPTY_MAP.get(0) is None
+  assert 0 not in EMPTY_MAP
+  assert list(EMPTY_MAP.items()) == []
+
+def test_keys_sharing_low_bits():
+  # same slot at every level until the top bits, so the trie goes deep
+  keys = [0, 1 << (TRIE_BITS * 6), 1 << (TRIE_BITS * 6 + 1), 0xFFFFFFFF, 0xFFFFFFFF + (1 << 40)]
+  memory = EMPTY_MAP
+  for value, key in enumerate(keys):
+    memory = memory.set(key, value)
+  assert [memory.get(x) for x in keys] == list(range(len(keys)))
+  assert memory.get(1 << 40) is None
+  assert sorted(memory.items()) == sorted(zip(keys, range(len(keys))))
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_against_dict(seed):
+  rng = random.Random(seed)
+  expected = {}
+  memory = PersistentMap()
+  versions = []
+  for _ in range(2000):
+    key = rng.choice([rng.randrange(64), rng.randrange(1 << 32), 0xFFFF0000 + rng.randrange(256)])
+    value = rng.randrange(256)
+    memory = memory.set(key, value)
+    expected[key] = value
+    if rng.random() < 0.05:
+      versions.append((memory, dict(expected)))
+  versions.append((memory, expected))
+  # every earlier version still reads as it did when it was taken
+  for memory, expected in versions:
+    assert len(memory) == len(expected)
+    assert dict(memory.items()) == expected
+    for key, value in expected.items():
+      assert memory.get(key) == value
+      assert key in memory
+    assert memory.get(1 << 33) is None
+
+def test_overwrite_keeps_size():
+  memory = EMPTY_MAP.set(5, 1).set(5, 2)
+  assert len(memory) == 1
+  assert memory.get(5) == 2
+
+def test_reads_and_writes():
+  context = make_context()
+  context.write_int(0x2000, 4, 0x11223344)
+  assert context.read_int(0x2000, 4) == 0x11223344
+  assert context.read_int(0x2001, 2) == 0x2233
+  assert context.read_int(0x1004, 2) == 0x0504
+  # one byte written over the base, the rest comes from it
+  context.write_int(0x1010, 1, 0xAA)
+  assert context.read_int(0x1010, 4) == 0x131211AA
+  assert context.writes == 2
+
+def test_write_is_masked_to_size():
+  context = make_context()
+  context.write_int(0x2000, 2, 0x123456)
+  assert context.read_int(0x2000, 2) == 0x3456
+  assert 0x2002 not in context.memory
+
+def test_unwritten_stack_reads_as_zero():
+  context = make_context()
+  assert context.read_int(0xFFFF0004, 4) == 0
+  context.write_int(0xFFFF0004, 1, 0x7F)
+  assert context.read_int(0xFFFF0004, 4) == 0x7F
+
+def test_unbacked_read_raises():
+  context = make_context()
+  with pytest.raises(Exception, match="Couldn't read"):
+    context.read_int(0x9000, 4)
+  context.write_int(0x9000, 2, 0xFFFF)
+  with pytest.raises(Exception, match="Couldn't read"):
+    context.read_int(0x9000, 4)
+  assert context.read_int(0x9000, 2) == 0xFFFF
+
+def test_push_and_stack_slots():
+  context = make_context()
+  context.push(0x1234)
+  assert context.registers["esp"] == 0xFFFEFFFC
+  assert context.stack_slot(0) == 0x1234
+  context.set_stack_slot(8, 0x5678)
+  assert context.read_int(0xFFFF0004, 4) == 0x5678
+
+def test_fork_keeps_writes_apart():
+  parent = make_context()
+  parent.write_int(0x2000, 4, 1)
+  child = parent.fork()
+  child.write_int(0x2000, 4, 2)
+  child.write_int(0x3000, 4, 3)
+  child.registers["esp"] -= 4
+  parent.write_int(0x4000, 4, 4)
+  assert parent.read_int(0x2000, 4) == 1
+  assert child.read_int(0x2000, 4) == 2
+  assert 0x3000 not in parent.memory
+  assert 0x4000 not in child.memory
+  assert parent.registers["esp"] == 0xFFFF0000
+  assert child.writes == 3
+  assert parent.writes == 2
+
+def test_snapshot_and_restore():
+  context = make_context()
+  context.write_int(0x2000, 4, 1)
+  snapshot = context.snapshot()
+  context.write_int(0x2000, 4, 2)
+  context.registers["eax"] = 5
+  context.restore(snapshot)
+  assert context.read_int(0x2000, 4) == 1
+  assert "eax" not in context.registers
+  # restoring hands out a copy, the snapshot can be restored again
+  context.registers["eax"] = 6
+  context.restore(snapshot)
+  assert "eax" not in context.registers
@@ -0,0 +1,64 @@
+# evaluate_vmenter runs the vmenter's stores and loads in program order, and
+# evaluate_vmenter_batch agrees with it
+import pytest
+
+import identify_handler
+from fake_binaryninja import (
+  BinaryView, Function, LowLevelILAdd, LowLevelILConst, LowLevelILJump, LowLevelILLoadSsa, LowLevelILRegSsa,
+  LowLevelILSetRegSsa, LowLevelILStoreSsa, LowLevelILSub, SSARegister,
+)
+from synthetic import make_vmenter
+
+def R(name, version):
+  return LowLevelILRegSsa(4, SSARegister(name, version))
+
+def C(value):
+  return LowLevelILConst(4, value)
+
+def S(name, version, source):
+  return LowLevelILSetRegSsa(4, SSARegister(name, version), source)
+
+def push_then_read():
+  # push 0x1234, mov edi, [esp], then the key from above the return address
+  return Function(BinaryView(), 0x401000, [
+    S("esp", 1, LowLevelILSub(4, R("esp", 0), C(4))),
+    LowLevelILStoreSsa(4, R("esp", 1), 1, 0, C(0x1234)),
+    S("edi", 1, LowLevelILLoadSsa(4, R("esp", 1), 1)),
+    S("esi", 1, LowLevelILLoadSsa(4, LowLevelILAdd(4, R("esp", 1), C(8)), 1)),
+    S("ebp", 1, R("esp", 1)),
+    S("ebx", 1, R("esi", 1)),
+    LowLevelILJump(4, R("edi", 1)),
+  ])
+
+def test_load_sees_earlier_store(cold_caches):
+  values = identify_handler.evaluate_vmenter(push_then_read(), 0xAAAA)
+  assert values["edi"] == 0x1234
+  assert values["esi"] == 0xAAAA
+  assert values["ebp"] == identify_handler.STACK_TOP - 4
+
+def test_needs_a_key_or_a_context(cold_caches):
+  with pytest.raises(Exception):
+    identify_handler.evaluate_vmenter(push_then_read())
+
+def test_batch_matches_scalar_on_stack_reads(cold_caches):
+  func = push_then_read()
+  keys = [0xAAAA, 0xBBBB, 0]
+  assert identify_handler.evaluate_vmenter_batch(func, keys) == [identify_handler.evaluate_vmenter(func, x) for x in keys]
+
+def test_batch_row_registers_reach_the_context(cold_caches):
+  # a row moving the stack pointer still finds its key just above it
+  func = push_then_read()
+  esp = identify_handler.AstNodeRegisterSsa("esp", 0)
+  values = identify_handler.evaluate_vmenter_batch(func, [{"key": 0xCCCC, esp: 0xFFFF8000}])[0]
+  assert values["esi"] == 0xCCCC
+  assert values["ebp"] == 0xFFFF8000 - 4
+  assert values["edi"] == 0x1234
+
+def test_batch_stays_batched_without_stack_reads(cold_caches, monkeypatch):
+  func = make_vmenter(BinaryView(), 0x401000, 64, 0.5)
+  keys = [0x1000, 0x2000, 0x3000]
+  expected = [identify_handler.evaluate_vmenter(func, x) for x in keys]
+  def one_at_a_time(*args):
+    raise AssertionError("fell back to one row at a time")
+  monkeypatch.setattr(identify_handler, "vmenter_row_context", one_at_a_time)
+  assert identify_handler.evaluate_vmenter_batch(func, keys) == expected
@@ -0,0 +1,91 @@
+# x64 vmenters evaluate with 8 byte registers and slots, and every
+# operation works at its operand's width
+import identify_handler
+from identify_handler import AstNodeAdd, AstNodeNeg, AstNodeRol, AstNodeRor, AstNodeShl, AstNodeShr, AstNodeSub
+from fake_binaryninja import (
+  BinaryView, Function, ILRegister, LowLevelILAdd, LowLevelILConst, LowLevelILJump, LowLevelILLoadSsa, LowLevelILNeg,
+  LowLevelILNot, LowLevelILRegSsa, LowLevelILRegSsaPartial, LowLevelILRol, LowLevelILSetRegSsa,
+  LowLevelILSetRegSsaPartial, LowLevelILSub, LowLevelILXor, LowLevelILZx, SSARegister,
+)
+
+MASK = (1 << 64) - 1
+
+def R(name, version, size=8):
+  return LowLevelILRegSsa(size, SSARegister(name, version))
+
+def C(value, size=8):
+  return LowLevelILConst(size, value)
+
+def S(name, version, source, size=8):
+  return LowLevelILSetRegSsa(size, SSARegister(name, version), source)
+
+def x64_vmenter():
+  # the key is at [rsp+0x90] after the vmenter's pushes, the decrypt
+  # finishes with a 32 bit write to esi which clears the top of rsi
+  return Function(BinaryView(), 0x140001000, [
+    S("rsp", 1, LowLevelILSub(8, R("rsp", 0), C(0x88))),
+    S("rsi", 1, LowLevelILLoadSsa(8, LowLevelILAdd(8, R("rsp", 1), C(0x90)), 0)),
+    S("rsi", 2, LowLevelILRol(8, LowLevelILXor(8, R("rsi", 1), C(0x1234567890ABCDEF)), C(13))),
+    S("rsi", 3, LowLevelILSub(8, R("rsi", 2), C(0xFFFFFFFFFFFF0000))),
+    LowLevelILSetRegSsaPartial(4, SSARegister("rsi", 4), ILRegister("esi"),
+      LowLevelILNeg(4, LowLevelILRegSsaPartial(4, SSARegister("rsi", 3), ILRegister("esi")))),
+    S("rbx", 1, R("rsi", 4)),
+    S("rbp", 1, R("rsp", 0)),
+    S("rsp", 2, LowLevelILSub(8, R("rsp", 0), C(0xC0))),
+    S("rdi", 1, LowLevelILNot(8, LowLevelILZx(8, LowLevelILLoadSsa(2, R("rsi", 4), 0)))),
+    LowLevelILJump(8, R("rdi", 1)),
+  ])
+
+def decrypted(key):
+  rsi = key ^ 0x1234567890ABCDEF
+  rsi = ((rsi << 13) | (rsi >> 51)) & MASK
+  rsi = (rsi - 0xFFFFFFFFFFFF0000) & MASK
+  return -(rsi & 0xFFFFFFFF) & 0xFFFFFFFF
+
+KEYS = [0x1111, 0xDEADBEEFCAFEBABE, 0]
+
+def test_x64_vmenter(cold_caches):
+  func = x64_vmenter()
+  assert identify_handler.function_address_size(func) == 8
+  for key in KEYS:
+    values = identify_handler.evaluate_vmenter(func, key)
+    assert values["rsi"] == values["rbx"] == decrypted(key)
+    assert values["rdi"] == MASK ^ func.view.read_int(decrypted(key), 2, False)
+    assert values["rsp"] == identify_handler.STACK_TOP - 0xC0
+    assert values["rbp"] == identify_handler.STACK_TOP
+
+def test_x64_batch_matches_scalar(cold_caches):
+  func = x64_vmenter()
+  assert identify_handler.evaluate_vmenter_batch(func, KEYS) == [identify_handler.evaluate_vmenter(func, x) for x in KEYS]
+
+def test_x64_tracer_starts_from_the_vmenter(cold_caches):
+  tracer = identify_handler.VmTracer.from_vmenter(x64_vmenter(), 0x1111)
+  tracer.step()
+  assert tracer.address_size == 8
+  assert tracer.registers["rsi"] == decrypted(0x1111)
+
+def test_operations_wrap_at_their_width():
+  operations = identify_handler.WIDTH_OPERATIONS
+  assert operations[2][AstNodeSub](1, 2) == 0xFFFF
+  assert operations[1][AstNodeAdd](0xFF, 1) == 0
+  assert operations[8][AstNodeSub](0, 1) == MASK
+  assert operations[1][AstNodeRol](0x81, 1) == 0x03
+  assert operations[2][AstNodeRor](0x0001, 1) == 0x8000
+  assert operations[8][AstNodeRol](1 << 63, 1) == 1
+  # counts are masked to 5 bits, or 6 for 64 bit operands
+  assert operations[4][AstNodeShl](1, 33) == 2
+  assert operations[8][AstNodeShl](1, 33) == 1 << 33
+  assert operations[1][AstNodeShr](0x80, 9) == 0
+  assert operations[8][AstNodeNeg](1) == MASK
+  assert identify_handler.evaluate_sx(0x80, 8, 1) == 0xFFFFFFFFFFFFFF80
+
+def test_partial_writes():
+  rax = identify_handler.AstNodeRegisterSsa("rax", 0)
+  eax = identify_handler.AstNodeRegisterSsa("eax", 0)
+  value = identify_handler.AstNodeConstant(0x1234)
+  def evaluate(node, register, previous):
+    return identify_handler.EvaluationContext({register: previous}).evaluate(node)
+  # the low half of an x64 register clears the top, smaller writes keep it
+  assert evaluate(identify_handler.partial_register_write(rax, "eax", value), rax, MASK) == 0x1234
+  assert evaluate(identify_handler.partial_register_write(rax, "ax", value), rax, MASK) == 0xFFFFFFFFFFFF1234
+  assert evaluate(identify_handler.partial_register_write(eax, "ah", value), eax, 0xFFFFFFFF) == 0xFFFF34FF
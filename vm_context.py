@@ -0,0 +1,155 @@
+# the state a vm runs against: native registers, the native stack frame the
+# vmenter was called with and everything handlers write, including the vm
+# scratch area (pregs) which lives on that stack
+#
+# written memory is a persistent map, so a fork (to explore both sides of a
+# conditional branch handler, say) shares everything with its parent and
+# costs the same however much has been written. only the registers are
+# copied, and there are at most 16 of them
+
+TRIE_BITS = 5
+TRIE_WIDTH = 1 << TRIE_BITS
+TRIE_MASK = TRIE_WIDTH - 1
+
+EMPTY_NODE = (None,) * TRIE_WIDTH
+
+class TrieLeaf(object):
+  __slots__ = ("key", "value")
+
+  def __init__(self, key, value):
+    self.key = key
+    self.value = value
+
+def trie_set(node, key, value, shift):
+  # (new node, whether the key is new), copying only the path to the key
+  index = (key >> shift) & TRIE_MASK
+  entry = node[index]
+  added = True
+  if entry is None:
+    entry = TrieLeaf(key, value)
+  elif type(entry) is TrieLeaf:
+    if entry.key == key:
+      entry = TrieLeaf(key, value)
+      added = False
+    else:
+      # two keys share this slot, push both a level down
+      child = trie_set(EMPTY_NODE, entry.key, entry.value, shift + TRIE_BITS)[0]
+      entry = trie_set(child, key, value, shift + TRIE_BITS)[0]
+  else:
+    entry, added = trie_set(entry, key, value, shift + TRIE_BITS)
+  return node[:index] + (entry,) + node[index + 1:], added
+
+class PersistentMap(object):
+  # immutable non-negative int -> value map, a 32 way trie on the key's bits
+  # from the bottom up so neighbouring addresses spread out near the root.
+  # set gives back a new map sharing every node off the updated path
+  __slots__ = ("root", "size")
+
+  def __init__(self, root=EMPTY_NODE, size=0):
+    self.root = root
+    self.size = size
+
+  def __len__(self):
+    return self.size
+
+  def get(self, key, default=None):
+    node = self.root
+    bits = key
+    while True:
+      entry = node[bits & TRIE_MASK]
+      if entry is None:
+        return default
+      if type(entry) is TrieLeaf:
+        return entry.value if entry.key == key else default
+      node = entry
+      bits >>= TRIE_BITS
+
+  def __contains__(self, key):
+    return self.get(key, TrieLeaf) is not TrieLeaf
+
+  def set(self, key, value):
+    root, added = trie_set(self.root, key, value, 0)
+    return PersistentMap(root, self.size + added)
+
+  def items(self):
+    stack = [self.root]
+    while stack:
+      for entry in stack.pop():
+        if entry is None:
+          continue
+        if type(entry) is TrieLeaf:
+          yield entry.key, entry.value
+        else:
+          stack.append(entry)
+
+EMPTY_MAP = PersistentMap()
+
+class VmContext(object):
+  # base is anything with read_int (memory_model.PagedMemory), reads of
+  # bytes nothing wrote come from it. the native stack is [stack_low,
+  # stack_high) and never comes from base, unwritten stack reads as zero
+  def __init__(self, base, address_size, stack_pointer, stack_low, stack_high, registers=None, memory=EMPTY_MAP):
+    self.base = base
+    self.address_size = address_size
+    self.stack_pointer = stack_pointer
+    self.stack_low = stack_low
+    self.stack_high = stack_high
+    self.registers = dict(registers or {})
+    self.memory = memory
+    self.writes = 0
+
+  def fork(self):
+    context = VmContext(self.base, self.address_size, self.stack_pointer, self.stack_low, self.stack_high,
+      self.registers, self.memory)
+    context.writes = self.writes
+    return context
+
+  def snapshot(self):
+    # (registers, memory) as they are now, the memory map never changes so
+    # holding on to it is enough
+    return dict(self.registers), self.memory
+
+  def restore(self, snapshot):
+    registers, self.memory = snapshot
+    self.registers = dict(registers)
+
+  def in_stack(self, address):
+    return self.stack_low <= address < self.stack_high
+
+  def read_base(self, address, size):
+    # anything else the base can't read raises, same as evaluating without
+    # a context would
+    if self.in_stack(address):
+      return 0
+    return self.base.read_int(address, size)
+
+  def read_int(self, address, size):
+    memory = self.memory
+    if not memory.size:
+      return self.read_base(address, size)
+    written = [memory.get(address + x) for x in range(size)]
+    if all(x is None for x in written):
+      return self.read_base(address, size)
+    if any(x is None for x in written):
+      base = self.read_base(address, size).to_bytes(size, "little")
+      written = [base[x] if value is None else value for x, value in enumerate(written)]
+    return int.from_bytes(bytes(written), "little")
+
+  def write_int(self, address, size, value):
+    memory = self.memory
+    for offset, byte in enumerate((value & ((1 << (size * 8)) - 1)).to_bytes(size, "little")):
+      memory = memory.set(address + offset, byte)
+    self.memory = memory
+    self.writes += 1
+
+  def push(self, value):
+    address = self.registers[self.stack_pointer] - self.address_size
+    self.registers[self.stack_pointer] = address
+    self.write_int(address, self.address_size, value)
+
+  def stack_slot(self, offset):
+    # the native word at stack pointer + offset, for the vm scratch area (pregs)
+    return self.read_int(self.registers[self.stack_pointer] + offset, self.address_size)
+
+  def set_stack_slot(self, offset, value):
+    self.write_int(self.registers[self.stack_pointer] + offset, self.address_size, value)